@@ -1,14 +1,32 @@
 import os
+import json
 import logging
-from typing import List
+from typing import Dict, Iterator, List, Tuple
+
+from langchain.text_splitter import Language
 
 from review.code_reviewer import CodeReviewer
+from review.code_reviewer import SUPPORTED_FILE_TYPES as REVIEW_FILE_TYPES
+from review.review_manifest import ReviewManifest
 from refactor.code_refactor import CodeRefactor
+from refactor.code_refactor import SUPPORTED_FILE_TYPES as REFACTOR_FILE_TYPES
 from document.document_code import DocumentCode
+from document.document_manifest import DocumentManifest
+from document.document_code import SUPPORTED_FILE_TYPES as DOCUMENT_FILE_TYPES
 from code_reviewer_configuration import CodeReviewerConfiguration
 from code_reviewer_configuration import PROVIDERS
+from utilities.llm_cache import configure_llm_cache
+from utilities.git_helper import (
+    get_changed_hunks,
+    get_blob_sha,
+    get_file_blob_sha,
+    get_tracked_files,
+    is_inside_work_tree,
+)
+from utilities.file_discovery import discover_source_files, discover_tracked_files
 
 VALID_TYPES = ["review", "refactor", "document"]
+VALID_REVIEW_MODES = ["full", "diff"]
 
 
 class ReviewRunner:
@@ -16,6 +34,9 @@ class ReviewRunner:
         self.load_arguments()
         self.set_logging_level()
         self.configuration = CodeReviewerConfiguration.from_environment()
+        self.llm_cache = configure_llm_cache(
+            self.configuration.cache_directory, self.configuration.cache_max_size_mb
+        )
 
     def main(self):
         # Lowercase the type to ensure case-insensitive comparison
@@ -29,12 +50,14 @@ class ReviewRunner:
         else:
             raise ValueError(f"Invalid type: {self.cr_type}")
 
+        if self.llm_cache is not None:
+            logging.info(
+                f"LLM cache hits: {self.llm_cache.hits}, misses: {self.llm_cache.misses}"
+            )
+
     def do_code_refactor(self):
         # Get the source code files
-        source_code_files = self.get_source_code_files()
-
-        if len(source_code_files) == 0:
-            raise ValueError("No source code files found")
+        source_code_files = self.get_source_code_files(REFACTOR_FILE_TYPES)
 
         # Get the source and target branches from arguments
         source_branch = self.source_branch
@@ -55,11 +78,8 @@ class ReviewRunner:
 
     def do_code_documentation(self):
         # Documentation functionality to be implemented
-        source_code_files = self.get_source_code_files()
+        source_code_files = self.get_source_code_files(DOCUMENT_FILE_TYPES)
 
-        if len(source_code_files) == 0:
-            raise ValueError("No source code files found")
-        
         # Code documentation requires a template or input file to be specified
         if self.document_template is None:
             raise ValueError("No document template specified")
@@ -69,28 +89,129 @@ class ReviewRunner:
         
         code_documenter = DocumentCode(self.configuration)
 
-        documentation = code_documenter.document(source_code_files, self.document_template, self.update_existing_documentation)
+        # Records where each section of the document came from, so it can be updated incrementally
+        manifest = DocumentManifest(self.document_output + ".manifest.json")
+
+        existing_contents = None
+        if self.update_existing_documentation and os.path.exists(self.document_output):
+            with open(self.document_output, "r") as f:
+                existing_contents = f.read()
+
+        # The documentation is written out as it's generated, so there's something to show even if the run
+        # dies, but to a partial file, so a failed run doesn't replace the last good document
+        partial_output = self.document_output + ".partial"
+        with open(partial_output, "w") as f:
+            code_documenter.document(
+                source_code_files,
+                self.document_template,
+                self.update_existing_documentation,
+                output=f,
+                manifest=manifest,
+                existing_contents=existing_contents,
+                # Only what was walked is removed from a persistent index
+                scope_paths=self.target_files or None,
+            )
 
-        # Write the documentation to the output file
-        with open(self.document_output, "w") as f:
-            f.write(documentation)
+        os.replace(partial_output, self.document_output)
+        manifest.save()
 
     def do_code_review(self):
         # Get the source code files
-        source_code_files = self.get_source_code_files()
+        source_code_files = self.get_source_code_files(REVIEW_FILE_TYPES)
+
+        # In diff mode, only the hunks that changed between the target and source branches are reviewed
+        changed_hunks = None
+        if self.review_mode == "diff":
+            changed_hunks = get_changed_hunks(self.target_branch, self.source_branch)
+            logging.info(
+                f"Found {sum(len(h) for h in changed_hunks.values())} changed hunks in {len(changed_hunks)} files"
+            )
 
-        if len(source_code_files) == 0:
-            raise ValueError("No source code files found")
+        # Files that haven't changed since the last run on this branch don't need to be reviewed again
+        manifest = None
+        file_hashes = {}
+        previous_comments = {}
+        files_to_review = source_code_files
+        if self.review_manifest is not None:
+            # The file list is needed more than once here, so it can't be consumed lazily
+            source_code_files = list(source_code_files)
+            manifest = ReviewManifest(
+                self.review_manifest, self.source_branch, self.get_review_settings()
+            )
+
+            files_to_review = []
+            for file in source_code_files:
+                file_hashes[file] = self.get_review_hash(file, changed_hunks)
+                comments = manifest.get_comments(file, file_hashes[file])
+                if comments is None:
+                    files_to_review.append(file)
+                else:
+                    previous_comments[file] = comments
+
+            logging.info(
+                f"Reusing previous review comments for {len(previous_comments)} unchanged files, reviewing {len(files_to_review)} files"
+            )
 
         # Initialize the CodeReviewer class and run the review
         code_reviewer = CodeReviewer(self.configuration)
-        review = code_reviewer.review(source_code_files)
+        new_comments = code_reviewer.review(files_to_review, changed_hunks)
+
+        if manifest is None:
+            review = new_comments
+        else:
+            comments_by_file = {}
+            for comment in new_comments:
+                comments_by_file.setdefault(comment.file_path, []).append(comment)
+
+            # Record what was just reviewed, unless the review of that file failed
+            for file in files_to_review:
+                if file not in code_reviewer.failed_files:
+                    manifest.update(
+                        file, file_hashes[file], comments_by_file.get(file, [])
+                    )
+            manifest.save()
+
+            # Put the previous and new comments back together, in the original file order
+            comments_by_file.update(previous_comments)
+            review = []
+            for file in source_code_files:
+                review.extend(comments_by_file.get(file, []))
 
         # Get the provider from the configuration and add the review comments to the PR
         provider = PROVIDERS[self.configuration.provider.lower()]()
         provider.add_pr_comments(review)
 
-    def get_source_code_files(self) -> List[str]:
+    def get_review_settings(self) -> str:
+        # If any of these change, previous review results can't be reused
+        llm_arguments = self.configuration.llm_arguments
+        return json.dumps(
+            [
+                self.review_mode,
+                self.target_branch if self.review_mode == "diff" else None,
+                llm_arguments.model,
+                llm_arguments.temperature,
+                llm_arguments.max_supported_tokens,
+                llm_arguments.max_completion_tokens,
+                self.configuration.include_summary,
+            ]
+        )
+
+    def get_review_hash(
+        self, file: str, changed_hunks: Dict[str, List[Tuple[int, int]]]
+    ) -> str:
+        # Use the SHA from the git index when we have it, rather than hashing the file again
+        content_hash = self.file_blob_shas.get(os.path.abspath(file), None)
+        if content_hash is None:
+            content_hash = get_file_blob_sha(file)
+
+        # In diff mode the review also depends on which lines changed
+        if changed_hunks is not None:
+            hunks = changed_hunks.get(os.path.abspath(file), [])
+            content_hash += ":" + get_blob_sha(json.dumps(hunks).encode("utf-8"))
+
+        return content_hash
+
+    def get_source_code_files(self, supported_file_types: Dict[str, Language]) -> Iterator[str]:
         # Get the paths to the source code files from arguments
         paths = self.target_files
         if paths is None or len(paths) == 0:
@@ -99,31 +220,39 @@ class ReviewRunner:
 
         logging.debug("Code Refactor Paths: " + str(paths))
 
-        # Function to recursively get all files within a directory, excluding hidden and specified directories
-        def get_files_recursively(directory):
-            files = []
-            for root, dirs, filenames in os.walk(directory):
-                # Exclude hidden directories
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
-                # Exclude specified directories
-                dirs[:] = [d for d in dirs if d not in self.exclude_directories]
-                for filename in filenames:
-                    files.append(os.path.join(root, filename))
-            return files
-
-        source_code_files = []
+        # Inside a git checkout, the index tells us which files are tracked (and their blob SHAs) in one call
+        if self.use_git_index and is_inside_work_tree():
+            self.file_blob_shas = get_tracked_files(paths)
+            logging.info(f"Found {len(self.file_blob_shas)} files tracked by git")
+
+            source_code_files = discover_tracked_files(
+                paths,
+                self.file_blob_shas,
+                exclude_directories=self.exclude_directories,
+                supported_extensions=supported_file_types.keys(),
+                max_file_size=self.max_file_size,
+            )
+        else:
+            # Files are yielded as they are found, so the pipelines can get started before the walk finishes
+            source_code_files = discover_source_files(
+                paths,
+                exclude_directories=self.exclude_directories,
+                supported_extensions=supported_file_types.keys(),
+                max_file_size=self.max_file_size,
+            )
 
-        for path in paths:
-            if os.path.isfile(path):
-                source_code_files.append(path)
-            elif os.path.isdir(path):
-                source_code_files.extend(get_files_recursively(path))
-            else:
-                logging.warning(f"Invalid path: {path}")
+        return self.ensure_source_code_files(source_code_files)
 
-        logging.debug("Source code files: " + str(source_code_files))
+    def ensure_source_code_files(self, source_code_files: Iterator[str]) -> Iterator[str]:
+        # Since the files are discovered lazily, we only know there weren't any once the walk is done
+        found = False
+        for file in source_code_files:
+            logging.debug(f"Source code file: {file}")
+            found = True
+            yield file
 
-        return source_code_files
+        if not found:
+            raise ValueError("No source code files found")
 
     def load_arguments(self):
         # Load the arguments from the environment
@@ -134,6 +263,8 @@ class ReviewRunner:
         self.target_branch = os.getenv("CR_TARGET_BRANCH", "test-branch")
         self.cr_type = os.getenv("CR_TYPE", None)
         self.target_files = os.getenv("CR_TARGET_FILES", None)
+        self.review_mode = os.getenv("CR_REVIEW_MODE", "full").lower()
+        self.review_manifest = os.getenv("CR_REVIEW_MANIFEST", None)
         
         # Documentation arguments
         self.update_existing_documentation = os.getenv("CR_UPDATE_EXISTING_DOCUMENTATION", "false").lower() == "true"
@@ -143,6 +274,15 @@ class ReviewRunner:
         # Get any directories to exclude from the target files
         self.exclude_directories = os.getenv("CR_EXCLUDE_DIRECTORIES", None)
 
+        # Files larger than this (in bytes) are skipped, 0 means no limit
+        self.max_file_size = int(os.getenv("CR_MAX_FILE_SIZE", 1024 * 1024))
+
+        # Whether to enumerate files from the git index (when in a git checkout) instead of walking the filesystem
+        self.use_git_index = os.getenv("CR_USE_GIT_INDEX", "true").lower() == "true"
+
+        # Absolute file path -> git blob SHA, for the files enumerated from the git index
+        self.file_blob_shas = {}
+
         # Split the target files string into a list
         if self.target_files is not None:
             self.target_files = self.target_files.split(",")
@@ -159,6 +299,11 @@ class ReviewRunner:
                 f"Invalid type: {self.cr_type}. Valid types are: {VALID_TYPES}"
             )
 
+        if self.review_mode not in VALID_REVIEW_MODES:
+            raise ValueError(
+                f"Invalid review mode: {self.review_mode}. Valid review modes are: {VALID_REVIEW_MODES}"
+            )
+
     def set_logging_level(self):
         # Get the numeric value of the logging level and set it
         numeric_level = getattr(logging, self.log_level.upper(), None)
@@ -16,12 +16,66 @@ PROVIDERS: Union[Dict[str, SourceControlBase], None] = {
     "file": FileIntegration,
 }
 
+# Where the embedding index of the code is kept
+VECTOR_STORES = ["numpy", "chroma", "pgvector"]
+
+
+def get_default_vector_store_collection():
+    repository = os.environ.get("GITHUB_REPOSITORY", os.environ.get("CI_PROJECT_PATH", None))
+    if repository is None:
+        return None
+
+    # Each branch keeps its own chunks, so runs on different branches don't remove each other's
+    # (GITHUB_HEAD_REF is only set, and GITHUB_REF_NAME is the merge ref, for pull requests)
+    ref = (
+        os.environ.get("GITHUB_HEAD_REF")
+        or os.environ.get("GITHUB_REF_NAME")
+        or os.environ.get("CI_MERGE_REQUEST_SOURCE_BRANCH_NAME")
+        or os.environ.get("CI_COMMIT_REF_NAME")
+        or os.environ.get("CR_SOURCE_BRANCH")
+    )
+    if not ref:
+        return repository
+
+    return f"{repository}@{ref}"
+
 
 class CodeReviewerConfiguration:
-    def __init__(self, provider, include_summary, llm_arguments) -> None:
+    def __init__(
+        self,
+        provider,
+        include_summary,
+        llm_arguments,
+        max_concurrency=4,
+        cache_directory=None,
+        cache_max_size_mb=100,
+        index_directory=None,
+        vector_store=None,
+        vector_store_connection_string=None,
+        vector_store_collection=None,
+        vector_store_index="none",
+    ) -> None:
         self.provider = provider
         self.include_summary = include_summary
         self.llm_arguments = llm_arguments
+        # Maximum number of LLM calls that are allowed to be in flight at once
+        self.max_concurrency = max_concurrency
+        # Where to keep cached LLM responses between runs (None disables the cache)
+        self.cache_directory = cache_directory
+        self.cache_max_size_mb = cache_max_size_mb
+        # Where to keep the embedding index of the code between runs (None builds a new one every run)
+        self.index_directory = index_directory
+        # numpy (in memory, for the run only), chroma (in index_directory) or pgvector (in Postgres)
+        if vector_store is None:
+            vector_store = "chroma" if index_directory else "numpy"
+        if vector_store not in VECTOR_STORES:
+            logging.error(f"Vector store {vector_store} is not supported.")
+            raise ValueError(f"Vector store {vector_store} is not supported.")
+        self.vector_store = vector_store
+        # pgvector settings- the collection keeps each repository's (and branch's) chunks apart in a shared database
+        self.vector_store_connection_string = vector_store_connection_string
+        self.vector_store_collection = vector_store_collection
+        self.vector_store_index = vector_store_index
 
     @staticmethod
     def from_json_file(file_path: str):
@@ -49,7 +103,35 @@ class CodeReviewerConfiguration:
 
         llm_arguments = LLMArguments.from_environment()
 
-        return CodeReviewerConfiguration(provider, include_summary, llm_arguments)
+        max_concurrency = int(os.environ.get("CR_MAX_CONCURRENCY", 4))
+
+        cache_directory = os.environ.get("CR_CACHE_DIRECTORY", None)
+        cache_max_size_mb = int(os.environ.get("CR_CACHE_MAX_SIZE_MB", 100))
+
+        index_directory = os.environ.get("CR_INDEX_DIRECTORY", None)
+
+        vector_store = os.environ.get("CR_VECTOR_STORE", None)
+        vector_store_connection_string = os.environ.get(
+            "CR_VECTOR_STORE_CONNECTION_STRING", os.environ.get("PGVECTOR_CONNECTION_STRING", None)
+        )
+        vector_store_collection = os.environ.get(
+            "CR_VECTOR_STORE_COLLECTION", get_default_vector_store_collection()
+        )
+        vector_store_index = os.environ.get("CR_VECTOR_STORE_INDEX", "none")
+
+        return CodeReviewerConfiguration(
+            provider,
+            include_summary,
+            llm_arguments,
+            max_concurrency,
+            cache_directory,
+            cache_max_size_mb,
+            index_directory,
+            vector_store,
+            vector_store_connection_string,
+            vector_store_collection,
+            vector_store_index,
+        )
 
     @staticmethod
     def from_dict(config: dict):
@@ -67,7 +149,31 @@ class CodeReviewerConfiguration:
 
         llm_arguments = LLMArguments.from_dict(llm_node)
 
-        return CodeReviewerConfiguration(provider, include_summary, llm_arguments)
+        max_concurrency = int(config.get("max_concurrency", 4))
+
+        cache_directory = config.get("cache_directory", None)
+        cache_max_size_mb = int(config.get("cache_max_size_mb", 100))
+
+        index_directory = config.get("index_directory", None)
+
+        vector_store = config.get("vector_store", None)
+        vector_store_connection_string = config.get("vector_store_connection_string", None)
+        vector_store_collection = config.get("vector_store_collection", None)
+        vector_store_index = config.get("vector_store_index", "none")
+
+        return CodeReviewerConfiguration(
+            provider,
+            include_summary,
+            llm_arguments,
+            max_concurrency,
+            cache_directory,
+            cache_max_size_mb,
+            index_directory,
+            vector_store,
+            vector_store_connection_string,
+            vector_store_collection,
+            vector_store_index,
+        )
 
 
 class LLMArguments:
@@ -1,32 +1,44 @@
 import logging
-from typing import List
+import os
+from typing import Dict, Iterable, List, Optional, TextIO
 
 from langchain.chains import LLMChain
-from langchain.chains import RetrievalQA
-from langchain.document_loaders import Blob
-from langchain.text_splitter import Language, RecursiveCharacterTextSplitter
-from langchain.chains.summarize import load_summarize_chain
+from langchain.docstore.document import Document
+from langchain.text_splitter import Language
 from langchain.chains.question_answering import load_qa_chain
-from langchain.document_loaders.parsers import LanguageParser
 from langchain.chat_models import ChatOpenAI
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
 
 
 from code_reviewer_configuration import CodeReviewerConfiguration
 from document.prompts import SUMMARIZE_PROMPT, COMBINE_PROMPT, MAP_REDUCE_COMBINE_PROMPT
-from utilities.token_helper import simple_get_tokens_for_message
+from document.document_manifest import DocumentManifest
+from document.document_template import parse_template, split_document
+from document.summary_tree import SummaryCache, SummaryTree, get_content_hash
+from utilities.token_helper import get_tokenizer
+from utilities.code_splitter import CodeSplitter
 from utilities.open_ai import get_openai_api_key
+from utilities.chunk_store import ChunkStore
+from utilities.concurrency import ordered_concurrent_map
 
 # Supported file types for documenting
 SUPPORTED_FILE_TYPES = {"py": Language.PYTHON, "cpp": Language.CPP}
 
+# Tokens the stuff chain adds between each summary
+STUFF_SEPARATOR_TOKENS = 2
+
+
+def get_source_hashes(documents: List[Document]) -> List[str]:
+    return [d.metadata["content_hash"] for d in documents if "content_hash" in d.metadata]
+
 
 class DocumentCode:
     def __init__(self, configuration: CodeReviewerConfiguration):
         self.configuration = configuration
         self.llm_arguments_configuration = configuration.llm_arguments
 
+        # Shared tokenizer for the configured model (loaded once, with memoized counts)
+        self.tokenizer = get_tokenizer(self.llm_arguments_configuration.model)
+
         # Initialize language model
         self.llm = ChatOpenAI(
             model=self.llm_arguments_configuration.model,
@@ -35,21 +47,29 @@ class DocumentCode:
             max_tokens=self.llm_arguments_configuration.max_completion_tokens,
         )
 
-        # Initialize various documentation chains
+        # Initialize various documentation chains- these build the summary tree
         self.map_chain = LLMChain(llm=self.llm, prompt=SUMMARIZE_PROMPT)
-        self.summarize_chain = load_summarize_chain(
-            self.llm,
-            chain_type="map_reduce",
-            map_prompt=SUMMARIZE_PROMPT,
-            combine_prompt=COMBINE_PROMPT,
-            map_reduce_document_variable_name="code",
-            combine_document_variable_name="text",
-        )
 
-        self.qa_chain = load_qa_chain(llm=self.llm, chain_type="map_reduce", combine_prompt=MAP_REDUCE_COMBINE_PROMPT)
+        self.combine_chain = LLMChain(llm=self.llm, prompt=COMBINE_PROMPT)
+
+        # Questions are answered against the (already summarized) summary tree, so the retrieved
+        # summaries just need stuffing into the prompt (as many as fit), rather than summarizing all over again
+        self.qa_chain = load_qa_chain(
+            llm=self.llm,
+            chain_type="stuff",
+            prompt=MAP_REDUCE_COMBINE_PROMPT,
+            document_variable_name="summaries",
+        )
 
     def document(
-        self, target_files: List[str], document_template: str, existing_document: bool
+        self,
+        target_files: Iterable[str],
+        document_template: str,
+        existing_document: bool,
+        output: Optional[TextIO] = None,
+        manifest: Optional[DocumentManifest] = None,
+        existing_contents: Optional[str] = None,
+        scope_paths: Optional[List[str]] = None,
     ):
         # Iterate over the files and load each of them if they are in the supported file types
         documents = []
@@ -63,82 +83,233 @@ class DocumentCode:
             else:
                 logging.warning(f"Skipping unsupported file type: {file_type}")
 
-        datastore = Chroma.from_documents(
-            documents, OpenAIEmbeddings(openai_api_key=get_openai_api_key())
+        # Summarize everything (chunks, files and packages) once, up front
+        summaries = self.get_summary_tree().build(documents)
+
+        # Documentation actually searches the summaries, so this is where the embeddings get built
+        datastore = ChunkStore(summaries, scope_paths=scope_paths).as_vector_store(
+            configuration=self.configuration
         )
 
-        retrieval_qa = RetrievalQA(
-            combine_documents_chain=self.qa_chain,
-            retriever=datastore.as_retriever(
-                # Fetch more documents for the MMR algorithm to consider, but only return the top 10
-                search_type="mmr", search_kwargs={"k": 10, "fetch_k": 50}
-            ),
+        retriever = datastore.as_retriever(
+            # Fetch more documents for the MMR algorithm to consider, but only return the top 10
+            search_type="mmr", search_kwargs={"k": 10, "fetch_k": 50}
         )
-        # summary = self.summarize_chain.run(documents)
-
-        if existing_document:
-            # If we are updating existing documentation, we need to do the following:
-            # 1. Load the existing documentation
-            # 2. Split by sections / or at least paragraphs and sentences
-            # 3. Analyze the existing chunks of documentation, including the purpose of the various chunks
-            # 4. Do "fact checking" on the existing documentation using the loaded documents in the data store
-            # 5. Add or update the existing documentation with what we find
-            raise NotImplementedError(
-                "Updating existing documentation is not yet implemented"
+
+        logging.info(f"Loading document template from: {document_template}")
+
+        with open(document_template, "r") as f:
+            template_contents = f.read()
+
+        if existing_document and (existing_contents is None or manifest is None):
+            logging.warning(
+                "There is no existing document (or no manifest for it), so it will be generated from scratch"
             )
-        else:
-            logging.info(f"Loading document template from: {document_template}")
+            existing_contents = None
 
-            # This will just return a list of the "[Prompt] ..." strings in the template
-            with open(document_template, "r") as f:
-                template_contents = f.read()
+        return self.render_template(
+            template_contents,
+            retriever,
+            output,
+            manifest,
+            existing_contents if existing_document else None,
+        )
 
-            prompt_strings = self.get_template_prompts(template_contents)
+    def get_summary_tree(self) -> SummaryTree:
+        cache_path = None
+        if self.configuration.cache_directory:
+            cache_path = os.path.join(self.configuration.cache_directory, "summaries.json")
 
-            # Iterate over the prompts, and answer them using the loaded documents
-            for prompt in prompt_strings:
-                logging.info(f"Prompt: {prompt}")
+        # Room for the summaries being combined, after the prompt and the completion
+        max_combine_tokens = (
+            self.llm_arguments_configuration.max_supported_tokens
+            - self.llm_arguments_configuration.max_completion_tokens
+            - self.tokenizer.count_tokens(COMBINE_PROMPT.template)
+        )
 
-                result = retrieval_qa.run(prompt.lower().replace("[prompt]", "").strip())
+        return SummaryTree(
+            self.map_chain,
+            self.combine_chain,
+            SummaryCache(cache_path),
+            self.tokenizer.count_tokens_batch,
+            max_combine_tokens,
+            self.configuration.max_concurrency,
+            # Summaries from a different model aren't the same summaries
+            cache_salt=f"{self.llm_arguments_configuration.model}:{self.llm_arguments_configuration.temperature}",
+        )
 
-                # Replace the prompt in the template with the result
-                template_contents = template_contents.replace(prompt, result)
+    def render_template(
+        self,
+        template_contents: str,
+        retriever,
+        output: Optional[TextIO] = None,
+        manifest: Optional[DocumentManifest] = None,
+        existing_contents: Optional[str] = None,
+    ) -> str:
+        """Fill in the prompts in the template, writing each piece to output as soon as it's ready.
 
-            return template_contents
+        With existing_contents (the previously generated document) and its manifest, the sections
+        that would be answered from exactly the same summaries as before are kept from the existing
+        document, and only the rest are regenerated.  The manifest is updated to describe the new
+        document either way.
+        """
+        segments = parse_template(template_contents)
+        template_hash = get_content_hash(template_contents)
 
+        # The content hashes of the summaries each answer came from, by question
+        sources: Dict[str, List[str]] = {}
 
-    def get_template_prompts(self, template_contents: str):
-        
+        # The summaries retrieved for each question, so they're only retrieved once
+        retrieved: Dict[str, List[Document]] = {}
 
-        # Split on newline
-        lines = template_contents.split("\n")
+        # Sections of the existing document that can be kept, by segment index
+        kept_sections: Dict[int, str] = {}
+        if existing_contents is not None and manifest is not None:
+            existing_sections = split_document(
+                segments,
+                existing_contents,
+                manifest.segment_lengths if manifest.template_hash == template_hash else None,
+            )
 
-        # Find all of the lines that start with "[Prompt]"
-        prompt_strings = [line for line in lines if line.startswith("[Prompt]")]
-        logging.info(f"Found {len(prompt_strings)} prompts in the template")
+            # Retrieval is cheap next to answering (the query embeddings are cached), and it's the only
+            # way to notice new or changed code that an answer would now be based on
+            questions = list(
+                dict.fromkeys(
+                    segments[i].question
+                    for i in existing_sections
+                    if manifest.get_sources(segments[i].question) is not None
+                )
+            )
+            for result in ordered_concurrent_map(
+                lambda q: self.get_relevant_summaries(retriever, q),
+                questions,
+                self.configuration.max_concurrency,
+            ):
+                if result.succeeded:
+                    retrieved[result.item] = result.result
+                else:
+                    logging.warning(f"Failed to retrieve summaries for '{result.item}': {result.error}")
 
-        return prompt_strings
+            for i, text in existing_sections.items():
+                question = segments[i].question
+                if question in retrieved and set(get_source_hashes(retrieved[question])) == set(
+                    manifest.get_sources(question)
+                ):
+                    kept_sections[i] = text
+                    sources[question] = manifest.get_sources(question)
 
-    def load_document(self, file_path: str, language: Language):
-        # Load the file
-        # with open(file_path, "r") as f:
-        #     file_contents = f.read()
+            logging.info(
+                f"Keeping {len(kept_sections)} of {len([s for s in segments if s.is_prompt])} sections of the existing document"
+            )
+
+        # The same question can show up more than once in a template, but only needs answering once
+        unique_questions = list(
+            dict.fromkeys(
+                s.question for i, s in enumerate(segments) if s.is_prompt and i not in kept_sections
+            )
+        )
+        logging.info(
+            f"Answering {len(unique_questions)} unique prompts, {self.configuration.max_concurrency} at a time"
+        )
 
-        parser = LanguageParser(language=language)
+        def answer(question: str):
+            documents = retrieved.get(question)
+            if documents is None:
+                documents = self.get_relevant_summaries(retriever, question)
 
-        documents = parser.parse(Blob(path=file_path))
+            return (
+                self.qa_chain.run(input_documents=documents, question=question),
+                get_source_hashes(documents),
+            )
+
+        # Answers come back in the order the questions first appear in the template, so by the time
+        # we reach a prompt, everything before it can already have been written out
+        results = ordered_concurrent_map(answer, unique_questions, self.configuration.max_concurrency)
+
+        answers = {}
+        rendered = []
+        for i, segment in enumerate(segments):
+            text = segment.text
+
+            if i in kept_sections:
+                text = kept_sections[i]
+            elif segment.is_prompt:
+                while segment.question not in answers:
+                    result = next(results)
+                    if result.succeeded:
+                        answers[result.item], sources[result.item] = result.result
+                    else:
+                        # The prompt is left in the template, so it's obvious what's missing
+                        logging.error(f"Failed to answer prompt '{result.item}': {result.error}")
+                        answers[result.item] = None
+
+                if answers[segment.question] is not None:
+                    text = answers[segment.question]
+
+            rendered.append(text)
 
-        # Split the code into chunks
-        code_splitter = RecursiveCharacterTextSplitter.from_language(
-            language=language,
-            chunk_size=500,
-            chunk_overlap=0,
-            keep_separator=True,
-            add_start_index=True,
-            length_function=simple_get_tokens_for_message,
+            if output is not None:
+                output.write(text)
+                output.flush()
+
+        if manifest is not None:
+            manifest.update(template_hash, [len(text) for text in rendered], sources)
+
+        return "".join(rendered)
+
+    def get_relevant_summaries(self, retriever, question: str) -> List[Document]:
+        """Retrieve the summaries for a question, keeping only as many as fit in the prompt alongside it.
+
+        The summaries come back most relevant first, so the ones that don't fit are the least relevant.
+        """
+        documents = retriever.get_relevant_documents(question)
+
+        # Room for the summaries, after the prompt, the question and the completion
+        max_tokens = (
+            self.llm_arguments_configuration.max_supported_tokens
+            - self.llm_arguments_configuration.max_completion_tokens
+            - self.tokenizer.count_tokens(MAP_REDUCE_COMBINE_PROMPT.template)
+            - self.tokenizer.count_tokens(question)
         )
 
+        relevant = []
+        total_tokens = 0
+        for document, tokens in zip(
+            documents, self.tokenizer.count_tokens_batch([d.page_content for d in documents])
+        ):
+            # The stuff chain puts a blank line between each summary
+            tokens += STUFF_SEPARATOR_TOKENS
+            if total_tokens + tokens > max_tokens:
+                break
+
+            relevant.append(document)
+            total_tokens += tokens
+
+        if len(relevant) == 0 and len(documents) > 0 and max_tokens > STUFF_SEPARATOR_TOKENS:
+            # Even the most relevant summary is too big, so use as much of it as fits
+            truncated = self.tokenizer.encoding.decode(
+                self.tokenizer.encode(documents[0].page_content)[: max_tokens - STUFF_SEPARATOR_TOKENS]
+            )
+            relevant.append(Document(page_content=truncated, metadata=documents[0].metadata))
+
+        if len(relevant) < len(documents):
+            logging.debug(
+                f"Using {len(relevant)} of {len(documents)} summaries for '{question}' to fit in {max_tokens} tokens"
+            )
+
+        return relevant
+
+    def load_document(self, file_path: str, language: Language):
+        # Load the file
+        with open(file_path, "r") as f:
+            file_contents = f.read()
+
+        # Split the code into chunks of whole definitions
+        code_splitter = CodeSplitter(language, 500, self.tokenizer)
+
         # Create documents from the chunks
-        split_documents = code_splitter.split_documents(documents)
+        split_documents = code_splitter.create_documents(
+            [file_contents], [{"source": file_path, "language": language}]
+        )
 
         return split_documents
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+
+class DocumentManifest:
+    """Remembers how a generated document was put together, so it can be updated incrementally.
+
+    For each prompt (by question), it keeps the content hashes of the summaries the answer was
+    generated from.  If the question would still be answered from exactly those summaries, the
+    answer in the existing document can be kept as it is.  It also keeps the length of every segment of the rendered document, so the
+    document can be split back into its sections exactly.
+
+    The manifest is stored as JSON next to the document:
+    {"template_hash": <hash>, "segment_lengths": [...], "sections": {<question>: {"sources": [<hash>, ...]}}}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.template_hash: Optional[str] = None
+        self.segment_lengths: Optional[List[int]] = None
+        self.sections: Dict[str, dict] = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    manifest = json.load(f)
+                self.template_hash = manifest.get("template_hash", None)
+                self.segment_lengths = manifest.get("segment_lengths", None)
+                self.sections = manifest.get("sections", {})
+            except (OSError, ValueError) as e:
+                logging.warning(
+                    f"Could not read the document manifest at {self.path}, starting fresh: {e}"
+                )
+
+    def get_sources(self, question: str) -> Optional[List[str]]:
+        """Get the content hashes the answer to a question was generated from, or None if it's unknown."""
+        section = self.sections.get(question, None)
+        if section is None:
+            return None
+
+        return section["sources"]
+
+    def update(
+        self,
+        template_hash: str,
+        segment_lengths: List[int],
+        sources: Dict[str, List[str]],
+    ):
+        # Replaces everything, so questions that are no longer in the template are dropped
+        self.template_hash = template_hash
+        self.segment_lengths = segment_lengths
+        self.sections = {question: {"sources": s} for question, s in sources.items()}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so a crash can't leave a half-written manifest behind
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(
+                {
+                    "template_hash": self.template_hash,
+                    "segment_lengths": self.segment_lengths,
+                    "sections": self.sections,
+                },
+                f,
+            )
+
+        os.replace(temporary_path, self.path)
+
+        logging.info(f"Saved document manifest with {len(self.sections)} sections to {self.path}")
@@ -0,0 +1,107 @@
+import re
+from typing import Dict, List, Optional
+
+PROMPT_PREFIX = "[Prompt]"
+
+
+class TemplateSegment:
+    """A piece of a documentation template- either literal text, or a prompt to be answered."""
+
+    def __init__(self, text: str, question: Optional[str] = None):
+        # For prompts, this is the original "[Prompt] ..." line, without its line ending
+        self.text = text
+        self.question = question
+
+    @property
+    def is_prompt(self) -> bool:
+        return self.question is not None
+
+
+def get_prompt_question(prompt: str) -> str:
+    return prompt.lower().replace(PROMPT_PREFIX.lower(), "").strip()
+
+
+def parse_template(template_contents: str) -> List[TemplateSegment]:
+    """Split a template into literal and prompt segments, in a single pass.
+
+    Lines starting with "[Prompt]" are prompts, and everything between them (including the
+    line endings of the prompt lines) is kept as literal text, so joining the text of all of
+    the segments gives back the original template.
+    """
+    segments: List[TemplateSegment] = []
+    literal_lines: List[str] = []
+
+    # Only newlines end lines- splitlines() would also split on form feeds and other separators
+    for line in re.split(r"(?<=\n)", template_contents):
+        if line == "":
+            continue
+        if not line.startswith(PROMPT_PREFIX):
+            literal_lines.append(line)
+            continue
+
+        if len(literal_lines) > 0:
+            segments.append(TemplateSegment("".join(literal_lines)))
+
+        prompt = line.rstrip("\r\n")
+        segments.append(TemplateSegment(prompt, get_prompt_question(prompt)))
+
+        literal_lines = [line[len(prompt) :]] if len(line) > len(prompt) else []
+
+    if len(literal_lines) > 0:
+        segments.append(TemplateSegment("".join(literal_lines)))
+
+    return segments
+
+
+def split_document(
+    segments: List[TemplateSegment],
+    document_contents: str,
+    segment_lengths: Optional[List[int]] = None,
+) -> Dict[int, str]:
+    """Split a document rendered from segments back into the text that each prompt was replaced with.
+
+    Returns the text for each prompt, keyed by the index of its segment.  segment_lengths (the
+    length of every segment when the document was rendered) splits it exactly, as long as the
+    literal text is still where it was.  Otherwise (e.g. the document was edited by hand), each
+    literal is searched for in turn, and the prompts next to a literal that can't be found are left out.
+    """
+    if segment_lengths is not None and len(segment_lengths) == len(segments):
+        sections = {}
+        offset = 0
+        for i, (segment, length) in enumerate(zip(segments, segment_lengths)):
+            text = document_contents[offset : offset + length]
+            if segment.is_prompt:
+                sections[i] = text
+            elif text != segment.text:
+                break
+            offset += length
+        else:
+            if offset == len(document_contents):
+                return sections
+
+    sections = {}
+    offset = 0
+    # Whether the previous literal was found, i.e. whether we know where the prompt after it starts
+    found_previous = True
+    for i, segment in enumerate(segments):
+        if segment.is_prompt:
+            continue
+
+        start = document_contents.find(segment.text, offset)
+        if start == -1:
+            # The prompts on either side of this literal can't be told apart, so they're left out
+            found_previous = False
+            continue
+
+        # Whatever is between this literal and the previous one belongs to the prompt in between
+        if i > 0 and segments[i - 1].is_prompt and found_previous:
+            sections[i - 1] = document_contents[offset:start]
+
+        offset = start + len(segment.text)
+        found_previous = True
+
+    # A prompt at the very end of the template runs to the end of the document
+    if len(segments) > 0 and segments[-1].is_prompt and found_previous:
+        sections[len(segments) - 1] = document_contents[offset:]
+
+    return sections
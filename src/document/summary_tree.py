@@ -0,0 +1,245 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from langchain.chains import LLMChain
+from langchain.docstore.document import Document
+
+from utilities.concurrency import ordered_concurrent_map
+
+# The levels of the tree, from the bottom up
+CHUNK_LEVEL = "chunk"
+FILE_LEVEL = "file"
+PACKAGE_LEVEL = "package"
+
+
+def get_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """Summaries keyed by a hash of what was summarized, optionally kept in a JSON file between runs."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.summaries: Dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.path is not None and os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.summaries = json.load(f).get("summaries", {})
+            except (OSError, ValueError) as e:
+                logging.warning(f"Could not read the summary cache at {self.path}, starting fresh: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self.summaries.get(key, None)
+            if summary is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return summary
+
+    def set(self, key: str, summary: str):
+        with self._lock:
+            self.summaries[key] = summary
+
+    def save(self, keep_keys: Optional[set] = None):
+        """Write the cache out, keeping only keep_keys (when given) so it doesn't grow forever."""
+        if self.path is None:
+            return
+
+        with self._lock:
+            if keep_keys is not None:
+                self.summaries = {k: v for k, v in self.summaries.items() if k in keep_keys}
+            summaries = dict(self.summaries)
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so a crash can't leave a half-written cache behind
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"summaries": summaries}, f)
+
+        os.replace(temporary_path, self.path)
+
+
+class SummaryTree:
+    """Summarizes code once per run as a tree: each chunk, then each file, then each package (directory).
+
+    Every summary is cached by a hash of its input (the chunk's code, or the summaries being
+    combined), so only the parts of the tree above code that changed need the LLM again.
+    The summaries at every level come back as documents, which questions can then be answered
+    against at whatever granularity fits them best.
+    """
+
+    def __init__(
+        self,
+        map_chain: LLMChain,
+        combine_chain: LLMChain,
+        cache: SummaryCache,
+        token_counter: Callable[[List[str]], List[int]],
+        max_combine_tokens: int,
+        max_concurrency: int,
+        cache_salt: str = "",
+    ):
+        # map_chain summarizes "code", combine_chain combines the summaries in "text"
+        self.map_chain = map_chain
+        self.combine_chain = combine_chain
+        self.cache = cache
+        self.token_counter = token_counter
+        self.max_combine_tokens = max_combine_tokens
+        self.max_concurrency = max_concurrency
+        # Anything else that changes the summaries (e.g. the model)
+        self.cache_salt = cache_salt
+        self.used_keys = set()
+
+    def build(self, documents: List[Document]) -> List[Document]:
+        # Chunks
+        chunk_summaries = self._summarize_all(
+            [("map", d.page_content) for d in documents]
+        )
+
+        # Each summary records the content hash of the code under it (content_hash), so anything
+        # generated from a summary can tell when that code has changed
+        summaries = [
+            Document(
+                page_content=summary,
+                metadata={**d.metadata, "level": CHUNK_LEVEL, "content_hash": get_content_hash(d.page_content)},
+            )
+            for d, summary in zip(documents, chunk_summaries)
+            if summary is not None
+        ]
+
+        # Files, from their chunks
+        files: Dict[str, List[str]] = {}
+        file_hashes: Dict[str, List[str]] = {}
+        for d, summary in zip(documents, chunk_summaries):
+            if summary is not None:
+                files.setdefault(d.metadata["source"], []).append(summary)
+                file_hashes.setdefault(d.metadata["source"], []).append(
+                    get_content_hash(d.page_content)
+                )
+
+        file_summaries = self._combine_groups(files)
+        summaries.extend(
+            Document(
+                page_content=summary,
+                metadata={
+                    "source": source,
+                    "level": FILE_LEVEL,
+                    "content_hash": get_content_hash("\n".join(file_hashes[source])),
+                },
+            )
+            for source, summary in file_summaries.items()
+            # A single chunk file already has its summary
+            if len(files[source]) > 1
+        )
+
+        # Packages, from their files
+        packages: Dict[str, List[str]] = {}
+        package_hashes: Dict[str, List[str]] = {}
+        for source, summary in file_summaries.items():
+            package = os.path.dirname(source) or "."
+            packages.setdefault(package, []).append(summary)
+            package_hashes.setdefault(package, []).extend(file_hashes[source])
+
+        package_summaries = self._combine_groups(packages)
+        summaries.extend(
+            Document(
+                page_content=summary,
+                metadata={
+                    "source": package,
+                    "level": PACKAGE_LEVEL,
+                    "content_hash": get_content_hash("\n".join(package_hashes[package])),
+                },
+            )
+            for package, summary in package_summaries.items()
+            if len(packages[package]) > 1
+        )
+
+        self.cache.save(self.used_keys)
+
+        logging.info(
+            f"Summary tree has {len(summaries)} summaries ({self.cache.hits} cached, {self.cache.misses} generated)"
+        )
+
+        return summaries
+
+    def _combine_groups(self, groups: Dict[str, List[str]]) -> Dict[str, str]:
+        names = list(groups)
+        results = ordered_concurrent_map(
+            lambda name: self._combine(groups[name]), names, self.max_concurrency
+        )
+
+        combined = {}
+        for name, result in zip(names, results):
+            if result.succeeded:
+                combined[name] = result.result
+            else:
+                logging.error(f"Failed to summarize {name}: {result.error}")
+
+        return combined
+
+    def _combine(self, summaries: List[str]) -> str:
+        # Combine as many summaries as fit at once, and keep going until there is only one
+        while len(summaries) > 1:
+            groups = self._group_by_tokens(summaries)
+            if len(groups) == len(summaries):
+                # Nothing can be combined without going over the limit, so just do pairs
+                groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+
+            summaries = [self._summarize("combine", "\n\n".join(group)) for group in groups]
+
+        return summaries[0]
+
+    def _group_by_tokens(self, summaries: List[str]) -> List[List[str]]:
+        groups = [[]]
+        group_tokens = 0
+        for summary, tokens in zip(summaries, self.token_counter(summaries)):
+            if len(groups[-1]) > 0 and group_tokens + tokens > self.max_combine_tokens:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(summary)
+            group_tokens += tokens
+
+        return groups
+
+    def _summarize_all(self, inputs: List[tuple]) -> List[Optional[str]]:
+        # Identical chunks (e.g. copy-pasted code) only get summarized once
+        unique_inputs = list(dict.fromkeys(inputs))
+
+        results = {}
+        for result in ordered_concurrent_map(
+            lambda i: self._summarize(*i), unique_inputs, self.max_concurrency
+        ):
+            if result.succeeded:
+                results[result.item] = result.result
+            else:
+                logging.error(f"Failed to summarize a chunk: {result.error}")
+
+        return [results.get(i, None) for i in inputs]
+
+    def _summarize(self, kind: str, text: str) -> str:
+        key = hashlib.sha256(
+            json.dumps([self.cache_salt, kind, text]).encode("utf-8")
+        ).hexdigest()
+        self.used_keys.add(key)
+
+        summary = self.cache.get(key)
+        if summary is None:
+            if kind == "map":
+                summary = self.map_chain.run(code=text)
+            else:
+                summary = self.combine_chain.run(text=text)
+            self.cache.set(key, summary)
+
+        return summary
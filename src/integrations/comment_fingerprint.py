@@ -0,0 +1,25 @@
+import hashlib
+from typing import Optional, Tuple
+
+CommentFingerprint = Tuple[Optional[str], Optional[int], Optional[int], str]
+
+
+def normalize_comment_text(text: str) -> str:
+    # Whitespace and case differences (e.g. from the server re-formatting markdown) don't make a comment new
+    return " ".join(text.split()).lower()
+
+
+def get_comment_fingerprint(
+    path: Optional[str], start: Optional[int], end: Optional[int], text: str
+) -> CommentFingerprint:
+    """Identify a comment by where it is and what it says, so that it is only ever posted once.
+
+    path should be relative to the repository root, and start/end are the lines the comment is
+    attached to on the server (None for comments that aren't attached to a file or line).
+    """
+    if end is None:
+        end = start
+
+    text_hash = hashlib.sha256(normalize_comment_text(text).encode("utf-8")).hexdigest()
+
+    return path, start, end, text_hash
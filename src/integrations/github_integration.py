@@ -1,16 +1,25 @@
 import logging
 import os
 import sys
-from typing import List
-from github import Github, Auth, InputGitTreeElement
+import time
+from typing import List, Optional, Set
+from github import Github, Auth, GithubException, InputGitTreeElement
 
 # Append the parent directory to the system path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
 
+from integrations.comment_fingerprint import CommentFingerprint, get_comment_fingerprint
 from integrations.source_control_base import SourceControlBase, CodeComment
+from utilities.concurrency import run_concurrently
+from utilities.git_helper import get_blob_sha, parse_hunk_ranges
+from utilities.hunk_index import HunkIndex
+from utilities.retry import call_with_retry
 
 REGULAR_FILE = "100644"
 
+# Delimiter for multi-line values written to $GITHUB_OUTPUT
+OUTPUT_DELIMITER = "CODE_REVIEW_SUMMARY_EOF"
+
 
 class GitHubIntegration(SourceControlBase):
     def __init__(self):
@@ -20,8 +29,22 @@ class GitHubIntegration(SourceControlBase):
             raise ValueError("GITHUB_TOKEN is not set in the environment")
 
         # Authenticate with Github using the token
+        # GITHUB_API_URL is set by GitHub Actions, and allows pointing at GitHub Enterprise (or a local stand-in server)
         self.auth = Auth.Token(self.github_token)
-        self.github = Github(auth=self.auth)
+
+        # The number of blobs uploaded at once when committing, which the connection pool needs to match
+        self.max_upload_concurrency = int(os.getenv("CR_GITHUB_UPLOAD_CONCURRENCY", 8))
+
+        self.github = Github(
+            auth=self.auth,
+            base_url=os.getenv("GITHUB_API_URL", "https://api.github.com"),
+            pool_size=self.max_upload_concurrency,
+        )
+
+        # GitHub limits how much can go into a single review, so larger reviews are split up
+        self.max_comments_per_review = int(
+            os.getenv("CR_GITHUB_MAX_COMMENTS_PER_REVIEW", 50)
+        )
 
     def commit_changes(
         self, source_branch, target_branch, commit_message, metadatas: List[dict]
@@ -35,28 +58,60 @@ class GitHubIntegration(SourceControlBase):
         # This call ensures the branch is created
         commit_branch = self._create_branch(repository, source_branch, target_branch)
 
-        # Get the base tree
-        base_tree = repo.get_git_tree(sha=source_branch)
+        # Get the base commit and its (full) tree, so we know what is already there
+        parent_commit = repo.get_git_commit(repo.get_branch(source_branch).commit.sha)
+        base_tree = repo.get_git_tree(sha=parent_commit.tree.sha, recursive=True)
+        base_blob_shas = {
+            element.path: element.sha
+            for element in base_tree.tree
+            if element.type == "blob"
+        }
 
-        # Create a new tree with the changes
-        tree_elements = []
+        # Files that come out of the refactor byte-for-byte the same don't need to be uploaded
+        # Does the encoding need to match the source?  Probably should find out and adjust this if necessary.
+        changed_files = []
         for metadata in metadatas:
-            path = metadata["file_path"]
-            code = metadata["code"]
-            # Does the encoding need to match the source?  Probably should find out and adjust this if necessary.
-            blob = repo.create_git_blob(content=code, encoding="utf-8")
-            git_tree_element = InputGitTreeElement(
-                path=path, mode=REGULAR_FILE, type="blob", sha=blob.sha
+            path = self._get_repository_path(metadata["file_path"])
+            content = metadata["code"].encode("utf-8")
+            if base_blob_shas.get(path) == get_blob_sha(content):
+                logging.debug(f"{path} is unchanged, skipping it")
+                continue
+            changed_files.append((path, metadata["code"]))
+
+        if len(changed_files) == 0:
+            logging.info("No files were changed, nothing to commit")
+            return
+
+        logging.info(
+            f"Uploading {len(changed_files)} changed files ({len(metadatas) - len(changed_files)} unchanged)"
+        )
+
+        # Upload the blobs in parallel- the connection pool is sized to match
+        results = run_concurrently(
+            lambda f: repo.create_git_blob(content=f[1], encoding="utf-8"),
+            changed_files,
+            self.max_upload_concurrency,
+        )
+
+        failures = [r for r in results if not r.succeeded]
+        if len(failures) > 0:
+            raise failures[0].error
+
+        # Create a new tree with the changes
+        tree_elements = [
+            InputGitTreeElement(
+                path=result.item[0], mode=REGULAR_FILE, type="blob", sha=result.result.sha
             )
-            tree_elements.append(git_tree_element)
+            for result in results
+        ]
 
         new_tree = repo.create_git_tree(tree_elements, base_tree)
 
         # Create the commit
         new_commit = repo.create_git_commit(
             message=commit_message,
-            tree=repo.get_git_tree(sha=new_tree.sha),
-            parents=[repo.get_git_commit(repo.get_branch(source_branch).commit.sha)],
+            tree=new_tree,
+            parents=[parent_commit],
         )
 
         # Push the commit to the new branch by editing the reference
@@ -90,7 +145,7 @@ class GitHubIntegration(SourceControlBase):
 
     def add_pr_comments(self, comments: List[CodeComment]):
         github_output = os.getenv("GITHUB_OUTPUT", None)
-        logging.debug("GH Output: " + github_output)
+        logging.debug(f"GH Output: {github_output}")
 
         github_repo = os.getenv("GITHUB_REPOSITORY")
         github_pr = os.getenv("GITHUB_PR")
@@ -102,30 +157,185 @@ class GitHubIntegration(SourceControlBase):
 
         pr = self.github.get_repo(github_repo).get_pull(int(github_pr))
 
+        # GitHub rejects inline comments on lines that aren't part of the diff, so find out
+        # what those lines are before posting anything
+        hunk_index = self._get_hunk_index(pr)
+
+        # Comments inside the diff become inline comments, the rest go into the summary
+        review_comments = []
+        general_comments = []
+        outside_diff_comments = []
         for comment in comments:
-            # Create a comment on a pull request
-            # https://docs.github.com/en/rest/reference/pulls#create-a-review-for-a-pull-request
-
-            pr.create_review(
-                body=comment.comment_in_markdown,
-                event="COMMENT",
-                comments=[
-                    {
-                        "path": comment.file_path,
-                        "start_line": comment.starting_line_number,
-                        "line": comment.ending_line_number,
-                        "body": comment.comment_in_markdown,
-                        "side": "RIGHT",
-                    }
-                ],
+            if comment.start is None:
+                general_comments.append(comment)
+            elif (
+                hunk_index.find_hunk(
+                    self._get_repository_path(comment.file_path),
+                    comment.start,
+                    comment.end,
+                )
+                is None
+            ):
+                outside_diff_comments.append(comment)
+            else:
+                review_comments.append(self._get_review_comment(comment))
+
+        if len(outside_diff_comments) > 0:
+            logging.info(
+                f"{len(outside_diff_comments)} comments are outside of the pull request diff, and will be added to the summary"
+            )
+
+        summary = self._get_review_summary(
+            len(comments), general_comments, outside_diff_comments
+        )
+
+        # Anything already on the PR (e.g. from a previous run of this job) isn't posted again
+        existing_fingerprints = self._get_existing_fingerprints(pr)
+        new_review_comments = [
+            c
+            for c in review_comments
+            if self._get_review_comment_fingerprint(c) not in existing_fingerprints
+        ]
+        post_summary = (
+            get_comment_fingerprint(None, None, None, summary) not in existing_fingerprints
+        )
+
+        logging.info(
+            f"{len(new_review_comments)} of {len(review_comments)} inline comments are new"
+        )
+
+        if len(new_review_comments) == 0 and not post_summary:
+            logging.info("The review is already on the pull request, nothing to post")
+            batches = []
+        else:
+            # Submit everything as a few pull request reviews, rather than one per comment
+            # See: https://docs.github.com/en/rest/pulls/reviews#create-a-review-for-a-pull-request
+            batches = [
+                new_review_comments[i : i + self.max_comments_per_review]
+                for i in range(0, len(new_review_comments), self.max_comments_per_review)
+            ] or [[]]
+
+        for i, batch in enumerate(batches, start=1):
+            if i > 1:
+                body = f"Code review continued (part {i} of {len(batches)})"
+            elif post_summary:
+                body = summary
+            else:
+                body = f"Code review found {len(new_review_comments)} new comments."
+
+            logging.info(
+                f"Submitting review {i} of {len(batches)} with {len(batch)} comments"
+            )
+            call_with_retry(
+                lambda: pr.create_review(body=body, event="COMMENT", comments=batch),
+                get_github_retry_delay,
             )
 
         # Write the output to the $GITHUB_OUTPUT environment file
-        # See: https://docs.github.com/en/actions/creating-actions/creating-a-docker-container-action?learn=create_actions&learnProduct=actions#writing-the-action-code
-        # Eventually this summary should be output as markdown and then added to the PR
+        # See: https://docs.github.com/en/actions/using-workflows/workflow-commands-for-github-actions#multiline-strings
         if github_output:
             with open(github_output, "a") as f:
-                f.write(f"review_summary={summary}")
+                f.write(f"review_summary<<{OUTPUT_DELIMITER}\n{summary}\n{OUTPUT_DELIMITER}\n")
+
+    def _get_review_comment(self, comment: CodeComment) -> dict:
+        review_comment = {
+            "path": self._get_repository_path(comment.file_path),
+            "line": comment.end if comment.end is not None else comment.start,
+            "body": comment.comment,
+            "side": "RIGHT",
+        }
+
+        # Multi-line comments need the starting line as well
+        if review_comment["line"] > comment.start:
+            review_comment["start_line"] = comment.start
+            review_comment["start_side"] = "RIGHT"
+
+        return review_comment
+
+    def _get_existing_fingerprints(self, pr) -> Set[CommentFingerprint]:
+        # Inline comments, plus the bodies of the reviews (where the summary goes)
+        fingerprints = set()
+        for comment in pr.get_review_comments():
+            fingerprints.add(
+                get_comment_fingerprint(
+                    comment.path, comment.start_line or comment.line, comment.line, comment.body
+                )
+            )
+
+        for review in pr.get_reviews():
+            if review.body:
+                fingerprints.add(get_comment_fingerprint(None, None, None, review.body))
+
+        return fingerprints
+
+    def _get_review_comment_fingerprint(self, review_comment: dict) -> CommentFingerprint:
+        return get_comment_fingerprint(
+            review_comment["path"],
+            review_comment.get("start_line", review_comment["line"]),
+            review_comment["line"],
+            review_comment["body"],
+        )
+
+    def _get_hunk_index(self, pr) -> HunkIndex:
+        # One (paginated) listing of the changed files gives us the hunks for the whole PR
+        hunks = {}
+        for file in pr.get_files():
+            # Binary and very large files don't come with a patch, so can't be commented on
+            hunks[file.filename] = parse_hunk_ranges(file.patch) if file.patch else []
+
+        return HunkIndex(hunks)
+
+    def _get_review_summary(
+        self,
+        num_comments: int,
+        general_comments: List[CodeComment],
+        outside_diff_comments: List[CodeComment],
+    ) -> str:
+        summary = f"Code review found {num_comments} comments."
+
+        for comment in general_comments:
+            if comment.file_path:
+                summary += f"\n\n**{self._get_repository_path(comment.file_path)}**: {comment.comment}"
+            else:
+                summary += f"\n\n{comment.comment}"
+
+        if len(outside_diff_comments) > 0:
+            summary += "\n\n### Comments outside of the changed lines"
+
+            for comment in outside_diff_comments:
+                lines = str(comment.start)
+                if comment.end is not None and comment.end != comment.start:
+                    lines += f"-{comment.end}"
+
+                summary += f"\n\n**{self._get_repository_path(comment.file_path)}** (line {lines}): {comment.comment}"
+
+        return summary
+
+    def _get_repository_path(self, path: str) -> str:
+        # GitHub wants paths relative to the root of the repository
+        workspace = os.getenv("GITHUB_WORKSPACE", os.getcwd())
+        return os.path.relpath(os.path.abspath(path), workspace).replace(os.sep, "/")
+
+
+def get_github_retry_delay(e: Exception) -> Optional[float]:
+    # Only rate limiting is worth retrying- other errors (bad lines, permissions) will just fail again.
+    # PyGithub already retries rate limits on its own, so this only kicks in once it has given up
+    if not isinstance(e, GithubException) or e.status not in (403, 429):
+        return None
+
+    headers = {k.lower(): v for k, v in (e.headers or {}).items()}
+
+    if "retry-after" in headers:
+        return float(headers["retry-after"])
+
+    if headers.get("x-ratelimit-remaining") == "0" and "x-ratelimit-reset" in headers:
+        return max(0.0, float(headers["x-ratelimit-reset"]) - time.time())
+
+    # A 403 without any rate limit information is a real permission problem
+    if e.status == 403 and "rate limit" not in str(e.data).lower():
+        return None
+
+    return 0.0
 
 
 if __name__ == "__main__":
@@ -136,7 +346,7 @@ if __name__ == "__main__":
         source_branch="main",
         target_branch="test-branch",
         commit_message="Test commit",
-        code_documents=[
+        metadatas=[
             {
                 "file_path": "examples/code_comment.py",
                 "code": "def test():\n    print('hello world')\n",
@@ -1,7 +1,8 @@
 import logging
 import os
+import re
 import sys
-from typing import List
+from typing import Dict, List, Optional, Set, Tuple
 
 import gitlab
 
@@ -9,6 +10,14 @@ import gitlab
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../")))
 
 from integrations.source_control_base import SourceControlBase, CodeComment
+from integrations.comment_fingerprint import CommentFingerprint, get_comment_fingerprint
+from utilities.concurrency import run_concurrently
+from utilities.git_helper import get_blob_sha, parse_hunk_ranges, parse_unchanged_lines
+from utilities.hunk_index import HunkIndex
+from utilities.retry import call_with_retry
+
+# The body of a comment that couldn't be positioned on its line, e.g. "**src/app.py** (line 12): ..."
+UNPOSITIONED_BODY_REGEX = re.compile(r"^\*\*(.+?)\*\* \(line (\d+)\): (.*)$", re.DOTALL)
 
 class GitLabIntegration(SourceControlBase):
     def __init__(self):
@@ -24,6 +33,15 @@ class GitLabIntegration(SourceControlBase):
         # private token or personal token authentication (self-hosted GitLab instance)
         self.gl = gitlab.Gitlab(url=self.gitlab_url, private_token=self.gitlab_token)
 
+        # The project is only looked up when it's needed, and then kept
+        self.project = None
+
+        # The number of discussions posted at once- self-hosted instances are often rate limited
+        self.max_concurrency = int(os.getenv("CR_GITLAB_MAX_CONCURRENCY", 4))
+
+        # Commits are split up when their content gets bigger than this
+        self.max_commit_size = int(os.getenv("CR_GITLAB_MAX_COMMIT_BYTES", 10 * 1024 * 1024))
+
         # make an API request to create the gl.user object. This is not required but may be useful
         # to validate your token authentication. Note that this will not work with job tokens.
         self.gl.auth()
@@ -36,49 +54,311 @@ class GitLabIntegration(SourceControlBase):
 
 
     def add_pr_comments(self, comments: List[CodeComment]):
-        raise NotImplementedError("GitLabIntegration.add_pr_comments is not implemented")
+        merge_request_iid = os.getenv("GITLAB_MR_IID", os.getenv("CI_MERGE_REQUEST_IID"))
+        if not merge_request_iid:
+            raise ValueError("GITLAB_MR_IID is not set in the environment")
 
-    def commit_changes(self, source_branch, target_branch, commit_message, metadatas: List[dict]):
-        project_id = os.getenv("GITLAB_PROJECT_ID")
-        if not project_id:
-            raise ValueError("GITLAB_PROJECT_ID is not set in the environment")
-        
-        for metadata in metadatas:
-            path = metadata["file_path"]
-            code = metadata["code"]
-            
-            if os.path.exists(path):
-                action = "update"
+        project = self._get_project()
+        merge_request = project.mergerequests.get(merge_request_iid)
+
+        # Discussions have to be positioned against the versions of the MR that the diff was made from
+        # See https://docs.gitlab.com/ee/api/discussions.html#create-new-merge-request-thread
+        diff_refs = merge_request.diff_refs
+
+        # Find out which lines are part of the diff (and what files were called before they were
+        # renamed), since GitLab won't position a discussion anywhere else
+        old_paths = {}
+        hunks = {}
+        # Unchanged lines need their old line number as well as the new one
+        unchanged_lines = {}
+        for change in merge_request.changes()["changes"]:
+            old_paths[change["new_path"]] = change["old_path"]
+            hunks[change["new_path"]] = parse_hunk_ranges(change["diff"]) if change["diff"] else []
+            unchanged_lines[change["new_path"]] = (
+                parse_unchanged_lines(change["diff"]) if change["diff"] else {}
+            )
+        hunk_index = HunkIndex(hunks)
+
+        discussions = []
+        general_comments = []
+        for comment in comments:
+            path = self._get_repository_path(comment.file_path) if comment.file_path else None
+            if comment.start is None or path is None:
+                general_comments.append(comment)
+            elif hunk_index.find_hunk(path, comment.start, comment.end) is None:
+                general_comments.append(comment)
             else:
-                action = "create"
+                line = comment.end if comment.end is not None else comment.start
+                position = {
+                    "position_type": "text",
+                    "base_sha": diff_refs["base_sha"],
+                    "start_sha": diff_refs["start_sha"],
+                    "head_sha": diff_refs["head_sha"],
+                    "old_path": old_paths.get(path, path),
+                    "new_path": path,
+                    "new_line": line,
+                }
+                if line in unchanged_lines[path]:
+                    position["old_line"] = unchanged_lines[path][line]
 
-            project = self.gl.projects.get(project_id)
-            # See https://docs.gitlab.com/ce/api/commits.html#create-a-commit-with-multiple-files-and-actions
-            # for actions detail
-            data = {
-                'branch': target_branch,
-                'start_branch': source_branch,
-                'commit_message': commit_message,
-                'actions': [
+                discussions.append({"body": self._get_comment_body(comment), "position": position})
+
+        # The summary has everything that couldn't be put on a line
+        summary = {"body": self._get_review_summary(len(comments), general_comments)}
+
+        # Anything already on the MR (e.g. from a previous run) isn't posted again
+        existing_fingerprints = self._get_existing_fingerprints(merge_request)
+        new_discussions = [
+            d for d in discussions if self._get_discussion_fingerprint(d) not in existing_fingerprints
+        ]
+        post_summary = self._get_discussion_fingerprint(summary) not in existing_fingerprints
+
+        logging.info(
+            f"Posting {len(new_discussions) + post_summary} discussions "
+            f"({len(discussions) + 1 - len(new_discussions) - post_summary} already exist)"
+        )
+
+        # GitLab orders discussions by when they were created, so the summary is posted on its own
+        # before anything else, and only the line comments (one request each) are posted concurrently
+        if post_summary:
+            self._create_discussion(merge_request, summary)
+
+        results = run_concurrently(
+            lambda d: self._create_discussion(merge_request, d),
+            new_discussions,
+            self.max_concurrency,
+        )
+
+        failures = [r for r in results if not r.succeeded]
+        for failure in failures:
+            logging.error(f"Could not post discussion: {failure.error}")
+
+        if len(failures) > 0:
+            raise failures[0].error
+
+    def _create_discussion(self, merge_request, discussion: dict):
+        try:
+            return call_with_retry(
+                lambda: merge_request.discussions.create(discussion),
+                get_gitlab_retry_delay,
+            )
+        except gitlab.exceptions.GitlabCreateError as e:
+            if e.response_code != 400 or "position" not in discussion:
+                raise
+
+            # GitLab can still refuse a position (e.g. the diff has moved on since it was fetched),
+            # in which case the comment is posted on the MR itself, so it isn't lost
+            position = discussion["position"]
+            logging.warning(
+                f"Could not position comment on {position['new_path']}:{position['new_line']}, posting it unpositioned: {e}"
+            )
+            return call_with_retry(
+                lambda: merge_request.discussions.create(
                     {
-                        'action': action,                    
-                        'file_path': path,
-                        'content': code,
+                        "body": f"**{position['new_path']}** (line {position['new_line']}): {discussion['body']}"
                     }
-                ]
+                ),
+                get_gitlab_retry_delay,
+            )
+
+    def _get_existing_fingerprints(self, merge_request) -> Set[CommentFingerprint]:
+        fingerprints = set()
+        for discussion in merge_request.discussions.list(get_all=True):
+            for note in discussion.attributes["notes"]:
+                fingerprints.add(self._get_discussion_fingerprint(note))
+
+        return fingerprints
+
+    def _get_discussion_fingerprint(self, discussion: dict) -> CommentFingerprint:
+        position = discussion.get("position")
+        if position is None:
+            # A comment that had to be posted unpositioned is still the comment for that line,
+            # so it isn't posted again next time
+            match = UNPOSITIONED_BODY_REGEX.match(discussion["body"])
+            if match is not None:
+                return get_comment_fingerprint(
+                    match.group(1), int(match.group(2)), None, match.group(3)
+                )
+
+            return get_comment_fingerprint(None, None, None, discussion["body"])
+
+        return get_comment_fingerprint(
+            position["new_path"], position["new_line"], None, discussion["body"]
+        )
+
+    def _get_comment_body(self, comment: CodeComment) -> str:
+        # Discussions sit on a single line, so say when a comment covers more than that
+        if comment.end is not None and comment.end != comment.start:
+            return f"**Lines {comment.start}-{comment.end}**: {comment.comment}"
+
+        return comment.comment
+
+    def _get_review_summary(self, num_comments: int, general_comments: List[CodeComment]) -> str:
+        summary = f"Code review found {num_comments} comments."
+
+        for comment in general_comments:
+            if comment.file_path is None:
+                summary += f"\n\n{comment.comment}"
+            elif comment.start is None:
+                summary += f"\n\n**{self._get_repository_path(comment.file_path)}**: {comment.comment}"
+            else:
+                lines = str(comment.start)
+                if comment.end is not None and comment.end != comment.start:
+                    lines += f"-{comment.end}"
+
+                summary += f"\n\n**{self._get_repository_path(comment.file_path)}** (line {lines}): {comment.comment}"
+
+        return summary
+
+    def commit_changes(self, source_branch, target_branch, commit_message, metadatas: List[dict]):
+        project = self._get_project()
+
+        # What's already in the repository decides between create and update (and lets us skip
+        # files the refactor didn't change), rather than whatever happens to be on this machine
+        paths = [self._get_repository_path(metadata["file_path"]) for metadata in metadatas]
+        existing_blob_shas, target_branch_exists = self._get_existing_blob_shas(
+            project, source_branch, target_branch, paths
+        )
+
+        actions = []
+        for path, metadata in zip(paths, metadatas):
+            code = metadata["code"]
+
+            existing_blob_sha = existing_blob_shas.get(path)
+            if existing_blob_sha == get_blob_sha(code.encode("utf-8")):
+                logging.debug(f"{path} is unchanged, skipping it")
+                continue
+
+            actions.append(
+                {
+                    "action": "create" if existing_blob_sha is None else "update",
+                    "file_path": path,
+                    "content": code,
+                }
+            )
+
+        if len(actions) == 0:
+            logging.info("No files were changed, nothing to commit")
+            return
+
+        # All of the files go into one commit, unless that would be too big for the server to accept
+        # See https://docs.gitlab.com/ce/api/commits.html#create-a-commit-with-multiple-files-and-actions
+        # for actions detail
+        batches = self._get_action_batches(actions)
+        for i, batch in enumerate(batches, start=1):
+            data = {
+                "branch": target_branch,
+                "commit_message": commit_message
+                if len(batches) == 1
+                else f"{commit_message} ({i} of {len(batches)})",
+                "actions": batch,
             }
 
+            # A missing target branch is created from the source branch by the first commit, and the
+            # rest go straight onto it (GitLab refuses a start_branch for a branch that already exists)
+            if i == 1 and not target_branch_exists:
+                data["start_branch"] = source_branch
+
             commit = project.commits.create(data)
-            
-            print(commit)
-    
+            logging.info(f"Committed {len(batch)} files to {target_branch}: {commit.id}")
+
+    def _get_project(self):
+        # Fetched once and re-used for everything else
+        if self.project is None:
+            project_id = os.getenv("GITLAB_PROJECT_ID")
+            if not project_id:
+                raise ValueError("GITLAB_PROJECT_ID is not set in the environment")
+
+            self.project = self.gl.projects.get(project_id)
+
+        return self.project
+
+    def _get_existing_blob_shas(
+        self, project, source_branch, target_branch, paths: List[str]
+    ) -> Tuple[Dict[str, str], bool]:
+        """Get the blob SHA of each of paths that exists where the commits will be made, and whether the target branch exists.
+
+        Commits land on the target branch if it exists, otherwise it is created from the source branch.
+        Only the given paths are looked up (with a HEAD request each), rather than listing the whole repository.
+        """
+        ref = None
+        for branch in [target_branch, source_branch]:
+            try:
+                project.branches.get(branch)
+            except gitlab.exceptions.GitlabGetError as e:
+                if e.response_code == 404:
+                    logging.debug(f"{branch} does not exist")
+                    continue
+                raise
+
+            ref = branch
+            break
+
+        if ref is None:
+            raise ValueError(f"Could not find the {source_branch} branch")
+
+        results = run_concurrently(
+            lambda path: self._get_blob_sha(project, path, ref),
+            paths,
+            self.max_concurrency,
+        )
+
+        blob_shas = {}
+        for result in results:
+            if not result.succeeded:
+                raise result.error
+            if result.result is not None:
+                blob_shas[result.item] = result.result
+
+        return blob_shas, ref == target_branch
+
+    def _get_blob_sha(self, project, path: str, ref: str) -> Optional[str]:
+        try:
+            headers = call_with_retry(
+                lambda: project.files.head(path, ref=ref), get_gitlab_retry_delay
+            )
+        except gitlab.exceptions.GitlabHeadError as e:
+            if e.response_code == 404:
+                return None
+            raise
+
+        return headers["X-Gitlab-Blob-Id"]
+
+    def _get_action_batches(self, actions: List[dict]) -> List[List[dict]]:
+        batches = [[]]
+        batch_size = 0
+        for action in actions:
+            action_size = len(action["content"].encode("utf-8")) + len(action["file_path"])
+            if len(batches[-1]) > 0 and batch_size + action_size > self.max_commit_size:
+                batches.append([])
+                batch_size = 0
+
+            batches[-1].append(action)
+            batch_size += action_size
+
+        return batches
+
+    def _get_repository_path(self, path: str) -> str:
+        # GitLab wants paths relative to the root of the repository
+        project_directory = os.getenv("CI_PROJECT_DIR", os.getcwd())
+        return os.path.relpath(os.path.abspath(path), project_directory).replace(os.sep, "/")
+
+
+def get_gitlab_retry_delay(e: Exception) -> Optional[float]:
+    # Only rate limiting is worth retrying.  python-gitlab already waits out Retry-After on its own,
+    # so this only kicks in once it has given up
+    if not isinstance(e, gitlab.exceptions.GitlabError) or e.response_code != 429:
+        return None
+
+    return 0.0
+
 if __name__ == "__main__":
     
     gl = GitLabIntegration()
     
     os.environ.setdefault("GITLAB_PROJECT_ID", "14106")
     
-    gl.commit_changes("gitlab-integration", "delete_me", "hey, it's a meeee... ", [{"file_path": "/test/blah.txt", "code": "Only a test"}])
+    gl.commit_changes("gitlab-integration", "delete_me", "hey, it's a meeee... ", [{"file_path": "test/blah.txt", "code": "Only a test"}])
     
     
     
\ No newline at end of file
@@ -1,11 +1,9 @@
 import logging
-from typing import List
+from typing import Iterable, List
 
 from langchain.chains import LLMChain
-from langchain.text_splitter import RecursiveCharacterTextSplitter, Language
+from langchain.text_splitter import Language
 from langchain.chat_models import ChatOpenAI
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
 
 from code_reviewer_configuration import CodeReviewerConfiguration
 from refactor.prompts import (
@@ -13,8 +11,10 @@ from refactor.prompts import (
     REFACTOR_TEMPLATE,
     SUMMARIZE_PROMPT,
 )
-from utilities.token_helper import simple_get_tokens_for_message
+from utilities.token_helper import get_tokenizer
+from utilities.code_splitter import CodeSplitter
 from utilities.open_ai import get_openai_api_key
+from utilities.chunk_store import ChunkStore
 
 # Supported file types for refactoring
 SUPPORTED_FILE_TYPES = {
@@ -28,11 +28,14 @@ class CodeRefactor:
         self.configuration = configuration
         self.llm_arguments_configuration = configuration.llm_arguments
 
+        # Shared tokenizer for the configured model (loaded once, with memoized counts)
+        self.tokenizer = get_tokenizer(self.llm_arguments_configuration.model)
+
         # Calculate remaining tokens for prompt
         self.remaining_prompt_tokens = (
             self.llm_arguments_configuration.max_supported_tokens
             - self.llm_arguments_configuration.max_completion_tokens
-            - simple_get_tokens_for_message(REFACTOR_TEMPLATE)
+            - self.tokenizer.count_tokens(REFACTOR_TEMPLATE)
         )        
 
         logging.info(f"Remaining prompt tokens: {self.remaining_prompt_tokens}")
@@ -55,14 +58,14 @@ class CodeRefactor:
         self.refactor_chain = LLMChain(llm=self.llm, prompt=REFACTOR_PROMPT)
         self.summarize_chain = LLMChain(llm=self.llm, prompt=SUMMARIZE_PROMPT)
 
-    def refactor(self, target_files: List[str]):
-        # Add target files to datastore and get vector database
-        vector_db = self.add_to_datastore(target_files, self.remaining_prompt_tokens)
+    def refactor(self, target_files: Iterable[str]):
+        # Add target files to the in-memory chunk store
+        chunk_store = self.add_to_datastore(target_files, self.remaining_prompt_tokens)
 
-        documents = vector_db.get()
+        documents = chunk_store.get()
         num_documents = len(documents["documents"])
 
-        logging.info(f"Created vector database with {num_documents} chunks of code")
+        logging.info(f"Split the target files into {num_documents} chunks of code")
 
         # TODO: Add this step in later
         # First summarize the code's functionality
@@ -122,13 +125,13 @@ class CodeRefactor:
 
         return unique_result_list
 
-    def add_to_datastore(self, target_files: List[str], max_split_size: int) -> Chroma:
+    def add_to_datastore(self, target_files: Iterable[str], max_split_size: int) -> ChunkStore:
         documents = []
         for file in target_files:
             logging.debug(f"Looking at {file}")
 
             ## TODO: We don't support files larger than the context window yet, until we get better splitting in place
-            if simple_get_tokens_for_message(file) > max_split_size:
+            if self.tokenizer.count_tokens(file) > max_split_size:
                 logging.warning(
                     f"Skipping {file} because it is too large to process.  Max size is {max_split_size} tokens.  This will change as soon as I get better splitting in place."
                 )
@@ -161,14 +164,7 @@ class CodeRefactor:
             # documents = loader.load()
 
             # Split the code into chunks
-            code_splitter = RecursiveCharacterTextSplitter.from_language(
-                language=language,
-                chunk_size=max_split_size,
-                chunk_overlap=0,
-                keep_separator=True,
-                add_start_index=True,
-                length_function=simple_get_tokens_for_message,
-            )
+            code_splitter = CodeSplitter(language, max_split_size, self.tokenizer)
 
             # Create documents from the chunks
             joined_docs = code_splitter.create_documents([file_contents])
@@ -179,4 +175,4 @@ class CodeRefactor:
                 documents.append(d)
 
         logging.info(f"Created {len(documents)} documents, adding to the datastore...")
-        return Chroma.from_documents(documents, OpenAIEmbeddings(openai_api_key=get_openai_api_key()))
+        return ChunkStore(documents)
@@ -0,0 +1,124 @@
+import logging
+from typing import Callable, List, Union
+
+SEGMENT_HEADER = "----- BEGIN FILE: {file_path} -----"
+SEGMENT_FOOTER = "----- END FILE: {file_path} -----"
+
+
+class PackedSegment:
+    """A single chunk of code that has been placed into a pack."""
+
+    def __init__(self, index: int, code: str, metadata: dict):
+        # Index of the chunk in the chunk store, used to keep the output in file/chunk order
+        self.index = index
+        self.code = code
+        self.metadata = metadata
+
+    @property
+    def file_path(self) -> str:
+        return self.metadata["file_path"]
+
+    @property
+    def starting_line_number(self) -> int:
+        return self.metadata["starting_line_number"]
+
+    @property
+    def ending_line_number(self) -> int:
+        return self.metadata["ending_line_number"]
+
+    def contains_line(self, line_number: Union[int, None]) -> bool:
+        if line_number is None:
+            return False
+        return self.starting_line_number <= line_number <= self.ending_line_number
+
+    def render(self) -> str:
+        return "\n".join(
+            [
+                SEGMENT_HEADER.format(file_path=self.file_path),
+                self.code,
+                SEGMENT_FOOTER.format(file_path=self.file_path),
+            ]
+        )
+
+
+class ChunkPack:
+    """A group of chunks (possibly from several files) that are reviewed in one LLM call."""
+
+    def __init__(self):
+        self.segments: List[PackedSegment] = []
+        self.tokens = 0
+
+    def add(self, segment: PackedSegment, tokens: int):
+        self.segments.append(segment)
+        self.tokens += tokens
+
+    @property
+    def language(self) -> str:
+        # Packs can span languages, so hand the LLM all of them
+        languages = []
+        for segment in self.segments:
+            language = getattr(
+                segment.metadata["language"], "value", segment.metadata["language"]
+            )
+            if language not in languages:
+                languages.append(language)
+
+        return ", ".join(languages)
+
+    @property
+    def code(self) -> str:
+        return "\n\n".join(segment.render() for segment in self.segments)
+
+    def find_segment(self, file_path: Union[str, None], line_number: Union[int, None]) -> PackedSegment:
+        # Prefer the segment the LLM told us about, narrowed down by line number when the
+        # same file appears more than once in the pack
+        candidates = [s for s in self.segments if s.file_path == file_path]
+        if len(candidates) == 0:
+            # The LLM didn't give us a (recognizable) file, so fall back to the line numbers
+            logging.warning(
+                f"Review comment names {file_path}, which isn't in the pack, matching it by line number instead"
+            )
+            candidates = self.segments
+
+        for segment in candidates:
+            if segment.contains_line(line_number):
+                return segment
+
+        logging.warning(
+            f"No chunk of {candidates[0].file_path} contains line {line_number}, attributing the review comment to the first one"
+        )
+        return candidates[0]
+
+
+def pack_chunks(
+    documents: dict,
+    max_tokens: int,
+    token_counter: Callable[[List[str]], List[int]],
+) -> List[ChunkPack]:
+    """Bin-pack the chunks from ChunkStore.get() into packs of at most max_tokens.
+
+    Uses first-fit in chunk order, so chunks from the same file tend to stay together and the
+    packs come out in a deterministic order.  A chunk that is too large to share a pack on its
+    own gets a pack to itself.  token_counter takes a list of strings and returns their token counts.
+    """
+    packs: List[ChunkPack] = []
+
+    segments = [
+        PackedSegment(i, documents["documents"][i], documents["metadatas"][i])
+        for i in range(len(documents["documents"]))
+    ]
+
+    # Count all of the segments in one batch, accounting for the separator between segments as well
+    segment_tokens = token_counter([segment.render() + "\n\n" for segment in segments])
+
+    for segment, tokens in zip(segments, segment_tokens):
+        for pack in packs:
+            if pack.tokens + tokens <= max_tokens:
+                pack.add(segment, tokens)
+                break
+        else:
+            pack = ChunkPack()
+            pack.add(segment, tokens)
+            packs.append(pack)
+
+    return packs
@@ -9,3 +9,15 @@ class CodeComment:
         self.end = end
         self.comment = comment
         self.file_path = file_path
+
+    def to_dict(self) -> dict:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "comment": self.comment,
+            "file_path": self.file_path,
+        }
+
+    @staticmethod
+    def from_dict(comment: dict):
+        return CodeComment(**comment)
@@ -1,20 +1,16 @@
 import json
+import os
 from enum import Enum
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
 import openai
 from dotenv import dotenv_values
 from langchain import PromptTemplate
 from langchain.chains import LLMChain
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-    Language,
-)
+from langchain.text_splitter import Language
 from langchain.document_loaders import TextLoader
 from langchain.docstore.document import Document
 import logging
 from datetime import datetime
-from typing import Union, List, Dict
+from typing import Union, Iterable, List, Dict, Tuple
 from langchain.llms import OpenAI
 from langchain.chat_models import ChatOpenAI
 from code_reviewer_configuration import CodeReviewerConfiguration
@@ -24,9 +20,15 @@ from review.prompts import (
     SUMMARIZE_PROMPT,
     SUMMARIZE_TEMPLATE,
 )
-from utilities.token_helper import simple_get_tokens_for_message
+from utilities.token_helper import get_tokenizer
+from utilities.code_splitter import CodeSplitter
 from review.code_comment import CodeComment
+from review.chunk_packer import ChunkPack, pack_chunks
+from review.diff_regions import get_review_regions
 from utilities.open_ai import get_openai_api_key
+from utilities.concurrency import ordered_concurrent_map
+from utilities.chunk_store import ChunkStore
+from utilities.line_index import LineIndex
 
 # TODO: Expand this list- most of the stuff we have doesn't need to be split, anyway.
 SUPPORTED_FILE_TYPES = {"py": Language.PYTHON, "cpp": Language.CPP}
@@ -37,10 +39,13 @@ class CodeReviewer:
         self.configuration = configuration
         self.llm_arguments_configuration = configuration.llm_arguments
 
+        # Shared tokenizer for the configured model (loaded once, with memoized counts)
+        self.tokenizer = get_tokenizer(self.llm_arguments_configuration.model)
+
         self.remaining_prompt_tokens = (
             self.llm_arguments_configuration.max_supported_tokens
             - self.llm_arguments_configuration.max_completion_tokens
-            - simple_get_tokens_for_message(REVIEW_TEMPLATE)
+            - self.tokenizer.count_tokens(REVIEW_TEMPLATE)
         )
 
         self.llm = ChatOpenAI(
@@ -53,50 +58,99 @@ class CodeReviewer:
         self.review_chain = LLMChain(llm=self.llm, prompt=REVIEW_PROMPT)
         self.summarize_chain = LLMChain(llm=self.llm, prompt=SUMMARIZE_PROMPT)
 
-    def review(self, target_files: List[str]) -> List[CodeComment]:
+        self.failed_files = set()
+
+    def review(
+        self,
+        target_files: Iterable[str],
+        changed_hunks: Dict[str, List[Tuple[int, int]]] = None,
+    ) -> List[CodeComment]:
         # Iterate through the files, and do several things:
         # - Read the file
+        # - If changed_hunks is provided (absolute file path -> changed line ranges), only keep the changed regions
         # - Split the files into chunks of (max_tokens - max_completion_tokens)
-        # - Create embeddings of each chunk so that the LLM can search for them when required
-        # - Create an in-memory database of the file chunks and embeddings for later reference by the LLM
+        # - Keep the chunks in an in-memory store (embeddings are only created if something needs to search them)
 
-        vector_db = self.split_and_add_to_datastore(
-            target_files, self.remaining_prompt_tokens
+        chunk_store = self.split_and_add_to_datastore(
+            target_files, self.remaining_prompt_tokens, changed_hunks
         )
 
-        documents = vector_db.get()
+        documents = chunk_store.get()
         num_documents = len(documents["documents"])
 
-        logging.info(f"Created vector database with {num_documents} chunks of code")
+        logging.info(f"Split the target files into {num_documents} chunks of code")
+
+        # We don't want to create excessive calls to the LLM, so we will combine chunks into a single call as long as they fit within the remaining prompt tokens
+        packs = pack_chunks(
+            documents, self.remaining_prompt_tokens, self.tokenizer.count_tokens_batch
+        )
+
+        logging.info(
+            f"Packed {num_documents} chunks into {len(packs)} review calls, running up to {self.configuration.max_concurrency} at a time"
+        )
+
+        # Once the files are split and packed, we can start the review process
+        # Packs are fanned out to the LLM concurrently, but the results come back in order
+        results = ordered_concurrent_map(
+            self.review_pack, packs, self.configuration.max_concurrency
+        )
+
+        # Collect the comments by chunk, so that the output stays in file/chunk order regardless of how the chunks were packed
+        comments_by_chunk = {}
+        # Files that could not be (completely) reviewed, so callers know not to trust their results
+        self.failed_files = set()
+        for result in results:
+            if not result.succeeded:
+                # A single bad call shouldn't take down the rest of the review
+                failed_files = {s.file_path for s in result.item.segments}
+                self.failed_files.update(failed_files)
+                logging.error(
+                    f"Failed to review {', '.join(sorted(failed_files))}: {result.error}"
+                )
+                continue
+
+            for index, comment in result.result:
+                comments_by_chunk.setdefault(index, []).append(comment)
 
         comments = []
-        # Once the files are split and added to the datastore, we can start the review process
-        for i in range(0, num_documents):
-            # We don't want to create excessive calls to the LLM, so we will combine chunks into a single call as long as they fit within the remaining prompt tokens
+        for index in sorted(comments_by_chunk):
+            comments.extend(comments_by_chunk[index])
 
+        return comments
+
+    def review_pack(self, pack: ChunkPack) -> List[Tuple[int, CodeComment]]:
+        for segment in pack.segments:
             logging.info(
-                f"Reviewing {documents['metadatas'][i]['file_path']}, chunk {documents['metadatas'][i]['chunk']}"
+                f"Reviewing {segment.file_path}, chunk {segment.metadata['chunk']}"
             )
-            code_to_review = documents["documents"][i]
 
-            # Summarize the chunk
-            if self.configuration.include_summary:
-                chunk_summary = self.summarize_chunk(
-                    documents["metadatas"][i]["language"], code_to_review
-                )
-                documents["metadatas"][i]["summary"] = chunk_summary
+        code_to_review = pack.code
 
-            # Review the chunk
-            chunk_review = self.review_chunk(
-                documents["metadatas"][i]["language"], code_to_review
-            )
-            documents["metadatas"][i]["review"] = chunk_review
+        # Summarize the chunks
+        if self.configuration.include_summary:
+            chunk_summary = self.summarize_chunk(pack.language, code_to_review)
+            for segment in pack.segments:
+                segment.metadata["summary"] = chunk_summary
 
-            # Load the chunk_review into json
-            for comment in self.get_comments(
-                chunk_review["text"], documents["metadatas"][i]["file_path"]
-            ):
-                comments.append(comment)
+        # Review the chunks
+        chunk_review = self.review_chunk(pack.language, code_to_review)
+        for segment in pack.segments:
+            segment.metadata["review"] = chunk_review
+
+        # Load the chunk_review into json, and route each comment back to the chunk it belongs to
+        return self.get_pack_comments(chunk_review["text"], pack)
+
+    def get_pack_comments(
+        self, chunk_review: str, pack: ChunkPack
+    ) -> List[Tuple[int, CodeComment]]:
+        chunk_review_json = json.loads(chunk_review)
+        comments = []
+        for comment in chunk_review_json["comments"]:
+            file_path = comment.pop("file", None)
+            segment = pack.find_segment(file_path, comment.get("start", None))
+            comments.append(
+                (segment.index, CodeComment(**comment, file_path=segment.file_path))
+            )
 
         return comments
 
@@ -104,13 +158,17 @@ class CodeReviewer:
         chunk_review_json = json.loads(chunk_review)
         comments = []
         for comment in chunk_review_json["comments"]:
+            comment.pop("file", None)
             comments.append(CodeComment(**comment, file_path=file_path))
 
         return comments
 
     def split_and_add_to_datastore(
-        self, target_files: List[str], max_split_size: int
-    ) -> Chroma:
+        self,
+        target_files: Iterable[str],
+        max_split_size: int,
+        changed_hunks: Dict[str, List[Tuple[int, int]]] = None,
+    ) -> ChunkStore:
         # Split the file into chunks of (max_tokens - max_completion_tokens)
         # This is because the LLM will need to add the completion tokens to the end of the chunk
         documents = []
@@ -127,6 +185,13 @@ class CodeReviewer:
                 )
                 continue
 
+            # When reviewing a diff, only the files that changed are of interest
+            if changed_hunks is not None and not changed_hunks.get(
+                os.path.abspath(file)
+            ):
+                logging.debug(f"Skipping {file} because it has no changes")
+                continue
+
             language = SUPPORTED_FILE_TYPES[file_extension]
             logging.debug(f"Language is {language} for {file}")
 
@@ -134,59 +199,68 @@ class CodeReviewer:
             with open(file, "r") as f:
                 file_contents = f.read()
 
-            # TODO: When looking at diffs for review, I need to diff two versions of this file,
-            # and then extract the chunks of diffs (much like git does),
-            # then need to ingest that into the datastore along with the full file
-            code_splitter = RecursiveCharacterTextSplitter.from_language(
-                language=language,
-                chunk_size=max_split_size,
-                chunk_overlap=0,
-                keep_separator=True,
-                add_start_index=True,
-                length_function=simple_get_tokens_for_message,
-            )
-
-            # Unwind this dumbass list-in-a-list
-            joined_docs = code_splitter.create_documents([file_contents])
-            docs = [d for d in joined_docs]
-
-            all_lines = file_contents.rstrip().split("\n")
+            code_splitter = CodeSplitter(language, max_split_size, self.tokenizer)
+
+            # Each section of the file to review is (first line number, code)
+            if changed_hunks is None:
+                sections = [(1, file_contents)]
+            else:
+                # Only review the changed hunks, expanded to their enclosing scopes where they fit
+                file_lines = file_contents.split("\n")
+                regions = get_review_regions(
+                    file_contents,
+                    language,
+                    changed_hunks[os.path.abspath(file)],
+                    max_split_size,
+                    self.tokenizer.count_tokens,
+                )
+                sections = [
+                    (start, "\n".join(file_lines[start - 1 : end]))
+                    for start, end in regions
+                ]
+                logging.debug(f"Reviewing lines {regions} of {file}")
 
-            # Create a list of docs with the medadata
             chunk = 0
-            starting_search_line_index = 0
-            for d in docs:
-                chunk += 1
-                # Find the true starting line number
-                for line_number, line in enumerate(
-                    all_lines[starting_search_line_index:], start=1
-                ):
-                    if d.page_content.split("\n")[0] in line:
-                        starting_line = line_number + starting_search_line_index
-                        starting_search_line_index = line_number + 1
-                        break
-
-                d.metadata = {
-                    "file_path": file,
-                    "chunk": chunk,
-                    "language": language,
-                    "starting_line_number": starting_line,
-                }
-
-                # Because of how little LLMs pay attention to things like a single line number prompt,
-                # (e.g. ----- BEGIN CODE: Starting Line #: {starting_line_number}  -----)
-                # I am going to add line numbers to each line of code
-                page_content_lines = d.page_content.split("\n")
-                for i, line in enumerate(page_content_lines, start=0):
-                    page_content_lines[i] = f"{i + starting_line}: {line}"
-
-                d.page_content = "\n".join(page_content_lines)
-
-                documents.append(d)
+            for first_line_number, section_contents in sections:
+                # Unwind this dumbass list-in-a-list
+                joined_docs = code_splitter.create_documents([section_contents])
+                docs = [d for d in joined_docs]
+
+                # The splitter records where each chunk starts (add_start_index=True), so map that to a line
+                line_index = LineIndex(section_contents, first_line_number)
+
+                # Create a list of docs with the medadata
+                for d in docs:
+                    chunk += 1
+                    starting_line = line_index.get_line_number(d.metadata["start_index"])
+
+                    d.metadata = {
+                        "file_path": file,
+                        "chunk": chunk,
+                        "language": language,
+                        "starting_line_number": starting_line,
+                        "ending_line_number": starting_line
+                        + d.page_content.count("\n"),
+                    }
+
+                    documents.append(self.add_line_numbers(d))
 
             logging.debug(f"Split {file} into {chunk} chunks")
 
-        return Chroma.from_documents(documents, OpenAIEmbeddings(openai_api_key=get_openai_api_key()))
+        return ChunkStore(documents)
+
+    def add_line_numbers(self, d: Document) -> Document:
+        # Because of how little LLMs pay attention to things like a single line number prompt,
+        # (e.g. ----- BEGIN CODE: Starting Line #: {starting_line_number}  -----)
+        # I am going to add line numbers to each line of code
+        starting_line = d.metadata["starting_line_number"]
+        page_content_lines = d.page_content.split("\n")
+        for i, line in enumerate(page_content_lines, start=0):
+            page_content_lines[i] = f"{i + starting_line}: {line}"
+
+        d.page_content = "\n".join(page_content_lines)
+
+        return d
 
     def create_embedding(self, text: str, embedding_model="text-embedding-ada-002"):
         return openai.Embedding.create(input=[text], model=embedding_model)["data"][0][
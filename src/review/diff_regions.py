@@ -0,0 +1,63 @@
+from typing import Callable, List, Tuple
+
+from langchain.text_splitter import Language
+
+from utilities.code_scopes import get_scopes
+
+# Lines of context to include around a changed hunk when it can't be expanded to its enclosing scope
+DEFAULT_CONTEXT_LINES = 3
+
+
+def get_review_regions(
+    file_contents: str,
+    language: Language,
+    hunks: List[Tuple[int, int]],
+    max_tokens: int,
+    token_counter: Callable[[str], int],
+    context_lines: int = DEFAULT_CONTEXT_LINES,
+) -> List[Tuple[int, int]]:
+    """Turn the changed hunks in a file into the (1-based, inclusive) line ranges that should be reviewed.
+
+    Each hunk is expanded to the innermost function/class that contains it, as long as that scope fits
+    in max_tokens.  Otherwise, the hunk is reviewed with a few lines of context around it.
+    Overlapping or adjacent regions are merged.
+    """
+    all_lines = file_contents.split("\n")
+    num_lines = len(all_lines)
+    scopes = get_scopes(file_contents, language)
+
+    regions = []
+    for hunk_start, hunk_end in hunks:
+        hunk_start = max(1, min(hunk_start, num_lines))
+        hunk_end = max(hunk_start, min(hunk_end, num_lines))
+
+        # Only the innermost scope is considered- the outer ones are only bigger
+        enclosing_scopes = [s for s in scopes if s.contains(hunk_start, hunk_end)]
+
+        region = None
+        if len(enclosing_scopes) > 0:
+            scope = min(enclosing_scopes, key=lambda s: s.num_lines)
+            scope_code = "\n".join(all_lines[scope.start_line - 1 : scope.end_line])
+            if token_counter(scope_code) <= max_tokens:
+                region = (scope.start_line, scope.end_line)
+
+        if region is None:
+            region = (
+                max(1, hunk_start - context_lines),
+                min(num_lines, hunk_end + context_lines),
+            )
+
+        regions.append(region)
+
+    return merge_regions(regions)
+
+
+def merge_regions(regions: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(regions):
+        if len(merged) > 0 and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+from review.code_comment import CodeComment
+
+
+class ReviewManifest:
+    """Remembers the comments produced for each file on a branch, keyed by the file's content hash.
+
+    Files whose hash hasn't changed since the last run don't need to be reviewed again-
+    their previous comments can simply be re-emitted.
+
+    The manifest is stored as JSON:
+    {"branches": {<branch>: {"settings": <settings>, "files": {<path>: {"hash": <hash>, "comments": [...]}}}}}
+    """
+
+    def __init__(self, path: str, branch: str, settings: str):
+        self.path = path
+        self.branch = branch
+        # Anything that changes the output of a review (model, review mode, etc.)
+        # If these change, the previous results for the branch are no longer valid.
+        self.settings = settings
+        self.branches: Dict[str, dict] = {}
+
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.branches = json.load(f).get("branches", {})
+            except (OSError, ValueError) as e:
+                logging.warning(
+                    f"Could not read the review manifest at {self.path}, starting fresh: {e}"
+                )
+
+        branch_manifest = self.branches.get(self.branch, None)
+        if branch_manifest is None or branch_manifest.get("settings") != self.settings:
+            logging.info(f"No usable review manifest entries for branch {self.branch}")
+            branch_manifest = {"settings": self.settings, "files": {}}
+            self.branches[self.branch] = branch_manifest
+
+        self.files: Dict[str, dict] = branch_manifest["files"]
+
+    def _get_key(self, file_path: str) -> str:
+        # Relative paths, so the manifest survives the checkout moving between runners
+        return os.path.relpath(file_path).replace(os.sep, "/")
+
+    def get_comments(self, file_path: str, content_hash: str) -> Optional[List[CodeComment]]:
+        """Get the previous comments for a file, or None if the file needs to be reviewed."""
+        entry = self.files.get(self._get_key(file_path), None)
+        if entry is None or entry["hash"] != content_hash:
+            return None
+
+        comments = []
+        for comment in entry["comments"]:
+            comment = CodeComment.from_dict(comment)
+            comment.file_path = file_path
+            comments.append(comment)
+
+        return comments
+
+    def update(self, file_path: str, content_hash: str, comments: List[CodeComment]):
+        self.files[self._get_key(file_path)] = {
+            "hash": content_hash,
+            "comments": [c.to_dict() for c in comments],
+        }
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first so a crash can't leave a half-written manifest behind
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump({"branches": self.branches}, f)
+
+        os.replace(temporary_path, self.path)
+
+        logging.info(f"Saved review manifest with {len(self.files)} files to {self.path}")
@@ -0,0 +1,99 @@
+from typing import List, Optional
+
+from langchain.docstore.document import Document
+from langchain.vectorstores.base import VectorStore
+from langchain.embeddings.base import Embeddings
+
+from utilities.embedding_index import get_persistent_index
+
+
+class ChunkStore:
+    """A plain in-memory collection of code chunks.
+
+    get() returns the same shape as Chroma.get(), so the review and refactor loops can walk
+    the chunks without paying for embeddings.  The embedding index is only built (once) when
+    something that actually needs retrieval calls as_vector_store().
+    """
+
+    def __init__(
+        self,
+        documents: List[Document],
+        embedding: Embeddings = None,
+        scope_paths: Optional[List[str]] = None,
+    ):
+        self.documents = documents
+        # What the chunks are embedded with, if and when an index is needed
+        self.embedding = embedding
+        # The files and directories the chunks came from, when that isn't the whole repository-
+        # a persistent index only has chunks removed from there
+        self.scope_paths = scope_paths
+        self._vector_store = None
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def get(self) -> dict:
+        # The metadata dicts are shared with the documents rather than copied,
+        # so anything the caller adds to them (e.g. summaries) sticks to the chunk
+        return {
+            "ids": [str(i) for i in range(len(self.documents))],
+            "documents": [d.page_content for d in self.documents],
+            "metadatas": [d.metadata for d in self.documents],
+        }
+
+    def as_vector_store(self, embedding: Embeddings = None, configuration=None) -> VectorStore:
+        """Get (building it the first time) an embedding index over the chunks.
+
+        configuration (a CodeReviewerConfiguration) decides where the index lives.  Without one,
+        the index is kept in memory for this run only.  The persistent stores (chroma, pgvector)
+        are kept between runs, and only the chunks that changed since the last run are embedded.
+        """
+        if self._vector_store is None:
+            # Imported here so that runs which never need retrieval don't pay the startup cost
+            from utilities.embedding_cache import get_embeddings
+
+            if embedding is None:
+                embedding = self.embedding
+
+            if embedding is None:
+                # The embeddings shared by the whole process, only created once something needs them
+                embedding = (
+                    get_embeddings(configuration.cache_directory, configuration.cache_max_size_mb)
+                    if configuration
+                    else get_embeddings()
+                )
+
+            vector_store = configuration.vector_store if configuration else "numpy"
+
+            if vector_store == "chroma":
+                if not configuration.index_directory:
+                    raise ValueError("The chroma vector store needs an index directory")
+
+                self._vector_store = get_persistent_index(
+                    self.documents, embedding, configuration.index_directory, self.scope_paths
+                )
+            elif vector_store == "pgvector":
+                from utilities.pgvector_store import (
+                    DEFAULT_COLLECTION_NAME,
+                    PGVectorStore,
+                    get_pgvector_index,
+                )
+
+                if not configuration.vector_store_connection_string:
+                    raise ValueError("The pgvector vector store needs a connection string")
+
+                store = PGVectorStore(
+                    configuration.vector_store_connection_string,
+                    embedding,
+                    collection_name=configuration.vector_store_collection
+                    or DEFAULT_COLLECTION_NAME,
+                    index_type=configuration.vector_store_index,
+                )
+                self._vector_store = get_pgvector_index(self.documents, store, self.scope_paths)
+            else:
+                # Nothing outlives the run, so there's no need for a database
+                from utilities.numpy_vector_store import NumpyVectorStore
+
+                self._vector_store = NumpyVectorStore.from_documents(self.documents, embedding)
+
+        return self._vector_store
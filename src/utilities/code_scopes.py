@@ -0,0 +1,141 @@
+import ast
+import logging
+from typing import List, Tuple
+
+from langchain.text_splitter import Language
+
+
+class CodeScope:
+    """A function, class, or other block of code, identified by its (1-based, inclusive) lines."""
+
+    def __init__(self, start_line: int, end_line: int, depth: int):
+        self.start_line = start_line
+        self.end_line = end_line
+        # How deeply nested the scope is, 0 being top-level
+        self.depth = depth
+
+    @property
+    def num_lines(self) -> int:
+        return self.end_line - self.start_line + 1
+
+    def contains(self, start_line: int, end_line: int) -> bool:
+        return self.start_line <= start_line and end_line <= self.end_line
+
+    def __repr__(self) -> str:
+        return f"CodeScope({self.start_line}-{self.end_line}, depth={self.depth})"
+
+
+def get_scopes(file_contents: str, language: Language) -> List[CodeScope]:
+    """Get the scopes in a file, sorted by starting line."""
+    if language == Language.PYTHON:
+        scopes = get_python_scopes(file_contents)
+    elif language == Language.CPP:
+        scopes = get_cpp_scopes(file_contents)
+    else:
+        logging.debug(f"Scope detection is not supported for {language}")
+        scopes = []
+
+    return sorted(scopes, key=lambda s: (s.start_line, -s.end_line))
+
+
+def get_python_scopes(file_contents: str) -> List[CodeScope]:
+    try:
+        tree = ast.parse(file_contents)
+    except SyntaxError as e:
+        logging.debug(f"Could not parse Python code, no scopes will be used: {e}")
+        return []
+
+    scopes = []
+
+    def visit(node, depth):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                # Decorators belong with the definition they decorate
+                start_line = min(
+                    [child.lineno] + [d.lineno for d in child.decorator_list]
+                )
+                scopes.append(CodeScope(start_line, child.end_lineno, depth))
+                visit(child, depth + 1)
+            else:
+                visit(child, depth)
+
+    visit(tree, 0)
+
+    return scopes
+
+
+def get_cpp_scopes(file_contents: str) -> List[CodeScope]:
+    # A lightweight brace scanner- this isn't a C++ parser, but it skips over comments,
+    # string/char literals and preprocessor lines, which is enough to find the blocks.
+    # Each block's scope starts on the line where the statement owning the "{" begins.
+    scopes = []
+    open_scopes: List[Tuple[int, int]] = []
+
+    line = 1
+    statement_start_line = None
+    i = 0
+    length = len(file_contents)
+
+    while i < length:
+        c = file_contents[i]
+
+        if c == "\n":
+            line += 1
+            i += 1
+            continue
+
+        if c.isspace():
+            i += 1
+            continue
+
+        # Comments
+        if file_contents.startswith("//", i):
+            end = file_contents.find("\n", i)
+            i = length if end == -1 else end
+            continue
+
+        if file_contents.startswith("/*", i):
+            end = file_contents.find("*/", i + 2)
+            end = length if end == -1 else end + 2
+            line += file_contents.count("\n", i, end)
+            i = end
+            continue
+
+        # Preprocessor directives (including continuation lines)
+        if c == "#" and statement_start_line is None:
+            while i < length and file_contents[i] != "\n":
+                if file_contents[i] == "\\" and i + 1 < length and file_contents[i + 1] == "\n":
+                    line += 1
+                    i += 1
+                i += 1
+            continue
+
+        if statement_start_line is None:
+            statement_start_line = line
+
+        # String and character literals
+        if c == '"' or c == "'":
+            i += 1
+            while i < length and file_contents[i] != c:
+                if file_contents[i] == "\\":
+                    i += 1
+                elif file_contents[i] == "\n":
+                    line += 1
+                i += 1
+            i += 1
+            continue
+
+        if c == "{":
+            open_scopes.append((statement_start_line, len(open_scopes)))
+            statement_start_line = None
+        elif c == "}":
+            if len(open_scopes) > 0:
+                start_line, depth = open_scopes.pop()
+                scopes.append(CodeScope(start_line, line, depth))
+            statement_start_line = None
+        elif c == ";":
+            statement_start_line = None
+
+        i += 1
+
+    return scopes
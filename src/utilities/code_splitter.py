@@ -0,0 +1,173 @@
+import logging
+import re
+from typing import List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import Language
+
+from utilities.code_scopes import CodeScope, get_scopes
+from utilities.token_helper import TokenizerService
+
+# Line prefixes that mark a comment, which should stay with the definition that follows it
+COMMENT_PREFIXES = {
+    Language.PYTHON: ("#",),
+    Language.CPP: ("//", "/*", "*"),
+}
+
+
+class CodeSplitter:
+    """Splits code into chunks of whole definitions (functions, classes, etc.) that fit in chunk_size tokens.
+
+    The file is parsed once to find its scopes, the token count of each top-level definition
+    is computed in a single batch, and then whole definitions are greedily grouped up to the budget.
+    Definitions that are too large on their own are split along their nested definitions, and only
+    fall back to splitting on lines when there is nothing left to split them on.
+
+    This is a drop-in replacement for the create_documents/split_documents methods of LangChain's
+    text splitters, and always adds the start_index of each chunk to its metadata.
+    """
+
+    def __init__(self, language: Language, chunk_size: int, tokenizer: TokenizerService):
+        self.language = language
+        self.chunk_size = chunk_size
+        self.tokenizer = tokenizer
+        self.comment_prefixes = COMMENT_PREFIXES.get(language, ())
+
+    def create_documents(
+        self, texts: List[str], metadatas: Optional[List[dict]] = None
+    ) -> List[Document]:
+        documents = []
+        for i, text in enumerate(texts):
+            for chunk, start_index in self.split_text_with_offsets(text):
+                metadata = dict(metadatas[i]) if metadatas else {}
+                metadata["start_index"] = start_index
+                documents.append(Document(page_content=chunk, metadata=metadata))
+
+        return documents
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        return self.create_documents(
+            [d.page_content for d in documents], [d.metadata for d in documents]
+        )
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self.split_text_with_offsets(text)]
+
+    def split_text_with_offsets(self, text: str) -> List[Tuple[str, int]]:
+        """Split the text, returning each chunk along with the character offset it starts at."""
+        # Only newlines end lines, as they do for the parsers that find the scopes (and for line numbers
+        # in the review)- splitlines() would also split on form feeds, \x85, \u2028 and the like
+        lines = [line for line in re.split(r"(?<=\n)", text) if line != ""]
+        if len(lines) == 0:
+            return []
+
+        line_offsets = [0]
+        for line in lines:
+            line_offsets.append(line_offsets[-1] + len(line))
+
+        scopes = get_scopes(text, self.language)
+
+        # Break the file into units that are each small enough (or can't be split any further),
+        # then greedily pack consecutive units into chunks
+        units = self._split_range(lines, scopes, 1, len(lines), 0)
+
+        chunks = []
+        current_start, current_end, current_tokens = None, None, 0
+        for start, end, tokens in units:
+            if current_start is not None and current_tokens + tokens <= self.chunk_size:
+                current_end = end
+                current_tokens += tokens
+                continue
+
+            if current_start is not None:
+                chunks.append((current_start, current_end))
+
+            if tokens > self.chunk_size:
+                logging.debug(
+                    f"Line {start} is {tokens} tokens, which is larger than the chunk size of {self.chunk_size}"
+                )
+
+            current_start, current_end, current_tokens = start, end, tokens
+
+        if current_start is not None:
+            chunks.append((current_start, current_end))
+
+        results = []
+        for start, end in chunks:
+            # Leading blank lines are dropped (without shifting the line numbering of what remains)
+            while start < end and lines[start - 1].strip() == "":
+                start += 1
+
+            chunk = "".join(lines[start - 1 : end]).rstrip()
+            if chunk.strip() == "":
+                continue
+
+            results.append((chunk, line_offsets[start - 1]))
+
+        return results
+
+    def _split_range(
+        self, lines: List[str], scopes: List[CodeScope], start_line: int, end_line: int, depth: int
+    ) -> List[Tuple[int, int, int]]:
+        # Returns (start line, end line, tokens) units that cover start_line to end_line
+        children = [
+            s
+            for s in scopes
+            if s.depth == depth and start_line <= s.start_line and s.end_line <= end_line
+        ]
+
+        # Each segment runs from the start of one definition (or the code in between them) to the next
+        boundaries = [start_line]
+        for child in children:
+            boundary = self._include_leading_comments(lines, child.start_line, boundaries[-1])
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+            if child.end_line + 1 <= end_line:
+                boundaries.append(child.end_line + 1)
+
+        boundaries = sorted(set(boundaries))
+        segments = [
+            (boundaries[i], (boundaries[i + 1] - 1) if i + 1 < len(boundaries) else end_line)
+            for i in range(len(boundaries))
+        ]
+
+        token_counts = self.tokenizer.count_tokens_batch(
+            ["".join(lines[s - 1 : e]) for s, e in segments]
+        )
+
+        units = []
+        for (segment_start, segment_end), tokens in zip(segments, token_counts):
+            if tokens <= self.chunk_size or segment_start == segment_end:
+                units.append((segment_start, segment_end, tokens))
+            elif any(
+                s.depth > depth and segment_start <= s.start_line and s.end_line <= segment_end
+                for s in scopes
+            ):
+                # Too big, but there are nested definitions to split it on
+                units.extend(
+                    self._split_range(lines, scopes, segment_start, segment_end, depth + 1)
+                )
+            else:
+                # Nothing left but the lines themselves
+                units.extend(self._split_lines(lines, segment_start, segment_end))
+
+        return units
+
+    def _split_lines(self, lines: List[str], start_line: int, end_line: int) -> List[Tuple[int, int, int]]:
+        token_counts = self.tokenizer.count_tokens_batch(lines[start_line - 1 : end_line])
+        return [
+            (line_number, line_number, tokens)
+            for line_number, tokens in zip(range(start_line, end_line + 1), token_counts)
+        ]
+
+    def _include_leading_comments(self, lines: List[str], start_line: int, minimum_line: int) -> int:
+        if len(self.comment_prefixes) == 0:
+            return start_line
+
+        # Walk back over any comment lines directly above a definition, so they stay together
+        while start_line - 1 > minimum_line and lines[start_line - 2].lstrip().startswith(
+            self.comment_prefixes
+        ):
+            start_line -= 1
+
+        return start_line
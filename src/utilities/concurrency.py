@@ -0,0 +1,58 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+class ConcurrentResult:
+    """The outcome of running a function against a single item."""
+
+    def __init__(self, item: Any, result: Any = None, error: Optional[Exception] = None):
+        self.item = item
+        self.result = result
+        self.error = error
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def ordered_concurrent_map(
+    func: Callable[[Any], Any], items: Iterable[Any], max_concurrency: int
+) -> Iterator[ConcurrentResult]:
+    """Run func against every item with at most max_concurrency calls in flight.
+
+    Results are yielded in the same order as the input items, as soon as each one
+    (and every item before it) has completed.  Exceptions raised by func are captured
+    on the result instead of being raised, so one failing item does not abort the rest.
+    """
+    items = list(items)
+
+    # No point spinning up a pool for a single worker (or a single item)
+    if max_concurrency <= 1 or len(items) <= 1:
+        for item in items:
+            try:
+                yield ConcurrentResult(item, result=func(item))
+            except Exception as e:
+                yield ConcurrentResult(item, error=e)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(items))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        for item, future in zip(items, futures):
+            try:
+                yield ConcurrentResult(item, result=future.result())
+            except Exception as e:
+                yield ConcurrentResult(item, error=e)
+
+
+def run_concurrently(
+    func: Callable[[Any], Any], items: Iterable[Any], max_concurrency: int
+) -> list:
+    """Same as ordered_concurrent_map, but waits for everything and returns a list."""
+    results = list(ordered_concurrent_map(func, items, max_concurrency))
+
+    failures = [r for r in results if not r.succeeded]
+    if len(failures) > 0:
+        logging.warning(f"{len(failures)} of {len(results)} concurrent calls failed")
+
+    return results
@@ -0,0 +1,224 @@
+import hashlib
+import logging
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+CACHE_FILE_EXTENSION = ".f32"
+
+# How many texts are sent to the embedding backend in one request
+DEFAULT_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps another Embeddings so that each distinct text is only ever embedded once.
+
+    Texts are keyed by a hash of their content (and the embedding model), so duplicate chunks
+    within a run are only sent once, and with a cache directory, anything embedded by a previous
+    run is read back from disk.  Whatever is left is sent to the backend in batches of batch_size.
+
+    Each cached embedding is stored as a file of raw float32 values named after its key.  When
+    the directory grows past max_size_bytes, the least recently used entries are evicted, in the
+    same way as the LLM response cache.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        cache_directory: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_size_bytes: Optional[int] = None,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_directory = cache_directory
+        self.batch_size = batch_size
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory: Dict[str, List[float]] = {}
+        # key -> size on disk, ordered from least to most recently used
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_size = 0
+
+        if self.cache_directory is not None:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            self._load_index()
+
+    def _load_index(self):
+        # The modification time of each file is its last use, so that is what the LRU order is rebuilt from
+        entries = []
+        with os.scandir(self.cache_directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(CACHE_FILE_EXTENSION):
+                    stat = entry.stat()
+                    key = entry.name[: -len(CACHE_FILE_EXTENSION)]
+                    entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_size += size
+
+        logging.info(
+            f"Loaded embedding cache from {self.cache_directory} with {len(self._entries)} entries ({self._total_size} bytes)"
+        )
+
+    def _get_key(self, text: str) -> str:
+        return hashlib.sha256((self.model_name + "\0" + text).encode("utf-8")).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_directory, key + CACHE_FILE_EXTENSION)
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        if key in self._memory:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            return self._memory[key]
+
+        if self.cache_directory is None:
+            return None
+
+        try:
+            with open(self._get_path(key), "rb") as f:
+                data = f.read()
+            values = array("f")
+            values.frombytes(data)
+        except FileNotFoundError:
+            self._forget(key)
+            return None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Discarding unreadable embedding cache entry {key}: {e}")
+            self._remove(key)
+            return None
+
+        # Mark the entry as most recently used, both here and on disk (it may have been written by another run)
+        if key in self._entries:
+            self._total_size -= self._entries.pop(key)
+        self._entries[key] = len(data)
+        self._total_size += len(data)
+        os.utime(self._get_path(key))
+
+        self._memory[key] = values.tolist()
+        return self._memory[key]
+
+    def _store(self, key: str, embedding: List[float]):
+        self._memory[key] = embedding
+
+        if self.cache_directory is not None:
+            # Written to a temporary file first, so a concurrent reader never sees half an entry
+            data = array("f", embedding).tobytes()
+            path = self._get_path(key)
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_size += len(data)
+
+            self._evict()
+
+    def _evict(self):
+        if self.max_size_bytes is None:
+            return
+
+        while self._total_size > self.max_size_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            logging.debug(f"Evicting embedding cache entry {key}")
+            self._remove(key)
+
+    def _forget(self, key: str):
+        self._total_size -= self._entries.pop(key, 0)
+
+    def _remove(self, key: str):
+        # Anything already in memory stays usable for the rest of the run
+        self._forget(key)
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._get_key(text) for text in texts]
+
+        # Only the first occurrence of each distinct text that isn't cached needs embedding
+        with self._lock:
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in missing and self._lookup(key) is None:
+                    missing[key] = text
+
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        logging.info(
+            f"Embedding {len(missing)} of {len(texts)} texts ({len(texts) - len(missing)} cached or duplicated)"
+        )
+
+        missing_keys = list(missing)
+        for i in range(0, len(missing_keys), self.batch_size):
+            batch_keys = missing_keys[i : i + self.batch_size]
+            batch_embeddings = self.embeddings.embed_documents([missing[k] for k in batch_keys])
+
+            with self._lock:
+                for key, embedding in zip(batch_keys, batch_embeddings):
+                    self._store(key, embedding)
+
+        with self._lock:
+            return [self._memory[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        # Queries can be embedded differently from documents, so they are keyed separately
+        key = self._get_key("query\0" + text)
+
+        with self._lock:
+            embedding = self._lookup(key)
+            if embedding is not None:
+                self.hits += 1
+                return embedding
+            self.misses += 1
+
+        embedding = self.embeddings.embed_query(text)
+
+        with self._lock:
+            self._store(key, embedding)
+
+        return embedding
+
+
+_shared_embeddings: Dict[Optional[str], CachedEmbeddings] = {}
+_shared_embeddings_lock = threading.Lock()
+
+
+def get_embeddings(
+    cache_directory: Optional[str] = None, max_size_mb: Optional[int] = None
+) -> CachedEmbeddings:
+    """Get the embeddings shared by everything in this process.
+
+    Embeddings are cached in an "embeddings" directory under cache_directory (when given),
+    alongside the LLM response cache, and kept to max_size_mb in the same way.
+    """
+    with _shared_embeddings_lock:
+        if cache_directory not in _shared_embeddings:
+            # Imported here so that runs which never need embeddings don't pay for it
+            from langchain.embeddings.openai import OpenAIEmbeddings
+            from utilities.open_ai import get_openai_api_key
+
+            embeddings = OpenAIEmbeddings(openai_api_key=get_openai_api_key())
+
+            _shared_embeddings[cache_directory] = CachedEmbeddings(
+                embeddings,
+                embeddings.model,
+                os.path.join(cache_directory, "embeddings") if cache_directory else None,
+                int(os.getenv("CR_EMBEDDING_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+                max_size_mb * 1024 * 1024 if max_size_mb is not None else None,
+            )
+
+        return _shared_embeddings[cache_directory]
@@ -0,0 +1,109 @@
+import hashlib
+import logging
+import os
+from typing import Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+# All of the chunks for a repository live in the one collection
+COLLECTION_NAME = "code_chunks"
+
+
+def get_chunk_id(document: Document) -> str:
+    # Keyed by content (and where it came from, so identical chunks in different files both stay)
+    # which means a chunk only ever needs embedding again when it actually changes
+    source = str(document.metadata.get("source", document.metadata.get("file_path", "")))
+    return hashlib.sha256(
+        (source + "\0" + document.page_content).encode("utf-8")
+    ).hexdigest()
+
+
+def get_removed_ids(
+    existing_sources: Dict[str, str],
+    current: Dict[str, Document],
+    scope_paths: Optional[List[str]] = None,
+) -> List[str]:
+    """Get the ids in an index (with their sources) that should go, now that current is what's there.
+
+    When only part of the repository was processed (scope_paths, the files and directories that
+    were walked), only the chunks from that part (or from a source that was processed anyway) are
+    removed- the rest of the index belongs to files this run never looked at.
+    """
+    if scope_paths is not None:
+        scope_paths = [os.path.abspath(p) for p in scope_paths]
+        current_sources = {str(d.metadata.get("source", "")) for d in current.values()}
+
+    def in_scope(source: Optional[str]) -> bool:
+        if scope_paths is None or source in current_sources:
+            return True
+
+        if not source:
+            return False
+
+        source = os.path.abspath(source)
+        return any(source == p or source.startswith(p.rstrip(os.sep) + os.sep) for p in scope_paths)
+
+    return [i for i, source in existing_sources.items() if i not in current and in_scope(source)]
+
+
+def get_persistent_index(
+    documents: List[Document],
+    embedding: Embeddings,
+    persist_directory: str,
+    scope_paths: Optional[List[str]] = None,
+) -> VectorStore:
+    """Open the Chroma index in persist_directory and bring it up to date with documents.
+
+    Only the chunks that aren't already in the index are embedded and added, and any chunks in
+    the index that are no longer in documents (changed or removed files) are deleted- only from
+    within scope_paths, when the run didn't cover the whole repository.
+
+    This uses the duckdb+parquet persistence of chromadb before 0.4 (which is pinned in requirements.txt).
+    """
+    # Imported here so that runs which never need retrieval don't pay the Chroma startup cost
+    from chromadb.config import Settings
+    from langchain.vectorstores import Chroma
+
+    db = Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embedding,
+        persist_directory=persist_directory,
+        client_settings=Settings(
+            chroma_db_impl="duckdb+parquet",
+            persist_directory=persist_directory,
+            anonymized_telemetry=False,
+        ),
+    )
+
+    # Duplicate chunks (same file, same content) only need to go in once
+    current = {get_chunk_id(d): d for d in documents}
+    existing = db.get(include=["metadatas"])
+    existing_sources = {
+        i: (metadata or {}).get("source") for i, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+    existing_ids = set(existing_sources)
+
+    removed_ids = get_removed_ids(existing_sources, current, scope_paths)
+    new_ids = [i for i in current if i not in existing_ids]
+
+    logging.info(
+        f"Embedding index at {persist_directory}: {len(new_ids)} chunks to add, "
+        f"{len(removed_ids)} to remove, {len(current) - len(new_ids)} unchanged"
+    )
+
+    if len(removed_ids) > 0:
+        db.delete(ids=removed_ids)
+
+    if len(new_ids) > 0:
+        db.add_texts(
+            texts=[current[i].page_content for i in new_ids],
+            metadatas=[current[i].metadata for i in new_ids],
+            ids=new_ids,
+        )
+
+    if len(removed_ids) > 0 or len(new_ids) > 0:
+        db.persist()
+
+    return db
@@ -0,0 +1,280 @@
+import logging
+import os
+import re
+from typing import Callable, Collection, Iterator, List, Optional, Tuple
+
+from utilities.git_helper import run_git
+
+
+class GitIgnoreRule:
+    """A single pattern from a .gitignore file."""
+
+    def __init__(self, pattern: str, base_directory: str):
+        # Paths are matched relative to the directory containing the .gitignore
+        self.base_prefix = os.path.join(os.path.abspath(base_directory), "")
+
+        self.negate = pattern.startswith("!")
+        if self.negate:
+            pattern = pattern[1:]
+
+        # Escaped leading characters ("\#", "\!") are literal
+        if pattern.startswith("\\"):
+            pattern = pattern[1:]
+
+        self.directory_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+
+        # A slash anywhere but the end anchors the pattern to the directory of the .gitignore,
+        # otherwise it can match a file or directory name at any depth
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+
+        regex = self._translate(pattern)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+
+        self.regex = re.compile(regex + "$")
+
+    def _translate(self, pattern: str) -> str:
+        regex = ""
+        i = 0
+        while i < len(pattern):
+            if pattern.startswith("**/", i):
+                regex += "(?:.*/)?"
+                i += 3
+            elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+                regex += "/.*"
+                i += 3
+            elif pattern.startswith("**", i):
+                regex += ".*"
+                i += 2
+            elif pattern[i] == "*":
+                regex += "[^/]*"
+                i += 1
+            elif pattern[i] == "?":
+                regex += "[^/]"
+                i += 1
+            elif pattern[i] == "[":
+                end = pattern.find("]", i + 1)
+                if end == -1:
+                    regex += re.escape(pattern[i])
+                    i += 1
+                else:
+                    character_class = pattern[i + 1 : end]
+                    if character_class.startswith("!"):
+                        character_class = "^" + character_class[1:]
+                    regex += f"[{character_class}]"
+                    i = end + 1
+            else:
+                regex += re.escape(pattern[i])
+                i += 1
+
+        return regex
+
+    def matches(self, path: str, is_directory: bool) -> bool:
+        if self.directory_only and not is_directory:
+            return False
+
+        # Plain string slicing rather than os.path.relpath, since this runs for every file in the tree
+        if not path.startswith(self.base_prefix):
+            return False
+
+        relative_path = path[len(self.base_prefix) :].replace(os.sep, "/")
+        return self.regex.match(relative_path) is not None
+
+
+def load_gitignore(directory: str) -> List[GitIgnoreRule]:
+    return load_ignore_file(os.path.join(directory, ".gitignore"), directory)
+
+
+def load_ignore_file(path: str, base_directory: str) -> List[GitIgnoreRule]:
+    if not os.path.isfile(path):
+        return []
+
+    rules = []
+    with open(path, "r", errors="ignore") as f:
+        for line in f:
+            line = line.rstrip("\n").rstrip()
+            if line == "" or line.startswith("#"):
+                continue
+            rules.append(GitIgnoreRule(line, base_directory))
+
+    return rules
+
+
+def get_excludes_file(repository_root: str) -> str:
+    # core.excludesFile, or where git looks when it isn't set
+    try:
+        excludes_file = run_git(
+            ["config", "--path", "--get", "core.excludesFile"], cwd=repository_root
+        ).strip()
+    except (RuntimeError, OSError):
+        # Not set (git exits with 1), or git isn't installed
+        excludes_file = ""
+
+    if excludes_file != "":
+        return os.path.expanduser(excludes_file)
+
+    config_home = os.getenv("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(config_home, "git", "ignore")
+
+
+def get_repository_exclude_rules(repository_root: str) -> List[GitIgnoreRule]:
+    """The rules that apply to the whole repository without being in a .gitignore, lowest precedence first."""
+    return load_ignore_file(get_excludes_file(repository_root), repository_root) + load_ignore_file(
+        os.path.join(repository_root, ".git", "info", "exclude"), repository_root
+    )
+
+
+def is_ignored(path: str, is_directory: bool, rules: List[GitIgnoreRule]) -> bool:
+    # The last rule that matches wins, and deeper .gitignore files come later in the list
+    ignored = False
+    for rule in rules:
+        if rule.matches(path, is_directory):
+            ignored = not rule.negate
+
+    return ignored
+
+
+def get_parent_gitignore_rules(directory: str) -> List[GitIgnoreRule]:
+    # Rules from the repository's exclude files, then the .gitignore files above the starting
+    # directory, up to the root of the repository (the starting directory's own is loaded by the walk)
+    directory = os.path.abspath(directory)
+
+    parents = []
+    current = directory
+    while not os.path.isdir(os.path.join(current, ".git")):
+        parent = os.path.dirname(current)
+        if parent == current:
+            # Not inside a repository, so none of these apply
+            return []
+        current = parent
+        parents.append(current)
+
+    rules = get_repository_exclude_rules(current)
+    for parent in reversed(parents):
+        rules.extend(load_gitignore(parent))
+
+    return rules
+
+
+def is_wanted(
+    path: str,
+    get_size: Callable[[], int],
+    supported_extensions: Optional[Collection[str]],
+    max_file_size: int,
+) -> bool:
+    if supported_extensions is not None and path.split(".")[-1] not in supported_extensions:
+        return False
+
+    # Only stat the file once we know we might want it
+    if max_file_size > 0 and get_size() > max_file_size:
+        logging.info(f"Skipping {path} because it is larger than {max_file_size} bytes")
+        return False
+
+    return True
+
+
+def discover_source_files(
+    paths: List[str],
+    exclude_directories: Optional[Collection[str]] = None,
+    supported_extensions: Optional[Collection[str]] = None,
+    max_file_size: int = 0,
+) -> Iterator[str]:
+    """Lazily yield the files under paths that should be processed.
+
+    Hidden directories, excluded directories and anything matched by a .gitignore are skipped
+    without being walked.  Files are only yielded if they have one of supported_extensions
+    (when given) and are no larger than max_file_size bytes (when non-zero).
+    Directories are walked in sorted order, so the output is deterministic.
+    """
+    exclude_directories = set(exclude_directories or [])
+
+    def wanted(path: str, get_size: Callable[[], int]) -> bool:
+        return is_wanted(path, get_size, supported_extensions, max_file_size)
+
+    for path in paths:
+        if os.path.isfile(path):
+            # Files that were asked for explicitly are not subject to .gitignore
+            if wanted(path, lambda: os.path.getsize(path)):
+                yield path
+        elif os.path.isdir(path):
+            yield from _walk(path, exclude_directories, wanted)
+        else:
+            logging.warning(f"Invalid path: {path}")
+
+
+def discover_tracked_files(
+    paths: List[str],
+    tracked_files: Collection[str],
+    exclude_directories: Optional[Collection[str]] = None,
+    supported_extensions: Optional[Collection[str]] = None,
+    max_file_size: int = 0,
+) -> Iterator[str]:
+    """The same as discover_source_files, but using the (absolute) paths of the files tracked by git.
+
+    tracked_files should already be limited to paths (see git_helper.get_tracked_files).  Files in
+    paths that were asked for explicitly are still yielded even if git doesn't track them.
+    """
+    exclude_directories = set(exclude_directories or [])
+
+    for path in paths:
+        if os.path.isfile(path) and os.path.abspath(path) not in tracked_files:
+            if is_wanted(path, lambda: os.path.getsize(path), supported_extensions, max_file_size):
+                yield path
+
+    for path in sorted(tracked_files):
+        # Same rules as the walk- no hidden or excluded directories
+        directories = os.path.dirname(os.path.relpath(path)).split(os.sep)
+        if any(
+            (d.startswith(".") and d not in (".", "..")) or d in exclude_directories
+            for d in directories
+        ):
+            continue
+
+        # The index can be ahead of the working tree (e.g. a file deleted but not staged)
+        if not os.path.isfile(path):
+            continue
+
+        if is_wanted(path, lambda: os.path.getsize(path), supported_extensions, max_file_size):
+            yield path
+
+
+def _walk(directory: str, exclude_directories, wanted) -> Iterator[str]:
+    # Each entry on the stack is a directory and the .gitignore rules in effect for it
+    # Walked using the absolute path, so the .gitignore rules can match against it
+    directory = os.path.abspath(directory)
+    stack: List[Tuple[str, List[GitIgnoreRule]]] = [
+        (directory, get_parent_gitignore_rules(directory))
+    ]
+
+    while len(stack) > 0:
+        current, rules = stack.pop()
+        rules = rules + load_gitignore(current)
+
+        try:
+            with os.scandir(current) as it:
+                entries = sorted(it, key=lambda e: e.name)
+        except OSError as e:
+            logging.warning(f"Could not read {current}: {e}")
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if (
+                    entry.name.startswith(".")
+                    or entry.name in exclude_directories
+                    or is_ignored(entry.path, True, rules)
+                ):
+                    continue
+                subdirectories.append(entry.path)
+            elif entry.is_file():
+                if is_ignored(entry.path, False, rules):
+                    continue
+                if wanted(entry.path, lambda: entry.stat().st_size):
+                    yield entry.path
+
+        # Pushed in reverse so the subdirectories are visited in sorted order
+        for subdirectory in reversed(subdirectories):
+            stack.append((subdirectory, rules))
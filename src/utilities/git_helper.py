@@ -0,0 +1,240 @@
+import hashlib
+import logging
+import os
+import re
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+# Matches the header of a unified diff hunk, e.g. "@@ -10,3 +12,4 @@ def foo():"
+HUNK_HEADER_REGEX = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+# The same, but capturing where the hunk starts on both sides
+HUNK_STARTS_REGEX = re.compile(r"^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+# The escapes git uses in quoted paths (other than octal bytes), e.g. "b/tab\there.py"
+QUOTED_PATH_ESCAPES = {"a": 7, "b": 8, "t": 9, "n": 10, "v": 11, "f": 12, "r": 13, '"': 34, "\\": 92}
+
+
+def run_git(args: List[str], cwd: Optional[str] = None) -> str:
+    result = subprocess.run(
+        ["git"] + args,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+
+    if result.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+
+    return result.stdout
+
+
+def get_blob_sha(content: bytes) -> str:
+    """Get the SHA git would give this content as a blob, without needing git (or a repository)."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def get_file_blob_sha(path: str) -> str:
+    with open(path, "rb") as f:
+        return get_blob_sha(f.read())
+
+
+def get_repository_root(cwd: Optional[str] = None) -> str:
+    return run_git(["rev-parse", "--show-toplevel"], cwd=cwd).strip()
+
+
+def is_inside_work_tree(cwd: Optional[str] = None) -> bool:
+    try:
+        return run_git(["rev-parse", "--is-inside-work-tree"], cwd=cwd).strip() == "true"
+    except (RuntimeError, OSError):
+        # Not a repository, or git isn't installed
+        return False
+
+
+def get_tracked_files(
+    paths: Optional[List[str]] = None, cwd: Optional[str] = None
+) -> Dict[str, Optional[str]]:
+    """Get the files tracked in the git index, along with their blob SHAs, keyed by absolute path.
+
+    The whole list comes from a single "git ls-files -s" call, so there's no filesystem walk and no
+    hashing.  Files that have been modified in the working tree since they were staged have a SHA
+    of None, since the index no longer describes their contents.
+    """
+    repository_root = get_repository_root(cwd)
+    pathspecs = ["--"] + (paths or [])
+
+    tracked_files = {}
+    # -z keeps unusual file names from being quoted
+    for entry in run_git(["ls-files", "-s", "-z", "--full-name"] + pathspecs, cwd=cwd).split("\0"):
+        if entry == "":
+            continue
+
+        info, path = entry.split("\t", 1)
+        mode, sha, _ = info.split(" ")
+
+        # Only regular files- not symlinks (120000) or submodules (160000)
+        if not mode.startswith("100"):
+            continue
+
+        tracked_files[os.path.normpath(os.path.join(repository_root, path))] = sha
+
+    for path in run_git(["ls-files", "-m", "-z", "--full-name"] + pathspecs, cwd=cwd).split("\0"):
+        if path != "":
+            tracked_files[os.path.normpath(os.path.join(repository_root, path))] = None
+
+    return tracked_files
+
+
+def resolve_ref(ref: str, cwd: Optional[str] = None) -> str:
+    # CI checkouts frequently only have the remote-tracking version of a branch
+    for candidate in [ref, f"origin/{ref}"]:
+        try:
+            run_git(["rev-parse", "--verify", "--quiet", candidate], cwd=cwd)
+            return candidate
+        except RuntimeError:
+            pass
+
+    raise ValueError(f"Could not find the git ref {ref} (or origin/{ref})")
+
+
+def parse_hunk_ranges(patch: str) -> List[Tuple[int, int]]:
+    """Get the (start, end) line ranges on the new side of the file for each hunk in a patch.
+
+    Hunks that only delete lines are given a one-line range at the point of the deletion.
+    """
+    ranges = []
+    for line in patch.split("\n"):
+        match = HUNK_HEADER_REGEX.match(line)
+        if match is None:
+            continue
+
+        start = int(match.group(1))
+        count = 1 if match.group(2) is None else int(match.group(2))
+
+        if count == 0:
+            # Pure deletion- the start is the line *before* the deleted lines
+            ranges.append((max(start, 1), max(start, 1)))
+        else:
+            ranges.append((start, start + count - 1))
+
+    return ranges
+
+
+def parse_unchanged_lines(patch: str) -> Dict[int, int]:
+    """Get the old line number of each unchanged (context) line in the hunks of a patch, by new line number."""
+    unchanged_lines = {}
+    old_line = new_line = None
+    for line in patch.split("\n"):
+        match = HUNK_STARTS_REGEX.match(line)
+        if match is not None:
+            old_line, new_line = int(match.group(1)), int(match.group(2))
+        elif new_line is None or line.startswith("\\"):
+            # Before the first hunk, or "\ No newline at end of file"
+            continue
+        elif line.startswith("+"):
+            new_line += 1
+        elif line.startswith("-"):
+            old_line += 1
+        elif line.startswith(" "):
+            unchanged_lines[new_line] = old_line
+            old_line += 1
+            new_line += 1
+
+    return unchanged_lines
+
+
+def unquote_git_path(path: str) -> str:
+    """Undo the C-style quoting git gives paths with unusual characters, e.g. "b/caf\\303\\251.py"."""
+    if len(path) < 2 or not path.startswith('"') or not path.endswith('"'):
+        return path
+
+    quoted = path[1:-1]
+    unquoted = bytearray()
+    i = 0
+    while i < len(quoted):
+        c = quoted[i]
+        if c != "\\" or i + 1 == len(quoted):
+            unquoted.extend(c.encode("utf-8"))
+            i += 1
+        elif quoted[i + 1] in QUOTED_PATH_ESCAPES:
+            unquoted.append(QUOTED_PATH_ESCAPES[quoted[i + 1]])
+            i += 2
+        else:
+            # Bytes outside of ASCII are written as three octal digits
+            unquoted.append(int(quoted[i + 1 : i + 4], 8))
+            i += 4
+
+    return unquoted.decode("utf-8", errors="surrogateescape")
+
+
+def parse_unified_diff(diff: str) -> Dict[str, List[Tuple[int, int]]]:
+    """Get the hunk ranges from the output of git diff, keyed by the (repo-relative) new path."""
+    hunks = {}
+    current_path = None
+    current_patch = []
+    # Only look for the file header before the first hunk, since an added line can start with "++"
+    in_header = False
+
+    def flush():
+        if current_path is not None:
+            ranges = parse_hunk_ranges("\n".join(current_patch))
+            if len(ranges) > 0:
+                hunks.setdefault(current_path, []).extend(ranges)
+
+    for line in diff.split("\n"):
+        if line.startswith("diff --git "):
+            flush()
+            current_path = None
+            current_patch = []
+            in_header = True
+        elif in_header and line.startswith("+++ "):
+            path = line[4:]
+            # git ends paths that contain spaces with a tab
+            if path.endswith("\t"):
+                path = path[:-1]
+
+            # Deleted files have nothing left to review.  Everything else has the "b/" prefix
+            # (which get_changed_hunks asks for, whatever diff.noprefix is set to), inside any quoting
+            path = unquote_git_path(path)
+            current_path = None if path == "/dev/null" else path[2:]
+        else:
+            if line.startswith("@@"):
+                in_header = False
+            current_patch.append(line)
+
+    flush()
+
+    return hunks
+
+
+def get_changed_hunks(
+    target_branch: str, source_branch: str, cwd: Optional[str] = None
+) -> Dict[str, List[Tuple[int, int]]]:
+    """Get the changed line ranges between two branches, keyed by absolute file path.
+
+    This is the equivalent of what a pull request from source_branch into target_branch would show.
+    """
+    repository_root = get_repository_root(cwd)
+    target = resolve_ref(target_branch, cwd)
+    source = resolve_ref(source_branch, cwd)
+
+    logging.info(f"Getting changed hunks between {target} and {source}")
+
+    diff = run_git(
+        [
+            "diff",
+            "--unified=0",
+            "--no-color",
+            "--no-ext-diff",
+            # Explicit prefixes override diff.noprefix/diff.mnemonicPrefix in the user's config
+            "--src-prefix=a/",
+            "--dst-prefix=b/",
+            f"{target}...{source}",
+        ],
+        cwd=cwd,
+    )
+
+    return {
+        os.path.normpath(os.path.join(repository_root, path)): ranges
+        for path, ranges in parse_unified_diff(diff).items()
+    }
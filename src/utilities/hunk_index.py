@@ -0,0 +1,37 @@
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+
+class HunkIndex:
+    """An interval index of the changed line ranges (hunks) in each file of a diff.
+
+    Hunks within a file never overlap, so each path keeps its hunk starts and ends in sorted
+    lists, and finding the hunk containing a line range is a single binary search.
+    """
+
+    def __init__(self, hunks: Dict[str, List[Tuple[int, int]]]):
+        self.starts: Dict[str, List[int]] = {}
+        self.ends: Dict[str, List[int]] = {}
+
+        for path, ranges in hunks.items():
+            ranges = sorted(ranges)
+            self.starts[path] = [start for start, _ in ranges]
+            self.ends[path] = [end for _, end in ranges]
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.starts
+
+    def find_hunk(self, path: str, start: int, end: Optional[int] = None) -> Optional[Tuple[int, int]]:
+        """Get the hunk that contains all of the lines from start to end, or None if there isn't one."""
+        if end is None:
+            end = start
+
+        starts = self.starts.get(path)
+        if not starts:
+            return None
+
+        i = bisect_right(starts, start) - 1
+        if i < 0 or self.ends[path][i] < end:
+            return None
+
+        return starts[i], self.ends[path][i]
@@ -0,0 +1,24 @@
+from bisect import bisect_right
+from typing import List
+
+
+class LineIndex:
+    """Maps character offsets in a piece of text to (1-based) line numbers.
+
+    The offset of every line start is computed once, so each lookup is a binary search
+    instead of a scan through the text.
+    """
+
+    def __init__(self, text: str, first_line_number: int = 1):
+        self.first_line_number = first_line_number
+        self.line_offsets: List[int] = [0]
+
+        offset = text.find("\n")
+        while offset != -1:
+            self.line_offsets.append(offset + 1)
+            offset = text.find("\n", offset + 1)
+
+    def get_line_number(self, offset: int) -> int:
+        # Offsets that couldn't be found (-1) are treated as the start of the text
+        offset = max(offset, 0)
+        return bisect_right(self.line_offsets, offset) - 1 + self.first_line_number
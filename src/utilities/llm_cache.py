@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+import langchain
+from langchain.cache import BaseCache
+from langchain.schema import AIMessage, ChatGeneration, Generation
+
+CACHE_FILE_EXTENSION = ".json.z"
+
+
+class LLMResponseCache(BaseCache):
+    """Content-addressed, size-bounded on-disk cache of LLM responses.
+
+    LangChain hands the cache the rendered prompt and a string describing the LLM
+    (model, temperature, max_tokens, etc.), so every chain that runs through the
+    LLM (review, summarize, refactor, documentation QA) is covered.
+
+    Each entry is stored as a zlib-compressed JSON file named after the hash of its key.
+    When the directory grows past max_size_bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, directory: str, max_size_bytes: int):
+        self.directory = directory
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        # key -> size on disk, ordered from least to most recently used
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_size = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        # The modification time of each file is its last use, so that is what the LRU order is rebuilt from
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(CACHE_FILE_EXTENSION):
+                    stat = entry.stat()
+                    key = entry.name[: -len(CACHE_FILE_EXTENSION)]
+                    entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_size += size
+
+        logging.info(
+            f"Loaded LLM response cache from {self.directory} with {len(self._entries)} entries ({self._total_size} bytes)"
+        )
+
+    def _get_key(self, prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(
+            json.dumps([prompt, llm_string]).encode("utf-8")
+        ).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_EXTENSION)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        key = self._get_key(prompt, llm_string)
+
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+
+            try:
+                with open(self._get_path(key), "rb") as f:
+                    entry = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            except (OSError, zlib.error, ValueError) as e:
+                logging.warning(f"Discarding unreadable LLM cache entry {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            # Mark the entry as most recently used, both here and on disk
+            self._entries.move_to_end(key)
+            os.utime(self._get_path(key))
+            self.hits += 1
+
+        return [self._to_generation(g) for g in entry["generations"]]
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        key = self._get_key(prompt, llm_string)
+        entry = {"generations": [self._from_generation(g) for g in return_val]}
+        data = zlib.compress(json.dumps(entry).encode("utf-8"))
+
+        with self._lock:
+            with open(self._get_path(key), "wb") as f:
+                f.write(data)
+
+            if key in self._entries:
+                self._total_size -= self._entries.pop(key)
+
+            self._entries[key] = len(data)
+            self._total_size += len(data)
+
+            self._evict()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def _evict(self):
+        while self._total_size > self.max_size_bytes and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            logging.debug(f"Evicting LLM cache entry {key}")
+            self._remove(key)
+
+    def _remove(self, key: str):
+        self._total_size -= self._entries.pop(key, 0)
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _from_generation(self, generation: Generation) -> dict:
+        return {
+            "type": "chat" if isinstance(generation, ChatGeneration) else "text",
+            "text": generation.text,
+        }
+
+    def _to_generation(self, generation: dict) -> Generation:
+        if generation["type"] == "chat":
+            return ChatGeneration(message=AIMessage(content=generation["text"]))
+
+        return Generation(text=generation["text"])
+
+
+def configure_llm_cache(
+    cache_directory: Optional[str], max_size_mb: int
+) -> Optional[LLMResponseCache]:
+    if not cache_directory:
+        logging.info("No LLM cache directory specified, responses will not be cached")
+        return None
+
+    cache = LLMResponseCache(cache_directory, max_size_mb * 1024 * 1024)
+
+    # Every LLM created after this point will check the cache before calling out
+    langchain.llm_cache = cache
+
+    return cache
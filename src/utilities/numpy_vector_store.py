@@ -0,0 +1,180 @@
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+
+def maximal_marginal_relevance(
+    query_similarities: np.ndarray, candidate_vectors: np.ndarray, k: int, lambda_mult: float
+) -> List[int]:
+    """Pick k of the candidates (given most similar first) using MMR, returning their indexes.
+
+    candidate_vectors must be normalized, so that their dot products are cosine similarities.
+    """
+    if len(query_similarities) == 0:
+        return []
+
+    # Similarity of every candidate to every other candidate, computed once
+    candidate_similarities = candidate_vectors @ candidate_vectors.T
+
+    # Start with the most similar candidate, then repeatedly take the one with the best balance
+    # of relevance to the query against similarity to anything already selected
+    selected = [0]
+    max_selected_similarity = candidate_similarities[0].copy()
+    available = np.ones(len(query_similarities), dtype=bool)
+    available[0] = False
+
+    while len(selected) < min(k, len(query_similarities)):
+        scores = lambda_mult * query_similarities - (1 - lambda_mult) * max_selected_similarity
+        scores[~available] = -np.inf
+
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_selected_similarity, candidate_similarities[best], out=max_selected_similarity)
+
+    return selected
+
+
+class NumpyVectorStore(VectorStore):
+    """A vector store that lives entirely in memory, for indexes that only last one run.
+
+    The embeddings are kept in one contiguous float32 matrix with each row normalized up front,
+    so cosine similarity against every chunk is a single matrix-vector product, and MMR only
+    ever works on the (small) matrix of candidates.  There is nothing to start up or persist.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+
+        vectors = self._normalize(
+            np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        )
+        self._matrix = vectors if len(self.ids) == 0 else np.vstack([self._matrix, vectors])
+
+        self.ids.extend(ids)
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas if metadatas is not None else [{} for _ in texts])
+
+        return ids
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, kwargs.get("ids"))
+        return store
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [d for d, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        """Get the k most similar chunks, with their cosine similarity (higher is more similar)."""
+        similarities = self._get_similarities(embedding)
+        indexes = self._top_k(similarities, k)
+
+        return [(self._get_document(i), float(similarities[i])) for i in indexes]
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        # Cosine similarity is -1 to 1, relevance scores are expected to be 0 to 1
+        return [(d, (score + 1) / 2) for d, score in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        similarities = self._get_similarities(embedding)
+        candidates = self._top_k(similarities, fetch_k)
+        if len(candidates) == 0:
+            return []
+
+        selected = maximal_marginal_relevance(
+            similarities[candidates], self._matrix[candidates], k, lambda_mult
+        )
+
+        return [self._get_document(candidates[i]) for i in selected]
+
+    def _get_similarities(self, embedding: List[float]) -> np.ndarray:
+        if len(self.ids) == 0:
+            return np.zeros(0, dtype=np.float32)
+
+        query = self._normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        return self._matrix @ query
+
+    def _top_k(self, similarities: np.ndarray, k: int) -> np.ndarray:
+        # argpartition finds the top k without sorting everything, then only those get sorted
+        if k >= len(similarities):
+            return np.argsort(-similarities)
+
+        top = np.argpartition(-similarities, k)[:k]
+        return top[np.argsort(-similarities[top])]
+
+    def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Zero vectors are left as they are, rather than dividing by zero
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def _get_document(self, i: int) -> Document:
+        return Document(page_content=self.texts[i], metadata=self.metadatas[i])
@@ -0,0 +1,450 @@
+import csv
+import io
+import json
+import logging
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from utilities.embedding_index import get_chunk_id, get_removed_ids
+from utilities.numpy_vector_store import maximal_marginal_relevance
+
+DEFAULT_TABLE_NAME = "code_chunks"
+DEFAULT_COLLECTION_NAME = "default"
+
+# The approximate nearest neighbor indexes pgvector supports (or "none" for exact search)
+INDEX_TYPES = ["none", "hnsw", "ivfflat"]
+
+# Rows per list for IVFFlat, as recommended by pgvector (rows / 1000)
+IVFFLAT_ROWS_PER_LIST = 1000
+
+# IVFFlat indexes are rebuilt once the table has grown to this many times the lists they were built with
+IVFFLAT_REBUILD_FACTOR = 2
+
+# The most candidates an HNSW scan can be asked for (pgvector's limit on hnsw.ef_search)
+HNSW_MAX_EF_SEARCH = 1000
+
+# How much wider each search gets when the collection filter leaves fewer rows than were asked for
+SEARCH_WIDENING_FACTOR = 4
+
+
+class PGVectorStore(VectorStore):
+    """A vector store in Postgres (with the pgvector extension), shared by every run against a repository.
+
+    All of the chunks live in one table, partitioned by collection (e.g. the repository name).
+    Chunks are written in bulk (COPY when the driver is psycopg2, otherwise executemany) and
+    searched with plain SQL, so the top-k can be served by an HNSW or IVFFlat index.
+    Connections come from a pooled SQLAlchemy engine.
+
+    Requires sqlalchemy and a Postgres driver (see requirements-pgvector.txt), which are only
+    imported when this store is used.
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        embedding: Embeddings,
+        collection_name: str = DEFAULT_COLLECTION_NAME,
+        table_name: str = DEFAULT_TABLE_NAME,
+        index_type: str = "none",
+        pool_size: int = 5,
+    ):
+        import sqlalchemy
+
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Index type {index_type} is not supported, use one of {INDEX_TYPES}")
+
+        # The table name ends up in the SQL itself, so it can't be allowed to be anything else
+        if re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", table_name) is None:
+            raise ValueError(f"Invalid table name: {table_name}")
+
+        self.embedding = embedding
+        self.collection_name = collection_name
+        self.table_name = table_name
+        self.index_type = index_type
+        # The lists the IVFFlat index was built with, once known
+        self._ivfflat_lists = None
+        # The table (and the extension) only need setting up once
+        self._table_created = False
+
+        self.engine = sqlalchemy.create_engine(
+            connection_string, pool_size=pool_size, pool_pre_ping=True
+        )
+        self._text = sqlalchemy.text
+
+    def _create_table(self, dimensions: int):
+        # The vector column needs to know the dimensions, so this waits for the first embeddings
+        if self._table_created:
+            return
+
+        with self.engine.begin() as connection:
+            # Creating the extension needs more privileges than anything else here, so it's only
+            # attempted when it isn't there (e.g. a database administrator may have set it up already)
+            installed = connection.execute(
+                self._text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")
+            ).scalar()
+            if installed is None:
+                connection.execute(self._text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+            connection.execute(
+                self._text(
+                    f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+                        collection TEXT NOT NULL,
+                        id TEXT NOT NULL,
+                        document TEXT NOT NULL,
+                        metadata JSONB NOT NULL,
+                        embedding vector({dimensions}) NOT NULL,
+                        PRIMARY KEY (collection, id)
+                    )"""
+                )
+            )
+
+        self._table_created = True
+
+    def create_index(self):
+        """Create the configured approximate nearest neighbor index, if it doesn't already exist.
+
+        An IVFFlat index is also rebuilt when the table has outgrown the lists it was built with.
+        """
+        if self.index_type == "none":
+            return
+
+        index_name = f"{self.table_name}_embedding_{self.index_type}"
+
+        with self.engine.begin() as connection:
+            if self.index_type == "hnsw":
+                options = ""
+            else:
+                # IVFFlat picks its lists from the data, so it needs building once the data is there
+                rows = connection.execute(
+                    self._text(f"SELECT COUNT(*) FROM {self.table_name}")
+                ).scalar()
+                lists = max(1, rows // IVFFLAT_ROWS_PER_LIST)
+                options = f" WITH (lists = {lists})"
+
+                existing_lists = self._get_ivfflat_lists(connection, index_name)
+                if existing_lists is not None and lists >= existing_lists * IVFFLAT_REBUILD_FACTOR:
+                    logging.info(
+                        f"Rebuilding {index_name} with {lists} lists (it was built with {existing_lists})"
+                    )
+                    connection.execute(self._text(f"DROP INDEX IF EXISTS {index_name}"))
+                    existing_lists = None
+
+                # What the searches decide their probes from
+                self._ivfflat_lists = lists if existing_lists is None else existing_lists
+
+            connection.execute(
+                self._text(
+                    f"CREATE INDEX IF NOT EXISTS {index_name} "
+                    f"ON {self.table_name} USING {self.index_type} (embedding vector_cosine_ops){options}"
+                )
+            )
+
+    def _get_ivfflat_lists(self, connection, index_name: str) -> Optional[int]:
+        # The options an index was built with are kept in pg_class, e.g. ["lists=10"]
+        options = connection.execute(
+            self._text("SELECT reloptions FROM pg_class WHERE relname = :name AND relkind = 'i'"),
+            {"name": index_name},
+        ).scalar()
+
+        for option in options or []:
+            name, _, value = option.partition("=")
+            if name == "lists":
+                return int(value)
+
+        return None
+
+    def get_ids(self) -> List[str]:
+        return list(self.get_sources())
+
+    def get_sources(self) -> Dict[str, Optional[str]]:
+        """Get the source (file or package) of every chunk in the collection, by id."""
+        from sqlalchemy.exc import ProgrammingError
+
+        try:
+            with self.engine.connect() as connection:
+                rows = connection.execute(
+                    self._text(
+                        f"SELECT id, metadata->>'source' FROM {self.table_name} WHERE collection = :collection"
+                    ),
+                    {"collection": self.collection_name},
+                )
+                return {row[0]: row[1] for row in rows}
+        except ProgrammingError:
+            # Nothing has been stored yet, so there is no table
+            return {}
+
+    def delete(self, ids: List[str]):
+        if len(ids) == 0:
+            return
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                self._text(
+                    f"DELETE FROM {self.table_name} WHERE collection = :collection AND id = ANY(:ids)"
+                ),
+                {"collection": self.collection_name, "ids": list(ids)},
+            )
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if len(texts) == 0:
+            return []
+
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+
+        if ids is None:
+            ids = [
+                get_chunk_id(Document(page_content=t, metadata=m))
+                for t, m in zip(texts, metadatas)
+            ]
+
+        embeddings = self.embedding.embed_documents(texts)
+        self._create_table(len(embeddings[0]))
+
+        rows = [
+            (self.collection_name, id, text, json.dumps(metadata, default=str), self._to_vector(e))
+            for id, text, metadata, e in zip(ids, texts, metadatas, embeddings)
+        ]
+
+        with self.engine.begin() as connection:
+            # Straight to the driver's cursor, for COPY (and its executemany)
+            cursor = connection.connection.cursor()
+            try:
+                if hasattr(cursor, "copy_expert"):
+                    self._copy_rows(cursor, rows)
+                else:
+                    cursor.executemany(
+                        f"INSERT INTO {self.table_name} (collection, id, document, metadata, embedding) "
+                        "VALUES (%s, %s, %s, %s, %s) ON CONFLICT DO NOTHING",
+                        rows,
+                    )
+            finally:
+                cursor.close()
+
+        return ids
+
+    def _copy_rows(self, cursor, rows: List[tuple]):
+        # COPY into a temporary table, then move them across- another runner may have added
+        # some of the same chunks in the meantime, and COPY can't skip conflicts on its own
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE incoming_chunks (LIKE {self.table_name}) ON COMMIT DROP"
+        )
+        cursor.copy_expert(
+            "COPY incoming_chunks (collection, id, document, metadata, embedding) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        cursor.execute(
+            f"INSERT INTO {self.table_name} SELECT * FROM incoming_chunks ON CONFLICT DO NOTHING"
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "PGVectorStore":
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        store.create_index()
+        return store
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [d for d, _ in self.similarity_search_with_score(query, k)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [d for d, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4
+    ) -> List[Tuple[Document, float]]:
+        """Get the k most similar chunks, with their cosine similarity (higher is more similar)."""
+        return [
+            (Document(page_content=document, metadata=metadata), 1 - distance)
+            for document, metadata, distance, _ in self._query(embedding, k)
+        ]
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        # Cosine similarity is -1 to 1, relevance scores are expected to be 0 to 1
+        return [(d, (score + 1) / 2) for d, score in self.similarity_search_with_score(query, k)]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        # The database finds the candidates, and the MMR selection happens here
+        candidates = self._query(embedding, fetch_k, include_embeddings=True)
+        if len(candidates) == 0:
+            return []
+
+        vectors = np.asarray([c[3] for c in candidates], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+
+        selected = maximal_marginal_relevance(
+            np.asarray([1 - c[2] for c in candidates], dtype=np.float32),
+            vectors / norms,
+            k,
+            lambda_mult,
+        )
+
+        return [
+            Document(page_content=candidates[i][0], metadata=candidates[i][1]) for i in selected
+        ]
+
+    def _query(self, embedding: List[float], k: int, include_embeddings: bool = False) -> List[tuple]:
+        # Every collection shares the table's index, and the collection filter only sees the rows the
+        # index scan found- so other collections (e.g. other branches) can crowd this one out.  When
+        # fewer than k rows come back, search wider, until the search is exact.
+        breadth = 1
+        while True:
+            settings, exact = self._get_search_settings(k, breadth)
+            rows = self._search(embedding, k, include_embeddings, settings)
+            if len(rows) >= k or exact:
+                return rows
+
+            logging.debug(f"Found {len(rows)} of {k} rows in {self.collection_name}, searching wider")
+            breadth *= SEARCH_WIDENING_FACTOR
+
+    def _get_search_settings(self, k: int, breadth: int) -> Tuple[List[str], bool]:
+        """Get the settings for an index scan breadth times wider than the default, and whether it's exact."""
+        if self.index_type == "hnsw":
+            # An HNSW scan only ever finds ef_search rows (40 by default), however many are asked for
+            ef_search = max(int(k), 40) * breadth
+            if ef_search > HNSW_MAX_EF_SEARCH:
+                # As wide as HNSW goes, so skip the index altogether
+                return ["SET LOCAL enable_indexscan = off"], True
+
+            return [f"SET LOCAL hnsw.ef_search = {ef_search}"], False
+
+        if self.index_type == "ivfflat":
+            lists = self._get_lists()
+            if lists is None:
+                # No index yet, so the search is exact anyway
+                return [], True
+
+            # An IVFFlat scan only looks in ivfflat.probes lists (1 by default)- pgvector suggests sqrt(lists)
+            probes = math.ceil(math.sqrt(lists)) * breadth
+            if probes >= lists:
+                return [f"SET LOCAL ivfflat.probes = {lists}"], True
+
+            return [f"SET LOCAL ivfflat.probes = {probes}"], False
+
+        return [], True
+
+    def _get_lists(self) -> Optional[int]:
+        if self._ivfflat_lists is None:
+            with self.engine.connect() as connection:
+                self._ivfflat_lists = self._get_ivfflat_lists(
+                    connection, f"{self.table_name}_embedding_ivfflat"
+                )
+
+        return self._ivfflat_lists
+
+    def _search(
+        self, embedding: List[float], k: int, include_embeddings: bool, settings: List[str]
+    ) -> List[tuple]:
+        # Ordering by the distance operator itself is what lets Postgres use the ANN index
+        columns = "document, metadata, embedding <=> CAST(:query AS vector) AS distance"
+        if include_embeddings:
+            columns += ", embedding::text"
+
+        with self.engine.begin() as connection:
+            # SET LOCAL only lasts for this transaction
+            for setting in settings:
+                connection.execute(self._text(setting))
+
+            rows = connection.execute(
+                self._text(
+                    f"SELECT {columns} FROM {self.table_name} WHERE collection = :collection "
+                    "ORDER BY embedding <=> CAST(:query AS vector) LIMIT :k"
+                ),
+                {"query": self._to_vector(embedding), "collection": self.collection_name, "k": k},
+            ).fetchall()
+
+        return [
+            (
+                row[0],
+                row[1] if isinstance(row[1], dict) else json.loads(row[1]),
+                float(row[2]),
+                json.loads(row[3]) if include_embeddings else None,
+            )
+            for row in rows
+        ]
+
+    def _to_vector(self, embedding: List[float]) -> str:
+        # pgvector's text format, which is the same as a JSON array
+        return "[" + ",".join(repr(float(v)) for v in embedding) + "]"
+
+
+def get_pgvector_index(
+    documents: List[Document], store: PGVectorStore, scope_paths: Optional[List[str]] = None
+) -> PGVectorStore:
+    """Bring the collection in store up to date with documents, in the same way as get_persistent_index."""
+    current = {get_chunk_id(d): d for d in documents}
+    existing_sources = store.get_sources()
+    existing_ids = set(existing_sources)
+
+    removed_ids = get_removed_ids(existing_sources, current, scope_paths)
+    new_ids = [i for i in current if i not in existing_ids]
+
+    logging.info(
+        f"pgvector collection {store.collection_name}: {len(new_ids)} chunks to add, "
+        f"{len(removed_ids)} to remove, {len(current) - len(new_ids)} unchanged"
+    )
+
+    store.delete(removed_ids)
+    store.add_texts(
+        [current[i].page_content for i in new_ids],
+        [current[i].metadata for i in new_ids],
+        new_ids,
+    )
+
+    if len(new_ids) > 0:
+        store.create_index()
+
+    return store
@@ -0,0 +1,36 @@
+import logging
+import random
+import time
+from typing import Any, Callable, Optional
+
+
+def call_with_retry(
+    func: Callable[[], Any],
+    get_retry_delay: Callable[[Exception], Optional[float]],
+    max_attempts: int = 5,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+) -> Any:
+    """Call func, retrying with exponential backoff when it raises a retryable exception.
+
+    get_retry_delay decides whether an exception is retryable: it returns None if it isn't,
+    otherwise the number of seconds the server asked us to wait (or 0 to just use the backoff).
+    """
+    attempt = 1
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            retry_delay = get_retry_delay(e)
+            if retry_delay is None or attempt >= max_attempts:
+                raise
+
+            # Exponential backoff with a little jitter, unless the server told us how long to wait
+            backoff = min(max_delay, base_delay * (2 ** (attempt - 1)))
+            delay = max(retry_delay, backoff + random.uniform(0, base_delay))
+
+            logging.warning(
+                f"Attempt {attempt} of {max_attempts} failed ({e}), retrying in {delay:.1f} seconds"
+            )
+            time.sleep(delay)
+            attempt += 1
@@ -1,12 +1,120 @@
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional
+
 import tiktoken
 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
-    """Return the number of tokens used by a list of messages."""
+DEFAULT_ENCODING = "cl100k_base"
+
+# Upper bound on the total length of the strings whose token counts are remembered
+MAX_CACHED_CHARACTERS = 16 * 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    # Loading an encoding is expensive, so only ever do it once per process
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def get_encoding_name_for_model(model: Optional[str]) -> str:
+    if model is None:
+        return DEFAULT_ENCODING
+
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model).name
     except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        logging.warning(f"Model {model} not found, using the {DEFAULT_ENCODING} encoding")
+        return DEFAULT_ENCODING
+
+
+class TokenizerService:
+    """Counts tokens using a shared encoding, remembering the counts for strings it has already seen.
+
+    The text splitters ask for the length of the same (overlapping) strings over and over,
+    so the counts are kept in a bounded LRU cache.  Safe to use from multiple threads.
+    """
+
+    def __init__(self, encoding_name: str = DEFAULT_ENCODING, max_cached_characters: int = MAX_CACHED_CHARACTERS):
+        self.encoding = get_encoding(encoding_name)
+        self.max_cached_characters = max_cached_characters
+
+        self._lock = threading.Lock()
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._cached_characters = 0
+
+    def _get_cached(self, text: str) -> Optional[int]:
+        with self._lock:
+            count = self._counts.get(text, None)
+            if count is not None:
+                self._counts.move_to_end(text)
+            return count
+
+    def _set_cached(self, text: str, count: int):
+        # Don't let one giant string push everything else out
+        if len(text) > self.max_cached_characters // 16:
+            return
+
+        with self._lock:
+            if text in self._counts:
+                return
+
+            self._counts[text] = count
+            self._cached_characters += len(text)
+
+            while self._cached_characters > self.max_cached_characters:
+                evicted, _ = self._counts.popitem(last=False)
+                self._cached_characters -= len(evicted)
+
+    def encode(self, text: str) -> List[int]:
+        return self.encoding.encode(text)
+
+    def encode_batch(self, texts: List[str]) -> List[List[int]]:
+        return self.encoding.encode_batch(texts)
+
+    def count_tokens(self, text: str) -> int:
+        count = self._get_cached(text)
+        if count is None:
+            count = len(self.encoding.encode(text))
+            self._set_cached(text, count)
+
+        return count
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        counts = [self._get_cached(text) for text in texts]
+
+        # Only encode what we haven't seen, and do it in one batch (tiktoken parallelizes this)
+        missing = list({texts[i] for i, count in enumerate(counts) if count is None})
+        if len(missing) > 0:
+            missing_counts = dict(
+                zip(missing, [len(tokens) for tokens in self.encode_batch(missing)])
+            )
+            for text, count in missing_counts.items():
+                self._set_cached(text, count)
+
+            counts = [
+                missing_counts[text] if count is None else count
+                for text, count in zip(texts, counts)
+            ]
+
+        return counts
+
+
+@lru_cache(maxsize=None)
+def _get_tokenizer_for_encoding(encoding_name: str) -> TokenizerService:
+    return TokenizerService(encoding_name)
+
+
+def get_tokenizer(model: Optional[str] = None) -> TokenizerService:
+    """Get the shared tokenizer for a model (or the default encoding if no model is given)."""
+    return _get_tokenizer_for_encoding(get_encoding_name_for_model(model))
+
+
+def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
+    """Return the number of tokens used by a list of messages."""
+    encoding = get_encoding(get_encoding_name_for_model(model))
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -21,10 +129,10 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
         tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
         tokens_per_name = -1  # if there's a name, the role is omitted
     elif "gpt-3.5-turbo" in model:
-        print("Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
+        logging.warning("gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613.")
         return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
-        print("Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
+        logging.warning("gpt-4 may update over time. Returning num tokens assuming gpt-4-0613.")
         return num_tokens_from_messages(messages, model="gpt-4-0613")
     else:
         raise NotImplementedError(
@@ -41,5 +149,4 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0613"):
     return num_tokens
 
 def simple_get_tokens_for_message(value):
-    encoding = tiktoken.get_encoding("cl100k_base")
-    return len(encoding.encode(value))
\ No newline at end of file
+    return get_tokenizer().count_tokens(value)
@@ -0,0 +1,97 @@
+import logging
+from enum import Enum
+
+from review.chunk_packer import pack_chunks
+
+
+class Language(str, Enum):
+    PYTHON = "python"
+    JS = "js"
+
+
+def get_documents(*chunks):
+    """Chunks are (file_path, language, starting line, ending line, size in tokens)."""
+    return {
+        "documents": ["x" * size for _, _, _, _, size in chunks],
+        "metadatas": [
+            {
+                "file_path": file_path,
+                "language": language,
+                "starting_line_number": start,
+                "ending_line_number": end,
+            }
+            for file_path, language, start, end, _ in chunks
+        ],
+    }
+
+
+def count_tokens(texts):
+    # One token per "x", ignoring the headers and footers
+    return [text.count("x") for text in texts]
+
+
+def test_pack_chunks_first_fit():
+    documents = get_documents(
+        ("a.py", Language.PYTHON, 1, 10, 60),
+        ("a.py", Language.PYTHON, 11, 20, 50),
+        ("b.py", Language.PYTHON, 1, 5, 30),
+        ("c.py", Language.PYTHON, 1, 5, 250),
+    )
+
+    packs = pack_chunks(documents, 100, count_tokens)
+
+    # b.py fits back into the first pack, and the oversized chunk gets a pack of its own
+    assert [[s.index for s in pack.segments] for pack in packs] == [[0, 2], [1], [3]]
+    assert [pack.tokens for pack in packs] == [90, 50, 250]
+    assert all(pack.tokens <= 100 for pack in packs[:-1])
+
+
+def test_pack_chunks_mixes_languages():
+    documents = get_documents(
+        ("a.py", Language.PYTHON, 1, 10, 10),
+        ("b.js", Language.JS, 1, 10, 10),
+        ("c.py", Language.PYTHON, 1, 10, 10),
+    )
+
+    (pack,) = pack_chunks(documents, 100, count_tokens)
+
+    assert pack.language == "python, js"
+    assert pack.code.index("BEGIN FILE: a.py") < pack.code.index("BEGIN FILE: b.js")
+
+
+def get_pack():
+    documents = get_documents(
+        ("a.py", Language.PYTHON, 1, 10, 10),
+        ("a.py", Language.PYTHON, 11, 20, 10),
+        ("b.py", Language.PYTHON, 50, 60, 10),
+    )
+    (pack,) = pack_chunks(documents, 100, count_tokens)
+    return pack
+
+
+def test_find_segment_uses_file_and_line():
+    pack = get_pack()
+
+    assert pack.find_segment("a.py", 15).index == 1
+    assert pack.find_segment("b.py", 55).index == 2
+
+
+def test_find_segment_falls_back_to_line_for_unknown_file(caplog):
+    pack = get_pack()
+
+    with caplog.at_level(logging.WARNING):
+        segment = pack.find_segment("src/b.py", 55)
+
+    assert segment.index == 2
+    assert "isn't in the pack" in caplog.text
+
+
+def test_find_segment_logs_misattributed_line(caplog):
+    pack = get_pack()
+
+    # The LLM put the line from b.py on a.py, so it can only go on a.py's first chunk
+    with caplog.at_level(logging.WARNING):
+        segment = pack.find_segment("a.py", 55)
+
+    assert segment.index == 0
+    assert "No chunk of a.py contains line 55" in caplog.text
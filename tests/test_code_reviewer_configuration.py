@@ -0,0 +1,36 @@
+import pytest
+
+from code_reviewer_configuration import get_default_vector_store_collection
+
+REF_VARIABLES = [
+    "GITHUB_REPOSITORY",
+    "CI_PROJECT_PATH",
+    "GITHUB_HEAD_REF",
+    "GITHUB_REF_NAME",
+    "CI_MERGE_REQUEST_SOURCE_BRANCH_NAME",
+    "CI_COMMIT_REF_NAME",
+    "CR_SOURCE_BRANCH",
+]
+
+
+@pytest.fixture(autouse=True)
+def clean_environment(monkeypatch):
+    for name in REF_VARIABLES:
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_default_collection_is_per_branch(monkeypatch):
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
+    monkeypatch.setenv("GITHUB_REF_NAME", "main")
+    assert get_default_vector_store_collection() == "owner/repo@main"
+
+
+def test_default_collection_uses_pull_request_head_branch(monkeypatch):
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
+    monkeypatch.setenv("GITHUB_HEAD_REF", "feature")
+    monkeypatch.setenv("GITHUB_REF_NAME", "12/merge")
+    assert get_default_vector_store_collection() == "owner/repo@feature"
+
+
+def test_default_collection_without_repository():
+    assert get_default_vector_store_collection() is None
@@ -0,0 +1,38 @@
+from langchain.text_splitter import Language
+
+from utilities.code_splitter import CodeSplitter
+
+
+class WordTokenizer:
+    def count_tokens_batch(self, texts):
+        return [len(text.split()) for text in texts]
+
+
+CODE = """import os
+
+
+def first():
+    return "page\x0cbreak\u2028separator"
+
+\x0c
+def second():
+    return os.getcwd()
+"""
+
+
+def test_split_text_keeps_chunks_on_definition_lines():
+    splitter = CodeSplitter(Language.PYTHON, 6, WordTokenizer())
+
+    chunks = splitter.split_text_with_offsets(CODE)
+
+    # Form feeds and other separators aren't line endings, so the chunks still line up with the definitions
+    assert [chunk.split("\n")[0] for chunk, _ in chunks] == ["import os", "def first():", "def second():"]
+    for chunk, start_index in chunks:
+        assert CODE[start_index:].startswith(chunk)
+
+
+def test_split_text_round_trips_lines():
+    splitter = CodeSplitter(Language.PYTHON, 1000, WordTokenizer())
+
+    assert splitter.split_text(CODE) == [CODE.rstrip()]
+    assert splitter.split_text("") == []
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from utilities.concurrency import ordered_concurrent_map, run_concurrently
+
+
+def slow_square(item):
+    # Earlier items take longer, so they finish out of order
+    time.sleep(0.01 * (5 - item))
+    return item * item
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_results_keep_input_order(max_concurrency):
+    results = list(ordered_concurrent_map(slow_square, range(5), max_concurrency))
+
+    assert [r.item for r in results] == [0, 1, 2, 3, 4]
+    assert [r.result for r in results] == [0, 1, 4, 9, 16]
+    assert all(r.succeeded for r in results)
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_exceptions_are_captured_per_item(max_concurrency):
+    def fail_on_two(item):
+        if item == 2:
+            raise ValueError("two")
+        return item
+
+    results = run_concurrently(fail_on_two, range(4), max_concurrency)
+
+    assert [r.succeeded for r in results] == [True, True, False, True]
+    assert isinstance(results[2].error, ValueError)
+    assert results[3].result == 3
+
+
+def test_calls_in_flight_are_limited():
+    lock = threading.Lock()
+    in_flight = [0]
+    most_in_flight = [0]
+
+    def track(item):
+        with lock:
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+
+    run_concurrently(track, range(10), 3)
+
+    assert 1 < most_in_flight[0] <= 3
+
+
+def test_results_are_yielded_as_they_complete():
+    release = threading.Event()
+
+    def wait_for_release(item):
+        if item == 1:
+            release.wait(5)
+        return item
+
+    results = ordered_concurrent_map(wait_for_release, range(2), 2)
+
+    # The first result is available while the second call is still blocked
+    assert next(results).result == 0
+    release.set()
+    assert next(results).result == 1
+
+
+def test_empty_input():
+    assert run_concurrently(slow_square, [], 4) == []
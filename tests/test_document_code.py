@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+from langchain.docstore.document import Document
+
+from document.document_code import DocumentCode
+from document.document_manifest import DocumentManifest
+
+TEMPLATE = """# Overview
+[Prompt] What does this do?
+
+## Modules
+[Prompt] List the modules
+
+## Usage
+[Prompt] How is it used?
+"""
+
+
+class FakeRetriever:
+    def __init__(self, sources):
+        # Question -> content hashes of the summaries it retrieves
+        self.sources = sources
+
+    def get_relevant_documents(self, question):
+        return [
+            Document(page_content=f"summary {h}", metadata={"content_hash": h})
+            for h in self.sources[question]
+        ]
+
+
+class FakeQAChain:
+    def __init__(self):
+        self.questions = []
+
+    def run(self, input_documents, question):
+        self.questions.append(question)
+        return f"{question} ({len(self.questions)})"
+
+
+def get_documenter():
+    # Skip the constructor, which sets up the LLM
+    documenter = DocumentCode.__new__(DocumentCode)
+    documenter.configuration = SimpleNamespace(max_concurrency=2)
+    documenter.qa_chain = FakeQAChain()
+    # Every retrieved summary fits
+    documenter.get_relevant_summaries = lambda retriever, question: retriever.get_relevant_documents(
+        question
+    )
+    return documenter
+
+
+def render(manifest_path, retriever, existing_contents=None):
+    documenter = get_documenter()
+    manifest = DocumentManifest(manifest_path)
+    document = documenter.render_template(TEMPLATE, retriever, None, manifest, existing_contents)
+    manifest.save()
+    return document, documenter.qa_chain.questions
+
+
+def test_update_keeps_sections_with_the_same_sources(tmp_path):
+    manifest_path = str(tmp_path / "doc.md.manifest.json")
+    retriever = FakeRetriever(
+        {
+            "what does this do?": ["a", "b"],
+            "list the modules": ["a", "b", "c"],
+            "how is it used?": ["c"],
+        }
+    )
+
+    document, questions = render(manifest_path, retriever)
+    assert len(questions) == 3
+
+    updated, questions = render(manifest_path, retriever, document)
+    assert updated == document
+    assert questions == []
+
+
+def test_update_regenerates_sections_whose_sources_changed(tmp_path):
+    manifest_path = str(tmp_path / "doc.md.manifest.json")
+    retriever = FakeRetriever(
+        {
+            "what does this do?": ["a", "b"],
+            "list the modules": ["a", "b"],
+            "how is it used?": ["c"],
+        }
+    )
+    document, _ = render(manifest_path, retriever)
+
+    # A new file (d) is now retrieved for the modules, and the summary behind usage changed (c -> e)
+    retriever.sources["list the modules"] = ["a", "b", "d"]
+    retriever.sources["how is it used?"] = ["e"]
+    updated, questions = render(manifest_path, retriever, document)
+
+    assert questions == ["list the modules", "how is it used?"]
+    assert "what does this do? (1)" in updated
+    assert "list the modules (1)" in updated
+    assert "how is it used? (2)" in updated
+
+
+def test_update_survives_hand_edited_document(tmp_path):
+    manifest_path = str(tmp_path / "doc.md.manifest.json")
+    retriever = FakeRetriever(
+        {
+            "what does this do?": ["a"],
+            "list the modules": ["b"],
+            "how is it used?": ["c"],
+        }
+    )
+    document, _ = render(manifest_path, retriever)
+
+    # Editing a heading only loses the sections on either side of it
+    edited = document.replace("## Modules", "## All of the modules")
+    _, questions = render(manifest_path, retriever, edited)
+
+    assert questions == ["what does this do?", "list the modules"]
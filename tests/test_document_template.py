@@ -0,0 +1,76 @@
+from document.document_template import parse_template, split_document
+
+TEMPLATE = """# Overview
+[Prompt] What does this do?
+
+## Modules
+[Prompt] List the modules
+"""
+
+
+def render(segments, answers):
+    texts = [answers.pop(0) if s.is_prompt else s.text for s in segments]
+    return "".join(texts), [len(t) for t in texts]
+
+
+def test_parse_template_round_trips():
+    for template in [TEMPLATE, TEMPLATE.replace("\n", "\r\n"), TEMPLATE.rstrip("\n"), ""]:
+        segments = parse_template(template)
+        assert "".join(s.text for s in segments) == template
+
+
+def test_parse_template_finds_prompts():
+    segments = parse_template(TEMPLATE)
+
+    assert [s.question for s in segments] == [
+        None,
+        "what does this do?",
+        None,
+        "list the modules",
+        None,
+    ]
+    assert segments[1].text == "[Prompt] What does this do?"
+
+
+def test_parse_template_only_splits_lines_on_newlines():
+    # A form feed isn't a line ending, so the prompt after it is literal text
+    segments = parse_template("Page 1\f[Prompt] Not a prompt\n[Prompt] A prompt")
+
+    assert [s.question for s in segments] == [None, "a prompt"]
+
+
+def test_split_document_with_lengths():
+    segments = parse_template(TEMPLATE)
+    document, lengths = render(segments, ["It reviews code", "One\n\n## Modules\nTwo"])
+
+    # The answer to the second prompt contains the literal before it, which only the lengths get right
+    assert split_document(segments, document, lengths) == {
+        1: "It reviews code",
+        3: "One\n\n## Modules\nTwo",
+    }
+
+
+def test_split_document_without_lengths():
+    segments = parse_template(TEMPLATE)
+    document, _ = render(segments, ["It reviews code", "app.py"])
+
+    assert split_document(segments, document) == {1: "It reviews code", 3: "app.py"}
+
+
+def test_split_document_falls_back_when_lengths_are_stale():
+    segments = parse_template(TEMPLATE)
+    document, lengths = render(segments, ["It reviews code", "app.py"])
+    edited = document.replace("It reviews code", "It reviews code, and documents it")
+
+    assert split_document(segments, edited, lengths) == {
+        1: "It reviews code, and documents it",
+        3: "app.py",
+    }
+
+
+def test_split_document_leaves_out_prompts_next_to_edited_literals():
+    segments = parse_template(TEMPLATE)
+    document, _ = render(segments, ["It reviews code", "app.py"])
+    edited = document.replace("## Modules", "## All of the modules")
+
+    assert split_document(segments, edited) == {}
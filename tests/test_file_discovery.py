@@ -0,0 +1,102 @@
+import os
+import subprocess
+
+import pytest
+
+from utilities.file_discovery import GitIgnoreRule, discover_source_files
+
+
+def matches(pattern, path, is_directory=False, base="/repo"):
+    return GitIgnoreRule(pattern, base).matches(os.path.join(base, path), is_directory)
+
+
+def test_unanchored_patterns_match_at_any_depth():
+    assert matches("*.log", "debug.log")
+    assert matches("*.log", "logs/deep/debug.log")
+    assert not matches("*.log", "debug.log.txt")
+    assert matches("build", "src/build", is_directory=True)
+
+
+def test_slash_anchors_pattern():
+    assert matches("/build", "build", is_directory=True)
+    assert not matches("/build", "src/build", is_directory=True)
+    assert matches("docs/*.md", "docs/index.md")
+    assert not matches("docs/*.md", "src/docs/index.md")
+    assert not matches("docs/*.md", "docs/api/index.md")
+
+
+def test_directory_only_patterns():
+    assert matches("cache/", "cache", is_directory=True)
+    assert not matches("cache/", "cache")
+
+
+def test_double_star():
+    assert matches("**/fixtures", "tests/unit/fixtures", is_directory=True)
+    assert matches("**/fixtures", "fixtures", is_directory=True)
+    assert matches("vendor/**", "vendor/lib/a.py")
+    assert matches("a/**/b", "a/b")
+    assert matches("a/**/b", "a/x/y/b")
+
+
+def test_wildcards_and_character_classes():
+    assert matches("file?.py", "file1.py")
+    assert not matches("file?.py", "dir/file/.py")
+    assert matches("file[0-9].py", "file3.py")
+    assert not matches("file[!0-9].py", "file3.py")
+    assert matches("file[!0-9].py", "filea.py")
+
+
+def test_negation_and_escapes():
+    rule = GitIgnoreRule("!keep.log", "/repo")
+    assert rule.negate
+    assert rule.matches("/repo/keep.log", False)
+
+    assert matches("\\!important", "!important")
+    assert matches("\\#notes", "#notes")
+
+
+def test_rules_only_apply_under_their_directory():
+    assert matches("*.py", "a.py", base="/repo/src")
+    assert not GitIgnoreRule("*.py", "/repo/src").matches("/repo/a.py", False)
+    assert not GitIgnoreRule("*.py", "/repo/src").matches("/repo/srcx/a.py", False)
+
+
+def git(directory, *args):
+    subprocess.run(["git", *args], cwd=directory, check=True, capture_output=True)
+
+
+def test_discover_source_files_uses_repository_excludes(tmp_path, monkeypatch):
+    try:
+        git(tmp_path, "init", "-q")
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("git is not available")
+
+    # Keep the user's own global ignore file out of it
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+
+    excludes_file = tmp_path.parent / f"{tmp_path.name}-excludes"
+    excludes_file.write_text("*.gen.py\n")
+    git(tmp_path, "config", "core.excludesFile", str(excludes_file))
+
+    (tmp_path / ".git" / "info").mkdir(exist_ok=True)
+    (tmp_path / ".git" / "info" / "exclude").write_text("scratch/\n")
+    # .gitignore files take precedence over both
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / ".gitignore").write_text("!keep.gen.py\n")
+
+    for path in ["app.py", "model.gen.py", "scratch/notes.py", "src/keep.gen.py", "src/other.gen.py"]:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("pass\n")
+
+    found = [
+        os.path.relpath(path, str(tmp_path))
+        for path in discover_source_files(
+            [os.path.join(str(tmp_path), "src"), str(tmp_path)], supported_extensions=["py"]
+        )
+    ]
+
+    assert found == [
+        os.path.join("src", "keep.gen.py"),
+        "app.py",
+        os.path.join("src", "keep.gen.py"),
+    ]
@@ -0,0 +1,81 @@
+import os
+import subprocess
+
+import pytest
+
+from utilities.git_helper import get_changed_hunks, parse_unified_diff, unquote_git_path
+
+
+def test_unquote_git_path():
+    assert unquote_git_path("b/app.py") == "b/app.py"
+    assert unquote_git_path('"b/caf\\303\\251.py"') == "b/café.py"
+    assert unquote_git_path('"b/tab\\there \\"quoted\\" back\\\\slash.py"') == 'b/tab\there "quoted" back\\slash.py'
+
+
+def test_parse_unified_diff_paths():
+    diff = "\n".join(
+        [
+            "diff --git a/app.py b/app.py",
+            "--- a/app.py",
+            "+++ b/app.py",
+            "@@ -1 +1,2 @@",
+            "+++ not a header",
+            'diff --git "a/caf\\303\\251.py" "b/caf\\303\\251.py"',
+            '--- "a/caf\\303\\251.py"',
+            '+++ "b/caf\\303\\251.py"',
+            "@@ -3,0 +4 @@",
+            "diff --git a/with space.py b/with space.py",
+            "--- a/with space.py\t",
+            "+++ b/with space.py\t",
+            "@@ -10 +10,3 @@",
+            "diff --git a/gone.py b/gone.py",
+            "--- a/gone.py",
+            "+++ /dev/null",
+            "@@ -1,2 +0,0 @@",
+        ]
+    )
+
+    assert parse_unified_diff(diff) == {
+        "app.py": [(1, 2)],
+        "café.py": [(4, 4)],
+        "with space.py": [(10, 12)],
+    }
+
+
+def git(directory, *args):
+    subprocess.run(["git", *args], cwd=directory, check=True, capture_output=True)
+
+
+@pytest.fixture
+def repository(tmp_path):
+    try:
+        git(tmp_path, "init", "-q", "-b", "main")
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("git is not available")
+
+    git(tmp_path, "config", "user.email", "test@example.com")
+    git(tmp_path, "config", "user.name", "Test")
+    # Without explicit prefixes, this would leave the paths in the diff without "b/"
+    git(tmp_path, "config", "diff.noprefix", "true")
+    git(tmp_path, "config", "core.quotePath", "true")
+
+    (tmp_path / "app.py").write_text("a\nb\nc\n")
+    git(tmp_path, "add", ".")
+    git(tmp_path, "commit", "-q", "-m", "Initial")
+    git(tmp_path, "checkout", "-q", "-b", "feature")
+    return tmp_path
+
+
+def test_get_changed_hunks_ignores_diff_config(repository):
+    (repository / "app.py").write_text("a\nchanged\nc\n")
+    (repository / "café.py").write_text("new\n")
+    git(repository, "add", ".")
+    git(repository, "commit", "-q", "-m", "Change")
+
+    hunks = get_changed_hunks("main", "feature", cwd=str(repository))
+
+    root = os.path.realpath(str(repository))
+    assert {os.path.relpath(os.path.realpath(p), root): r for p, r in hunks.items()} == {
+        "app.py": [(2, 2)],
+        "café.py": [(1, 1)],
+    }
@@ -0,0 +1,282 @@
+"""Tests for posting reviews to GitHub.
+
+Most of these run against FakePullRequest, which stands in for PyGithub's PullRequest.  The
+tests at the end run the real PyGithub client against FakeGitHubServer (a local http.server),
+so the requests it sends, its pagination and its own retries are covered as well.  PyGithub
+retries rate limits (429, and 403s that say they are rate limits) itself, honouring Retry-After,
+so call_with_retry only sees the ones it has given up on.
+"""
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import pytest
+from github import GithubException
+
+import utilities.retry
+from integrations.github_integration import GitHubIntegration, get_github_retry_delay
+from review.code_comment import CodeComment
+
+# Lines 1-10 of app.py are in the diff
+PATCH = "@@ -1,5 +1,10 @@\n" + "\n".join(f"+line {i}" for i in range(1, 11))
+
+
+class FakePullRequest:
+    """Keeps the reviews posted to it, and hands them back like GitHub does."""
+
+    def __init__(self, failures=None):
+        self.reviews = []
+        self.review_comments = []
+        self.attempts = 0
+        # Exceptions to raise from the next create_review calls
+        self.failures = list(failures or [])
+
+    def get_files(self):
+        return [SimpleNamespace(filename="app.py", patch=PATCH)]
+
+    def get_review_comments(self):
+        return self.review_comments
+
+    def get_reviews(self):
+        return self.reviews
+
+    def create_review(self, body, event, comments):
+        self.attempts += 1
+        if len(self.failures) > 0:
+            raise self.failures.pop(0)
+
+        assert event == "COMMENT"
+        self.reviews.append(SimpleNamespace(body=body, comments=comments))
+        self.review_comments.extend(
+            SimpleNamespace(
+                path=c["path"], start_line=c.get("start_line"), line=c["line"], body=c["body"]
+            )
+            for c in comments
+        )
+
+
+def get_integration(pr, max_comments_per_review=50):
+    # Skip the constructor, which creates a real client
+    integration = GitHubIntegration.__new__(GitHubIntegration)
+    integration.max_comments_per_review = max_comments_per_review
+    integration.github = SimpleNamespace(
+        get_repo=lambda name: SimpleNamespace(get_pull=lambda number: pr)
+    )
+    return integration
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITHUB_REPOSITORY", "owner/repo")
+    monkeypatch.setenv("GITHUB_PR", "1")
+    monkeypatch.setenv("GITHUB_WORKSPACE", str(tmp_path))
+    monkeypatch.delenv("GITHUB_OUTPUT", raising=False)
+
+    # Retries shouldn't actually wait
+    sleeps = []
+    monkeypatch.setattr(utilities.retry.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def get_comments(tmp_path, count):
+    path = os.path.join(str(tmp_path), "app.py")
+    comments = [CodeComment(f"Comment {i}", start=i, file_path=path) for i in range(1, count + 1)]
+    comments.append(CodeComment("Range", start=2, end=4, file_path=path))
+    comments.append(CodeComment("Outside the diff", start=50, file_path=path))
+    return comments
+
+
+def test_add_pr_comments_batches_reviews(tmp_path):
+    pr = FakePullRequest()
+
+    get_integration(pr, max_comments_per_review=2).add_pr_comments(get_comments(tmp_path, 4))
+
+    assert [len(review.comments) for review in pr.reviews] == [2, 2, 1]
+    assert pr.reviews[0].body.startswith("Code review found 6 comments.")
+    assert "**app.py** (line 50): Outside the diff" in pr.reviews[0].body
+    assert pr.reviews[1].body == "Code review continued (part 2 of 3)"
+
+    multi_line = pr.reviews[2].comments[0]
+    assert (multi_line["start_line"], multi_line["line"], multi_line["side"]) == (2, 4, "RIGHT")
+
+
+def test_add_pr_comments_is_idempotent(tmp_path):
+    pr = FakePullRequest()
+    integration = get_integration(pr, max_comments_per_review=2)
+
+    integration.add_pr_comments(get_comments(tmp_path, 4))
+    attempts = pr.attempts
+
+    integration.add_pr_comments(get_comments(tmp_path, 4))
+
+    assert pr.attempts == attempts
+
+
+def test_add_pr_comments_only_posts_new_comments(tmp_path):
+    pr = FakePullRequest()
+    integration = get_integration(pr)
+
+    integration.add_pr_comments(get_comments(tmp_path, 2))
+    integration.add_pr_comments(get_comments(tmp_path, 3))
+
+    # The summary changed (there are more comments), and only the new inline comment is posted
+    assert len(pr.reviews) == 2
+    assert [c["body"] for c in pr.reviews[1].comments] == ["Comment 3"]
+
+
+def test_add_pr_comments_retries_rate_limits(tmp_path, environment):
+    pr = FakePullRequest(
+        failures=[GithubException(429, {"message": "Too many requests"}, {"Retry-After": "7"})]
+    )
+
+    get_integration(pr).add_pr_comments(get_comments(tmp_path, 1))
+
+    assert pr.attempts == 2
+    assert len(pr.reviews) == 1
+    assert environment[0] >= 7
+
+
+def test_add_pr_comments_does_not_retry_other_errors(tmp_path):
+    pr = FakePullRequest(failures=[GithubException(422, {"message": "Unprocessable"}, {})])
+
+    with pytest.raises(GithubException):
+        get_integration(pr).add_pr_comments(get_comments(tmp_path, 1))
+
+    assert pr.attempts == 1
+
+
+def test_get_github_retry_delay():
+    assert get_github_retry_delay(GithubException(429, {}, {"Retry-After": "3"})) == 3.0
+    assert get_github_retry_delay(GithubException(403, {"message": "API rate limit exceeded"}, {})) == 0.0
+    assert get_github_retry_delay(GithubException(403, {"message": "Resource not accessible"}, {})) is None
+    assert get_github_retry_delay(ValueError("not from GitHub")) is None
+
+
+class FakeGitHubServer(ThreadingHTTPServer):
+    """Just enough of the GitHub REST API for a pull request review, with the changed files split over two pages."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeGitHubHandler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.reviews = []
+        self.review_attempts = 0
+        self.requested_paths = []
+        # (status, body, headers) to answer the next review submissions with
+        self.failures = []
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = self.server.url
+        self.server.requested_paths.append(self.path)
+        path = urlparse(self.path).path
+
+        if path == "/repos/owner/repo":
+            self.reply(200, {"full_name": "owner/repo", "url": f"{url}/repos/owner/repo"})
+        elif path == "/repos/owner/repo/pulls/1":
+            self.reply(200, {"number": 1, "url": f"{url}/repos/owner/repo/pulls/1"})
+        elif path == "/repos/owner/repo/pulls/1/files":
+            if "page=2" in self.path:
+                self.reply(200, [{"filename": "app.py", "patch": PATCH}])
+            else:
+                self.reply(
+                    200,
+                    [{"filename": "other.py", "patch": "@@ -1 +1 @@\n+other"}],
+                    {"Link": f'<{url}/repos/owner/repo/pulls/1/files?page=2>; rel="next"'},
+                )
+        elif path in ("/repos/owner/repo/pulls/1/comments", "/repos/owner/repo/pulls/1/reviews"):
+            self.reply(200, [])
+        else:
+            self.reply(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        self.server.review_attempts += 1
+        review = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if len(self.server.failures) > 0:
+            self.reply(*self.server.failures.pop(0))
+            return
+
+        self.server.reviews.append(review)
+        self.reply(200, {"id": len(self.server.reviews), "body": review["body"]})
+
+
+@pytest.fixture
+def github_server(monkeypatch):
+    with FakeGitHubServer() as server:
+        monkeypatch.setenv("GITHUB_TOKEN", "token")
+        monkeypatch.setenv("GITHUB_API_URL", server.url)
+        yield server
+
+
+def test_add_pr_comments_through_github_api(tmp_path, github_server):
+    GitHubIntegration().add_pr_comments(get_comments(tmp_path, 2))
+
+    # The second page of changed files (where app.py is) was fetched, so the comments are inline
+    assert any("page=2" in path for path in github_server.requested_paths)
+    (review,) = github_server.reviews
+    assert review["event"] == "COMMENT"
+    assert review["body"].startswith("Code review found 4 comments.")
+    assert review["comments"] == [
+        {"path": "app.py", "line": 1, "body": "Comment 1", "side": "RIGHT"},
+        {"path": "app.py", "line": 2, "body": "Comment 2", "side": "RIGHT"},
+        {
+            "path": "app.py",
+            "line": 4,
+            "body": "Range",
+            "side": "RIGHT",
+            "start_line": 2,
+            "start_side": "RIGHT",
+        },
+    ]
+
+
+@pytest.mark.parametrize(
+    "status, message",
+    [(429, "Too many requests"), (403, "You have exceeded a secondary rate limit")],
+)
+def test_add_pr_comments_waits_out_rate_limits_through_github_api(
+    tmp_path, github_server, environment, status, message
+):
+    github_server.failures = [(status, {"message": message}, {"Retry-After": "7"})]
+
+    GitHubIntegration().add_pr_comments(get_comments(tmp_path, 1))
+
+    assert github_server.review_attempts == 2
+    assert len(github_server.reviews) == 1
+    assert 7 in environment
+
+
+def test_add_pr_comments_does_not_retry_permission_errors_through_github_api(
+    tmp_path, github_server
+):
+    github_server.failures = [(403, {"message": "Resource not accessible by integration"}, {})]
+
+    with pytest.raises(GithubException) as e:
+        GitHubIntegration().add_pr_comments(get_comments(tmp_path, 1))
+
+    assert e.value.status == 403
+    assert github_server.review_attempts == 1
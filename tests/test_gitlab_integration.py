@@ -0,0 +1,273 @@
+import os
+import time
+from types import SimpleNamespace
+
+import gitlab
+import pytest
+
+from integrations.gitlab_integration import GitLabIntegration
+from review.code_comment import CodeComment
+from utilities.git_helper import get_blob_sha
+
+
+class FakeCommits:
+    def __init__(self, branches):
+        self.branches = branches
+        self.created = []
+
+    def create(self, data):
+        # Behaves like GitLab: start_branch is only allowed when the branch doesn't exist yet
+        if "start_branch" in data:
+            if data["branch"] in self.branches:
+                raise gitlab.exceptions.GitlabCreateError(
+                    f"A branch called '{data['branch']}' already exists", 400
+                )
+            self.branches[data["branch"]] = dict(self.branches[data["start_branch"]])
+        elif data["branch"] not in self.branches:
+            raise gitlab.exceptions.GitlabCreateError("You can only create or edit files when you are on a branch", 400)
+
+        self.created.append(data)
+        return SimpleNamespace(id=f"commit{len(self.created)}")
+
+
+class FakeBranches:
+    def __init__(self, branches):
+        self.branches = branches
+
+    def get(self, name):
+        if name not in self.branches:
+            raise gitlab.exceptions.GitlabGetError("404 Branch Not Found", 404)
+        return SimpleNamespace(name=name)
+
+
+class FakeFiles:
+    def __init__(self, branches):
+        self.branches = branches
+        self.heads = []
+
+    def head(self, path, ref):
+        self.heads.append((path, ref))
+        if path not in self.branches[ref]:
+            raise gitlab.exceptions.GitlabHeadError("404 File Not Found", 404)
+        return {"X-Gitlab-Blob-Id": get_blob_sha(self.branches[ref][path].encode("utf-8"))}
+
+
+class FakeProject:
+    def __init__(self, contents):
+        # Branch -> path -> content
+        self.contents = contents
+        self.branches = FakeBranches(contents)
+        self.files = FakeFiles(contents)
+        self.commits = FakeCommits(contents)
+
+
+def get_integration(project, max_commit_size=10 * 1024 * 1024):
+    # Skip the constructor, which talks to the server
+    integration = GitLabIntegration.__new__(GitLabIntegration)
+    integration.project = project
+    integration.max_concurrency = 4
+    integration.max_commit_size = max_commit_size
+    return integration
+
+
+@pytest.fixture(autouse=True)
+def project_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv("CI_PROJECT_DIR", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+
+
+def test_commit_changes_creates_target_branch_once_when_batched():
+    project = FakeProject({"main": {"a.py": "a\n"}})
+    integration = get_integration(project, max_commit_size=20)
+
+    integration.commit_changes(
+        "main",
+        "refactor",
+        "Refactor",
+        [{"file_path": f"{name}.py", "code": name * 10 + "\n"} for name in "bcd"],
+    )
+
+    created = project.commits.created
+    assert len(created) == 3
+    assert created[0]["start_branch"] == "main"
+    assert all("start_branch" not in data for data in created[1:])
+    assert all(data["branch"] == "refactor" for data in created)
+    assert [data["commit_message"] for data in created] == [
+        "Refactor (1 of 3)",
+        "Refactor (2 of 3)",
+        "Refactor (3 of 3)",
+    ]
+
+
+def test_commit_changes_commits_onto_existing_target_branch():
+    project = FakeProject({"main": {"a.py": "a\n"}, "refactor": {"a.py": "a\n", "b.py": "b\n"}})
+    integration = get_integration(project)
+
+    integration.commit_changes(
+        "main",
+        "refactor",
+        "Refactor",
+        [
+            {"file_path": "a.py", "code": "a\n"},
+            {"file_path": "b.py", "code": "b changed\n"},
+            {"file_path": "c.py", "code": "c\n"},
+        ],
+    )
+
+    assert len(project.commits.created) == 1
+    data = project.commits.created[0]
+    assert "start_branch" not in data
+    # Unchanged files are left out, and create/update comes from what's on the target branch
+    assert [(a["action"], a["file_path"]) for a in data["actions"]] == [
+        ("update", "b.py"),
+        ("create", "c.py"),
+    ]
+    # Only the files being committed are looked up, on the branch they're committed to
+    assert sorted(project.files.heads) == [("a.py", "refactor"), ("b.py", "refactor"), ("c.py", "refactor")]
+
+
+def test_commit_changes_skips_commit_when_nothing_changed():
+    project = FakeProject({"main": {"a.py": "a\n"}})
+    integration = get_integration(project)
+
+    integration.commit_changes("main", "refactor", "Refactor", [{"file_path": "a.py", "code": "a\n"}])
+
+    assert project.commits.created == []
+
+
+# Lines 1-2 and 5 are unchanged, 3-4 were added (and the old line 3 removed)
+DIFF = """@@ -1,4 +1,5 @@
+ import os
+ import sys
+-import re
++import json
++import logging
+ 
+"""
+
+
+class FakeDiscussions:
+    def __init__(self):
+        self.notes = []
+        self.attempts = 0
+        # ("start" or "end", body) for every create, in the order they happened
+        self.events = []
+
+    def list(self, get_all):
+        return [SimpleNamespace(attributes={"notes": [note]}) for note in self.notes]
+
+    def create(self, data):
+        # Behaves like GitLab: an unchanged line can only be commented on with its old line number too
+        self.attempts += 1
+        self.events.append(("start", data["body"]))
+        if data["body"].startswith("Code review found"):
+            # Slow enough that anything posted alongside the summary would start before it ended
+            time.sleep(0.05)
+        self.events.append(("end", data["body"]))
+
+        position = data.get("position")
+        if position is not None and position["new_line"] in (1, 2, 5) and "old_line" not in position:
+            raise gitlab.exceptions.GitlabCreateError("400 Bad request - Note {:line_code=>[\"can't be blank\"]}", 400)
+
+        self.notes.append(data)
+        return SimpleNamespace(attributes=data)
+
+
+class FakeMergeRequests:
+    def __init__(self, merge_request):
+        self.merge_request = merge_request
+
+    def get(self, iid):
+        return self.merge_request
+
+
+def get_merge_request_project():
+    merge_request = SimpleNamespace(
+        diff_refs={"base_sha": "base", "start_sha": "start", "head_sha": "head"},
+        changes=lambda: {"changes": [{"old_path": "app.py", "new_path": "app.py", "diff": DIFF}]},
+        discussions=FakeDiscussions(),
+    )
+    return SimpleNamespace(mergerequests=FakeMergeRequests(merge_request)), merge_request
+
+
+def get_comments(tmp_path):
+    path = os.path.join(str(tmp_path), "app.py")
+    return [
+        CodeComment("Unused import", start=1, file_path=path),
+        CodeComment("Prefer orjson", start=3, file_path=path),
+        CodeComment("Outside the diff", start=40, file_path=path),
+    ]
+
+
+def test_add_pr_comments_positions_unchanged_lines(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITLAB_MR_IID", "7")
+    project, merge_request = get_merge_request_project()
+
+    get_integration(project).add_pr_comments(get_comments(tmp_path))
+
+    positions = {
+        note["position"]["new_line"]: note["position"]
+        for note in merge_request.discussions.notes
+        if "position" in note
+    }
+    assert positions[1]["old_line"] == 1
+    assert "old_line" not in positions[3]
+    # The summary, plus the two comments in the diff
+    assert len(merge_request.discussions.notes) == 3
+    assert "Outside the diff" in merge_request.discussions.notes[0]["body"]
+
+
+def test_add_pr_comments_posts_summary_before_line_comments(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITLAB_MR_IID", "7")
+    project, merge_request = get_merge_request_project()
+
+    get_integration(project).add_pr_comments(get_comments(tmp_path))
+
+    # The summary has finished posting before any other discussion is started
+    events = merge_request.discussions.events
+    assert events[0][1].startswith("Code review found")
+    assert events[1] == ("end", events[0][1])
+
+
+def test_add_pr_comments_is_idempotent(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITLAB_MR_IID", "7")
+    project, merge_request = get_merge_request_project()
+    integration = get_integration(project)
+
+    integration.add_pr_comments(get_comments(tmp_path))
+    attempts = merge_request.discussions.attempts
+
+    integration.add_pr_comments(get_comments(tmp_path))
+
+    assert merge_request.discussions.attempts == attempts
+    assert len(merge_request.discussions.notes) == 3
+
+
+def test_add_pr_comments_does_not_repost_unpositioned_fallback(tmp_path, monkeypatch):
+    monkeypatch.setenv("GITLAB_MR_IID", "7")
+    project, merge_request = get_merge_request_project()
+    integration = get_integration(project)
+
+    # GitLab refuses every position, e.g. because the MR moved on since the diff was fetched
+    create = merge_request.discussions.create
+
+    def refuse_positions(data):
+        if "position" in data:
+            merge_request.discussions.attempts += 1
+            raise gitlab.exceptions.GitlabCreateError("400 Bad request - position is invalid", 400)
+        return create(data)
+
+    merge_request.discussions.create = refuse_positions
+
+    integration.add_pr_comments(get_comments(tmp_path))
+    # Posted concurrently, so in any order
+    assert sorted(note["body"] for note in merge_request.discussions.notes[1:]) == [
+        "**app.py** (line 1): Unused import",
+        "**app.py** (line 3): Prefer orjson",
+    ]
+
+    attempts = merge_request.discussions.attempts
+    integration.add_pr_comments(get_comments(tmp_path))
+
+    assert merge_request.discussions.attempts == attempts
+    assert len(merge_request.discussions.notes) == 3
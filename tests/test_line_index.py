@@ -0,0 +1,39 @@
+from utilities.line_index import LineIndex
+
+TEXT = "first\nsecond\n\nfourth"
+
+
+def test_get_line_number_at_boundaries():
+    index = LineIndex(TEXT)
+
+    assert index.get_line_number(0) == 1
+    # The newline ends its line, and the next character starts the next one
+    assert index.get_line_number(TEXT.index("\n")) == 1
+    assert index.get_line_number(TEXT.index("second")) == 2
+    assert index.get_line_number(TEXT.index("\n\n") + 1) == 3
+    assert index.get_line_number(TEXT.index("fourth")) == 4
+    assert index.get_line_number(len(TEXT) - 1) == 4
+
+
+def test_get_line_number_matches_counting_newlines():
+    index = LineIndex(TEXT)
+
+    for offset in range(len(TEXT)):
+        assert index.get_line_number(offset) == TEXT.count("\n", 0, offset) + 1
+
+
+def test_get_line_number_with_first_line_number():
+    index = LineIndex(TEXT, first_line_number=41)
+
+    assert index.get_line_number(0) == 41
+    assert index.get_line_number(TEXT.index("fourth")) == 44
+
+
+def test_get_line_number_for_missing_offset():
+    # str.find gives -1 for something that isn't there
+    assert LineIndex(TEXT, first_line_number=10).get_line_number(-1) == 10
+
+
+def test_trailing_newline_and_empty_text():
+    assert LineIndex("a\n").get_line_number(2) == 2
+    assert LineIndex("").get_line_number(0) == 1
@@ -0,0 +1,67 @@
+import os
+
+from langchain.schema import AIMessage, ChatGeneration, Generation
+
+from utilities.llm_cache import CACHE_FILE_EXTENSION, LLMResponseCache
+
+
+def get_cache_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(CACHE_FILE_EXTENSION))
+
+
+def test_lookup_is_keyed_on_prompt_and_llm(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), 1024 * 1024)
+    cache.update("Review this", "gpt-4 temperature=0", [Generation(text="Looks good")])
+
+    assert [g.text for g in cache.lookup("Review this", "gpt-4 temperature=0")] == ["Looks good"]
+    # A different model (or settings) or prompt is a different entry
+    assert cache.lookup("Review this", "gpt-4 temperature=1") is None
+    assert cache.lookup("Review that", "gpt-4 temperature=0") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_lookup_keeps_generation_types(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), 1024 * 1024)
+    cache.update("p", "chat", [ChatGeneration(message=AIMessage(content="Hi"))])
+    cache.update("p", "text", [Generation(text="Hi")])
+
+    (chat,) = cache.lookup("p", "chat")
+    (text,) = cache.lookup("p", "text")
+    assert isinstance(chat, ChatGeneration) and chat.message.content == "Hi"
+    assert not isinstance(text, ChatGeneration) and text.text == "Hi"
+
+
+def test_update_evicts_least_recently_used(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), 1024 * 1024)
+    for prompt in ["a", "b", "c"]:
+        cache.update(prompt, "llm", [Generation(text=prompt * 100)])
+    # Reading "a" makes "b" the least recently used
+    cache.lookup("a", "llm")
+
+    # Just enough room for two entries
+    cache.max_size_bytes = cache._total_size - 1
+    cache.update("c", "llm", [Generation(text="c" * 100)])
+
+    assert cache.lookup("b", "llm") is None
+    assert cache.lookup("a", "llm") is not None
+    assert len(get_cache_files(str(tmp_path))) == 2
+
+
+def test_cache_survives_restart(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), 1024 * 1024)
+    cache.update("a", "llm", [Generation(text="answer")])
+
+    reloaded = LLMResponseCache(str(tmp_path), 1024 * 1024)
+
+    assert reloaded._total_size == cache._total_size
+    assert [g.text for g in reloaded.lookup("a", "llm")] == ["answer"]
+
+
+def test_unreadable_entry_is_a_miss(tmp_path):
+    cache = LLMResponseCache(str(tmp_path), 1024 * 1024)
+    cache.update("a", "llm", [Generation(text="answer")])
+    (name,) = get_cache_files(str(tmp_path))
+    (tmp_path / name).write_bytes(b"not zlib")
+
+    assert cache.lookup("a", "llm") is None
+    assert get_cache_files(str(tmp_path)) == []
@@ -0,0 +1,67 @@
+import numpy as np
+
+from utilities.numpy_vector_store import NumpyVectorStore, maximal_marginal_relevance
+
+VECTORS = {
+    "query": [1.0, 0.2, 0.0],
+    "parse config": [1.0, 0.0, 0.0],
+    # Nearly the same as "parse config"
+    "parse config again": [0.99, -0.05, 0.0],
+    "load config": [0.6, 0.8, 0.0],
+    "unrelated": [0.0, 0.0, 1.0],
+}
+
+
+class FakeEmbeddings:
+    def embed_documents(self, texts):
+        return [VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return VECTORS[text]
+
+
+def get_store():
+    texts = ["unrelated", "load config", "parse config again", "parse config"]
+    return NumpyVectorStore.from_texts(texts, FakeEmbeddings(), [{"name": t} for t in texts])
+
+
+def test_similarity_search_orders_by_cosine_similarity():
+    results = get_store().similarity_search_with_score("query", k=3)
+
+    assert [d.page_content for d, _ in results] == ["parse config", "parse config again", "load config"]
+    assert results[0][1] > results[1][1] > results[2][1]
+    assert results[0][0].metadata == {"name": "parse config"}
+
+
+def test_mmr_skips_near_duplicates():
+    documents = get_store().max_marginal_relevance_search("query", k=2, fetch_k=4)
+
+    # The second most similar chunk adds nothing over the first, so a more diverse one is picked instead
+    assert [d.page_content for d in documents] == ["parse config", "load config"]
+
+
+def test_mmr_without_diversity_is_similarity_order():
+    documents = get_store().max_marginal_relevance_search("query", k=3, fetch_k=4, lambda_mult=1.0)
+
+    assert [d.page_content for d in documents] == ["parse config", "parse config again", "load config"]
+
+
+def test_mmr_only_picks_from_fetched_candidates():
+    documents = get_store().max_marginal_relevance_search("query", k=4, fetch_k=2)
+
+    assert [d.page_content for d in documents] == ["parse config", "parse config again"]
+
+
+def test_maximal_marginal_relevance_edge_cases():
+    assert maximal_marginal_relevance(np.zeros(0), np.zeros((0, 3)), 4, 0.5) == []
+
+    vectors = np.eye(3, dtype=np.float32)
+    # Orthogonal candidates are all equally diverse, so relevance decides, and k is capped
+    assert maximal_marginal_relevance(np.array([0.9, 0.5, 0.1]), vectors, 10, 0.5) == [0, 1, 2]
+
+
+def test_empty_store():
+    store = NumpyVectorStore(FakeEmbeddings())
+
+    assert store.similarity_search("query") == []
+    assert store.max_marginal_relevance_search("query") == []
@@ -0,0 +1,259 @@
+import os
+
+from langchain.docstore.document import Document
+
+from utilities.embedding_index import get_chunk_id
+from utilities.pgvector_store import PGVectorStore, get_pgvector_index
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchall(self):
+        return self.rows
+
+    def scalar(self):
+        return self.rows[0][0] if len(self.rows) > 0 else None
+
+
+class FakeConnection:
+    """Records the SQL it's given, answering queries from a function of the SQL."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, statement, parameters=None):
+        self.engine.statements.append(" ".join(str(statement).split()))
+        return FakeResult(self.engine.answer(str(statement), parameters))
+
+
+class FakeEngine:
+    def __init__(self, answer=lambda statement, parameters: []):
+        self.answer = answer
+        self.statements = []
+        self.transactions = 0
+
+    def begin(self):
+        self.transactions += 1
+        return FakeConnection(self)
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+def get_store(index_type, engine):
+    # Skip the constructor, which needs sqlalchemy and a database
+    store = PGVectorStore.__new__(PGVectorStore)
+    store.embedding = None
+    store.collection_name = "owner/repo@main"
+    store.table_name = "code_chunks"
+    store.index_type = index_type
+    store.engine = engine
+    store._text = lambda sql: sql
+    store._ivfflat_lists = None
+    store._table_created = False
+    return store
+
+
+def get_search_engine(found, lists=None):
+    """An engine whose searches find found(setting) rows, given the setting made before the search."""
+
+    def answer(statement, parameters):
+        if "reloptions" in statement:
+            return [([f"lists={lists}"] if lists is not None else None,)]
+        if statement.startswith("SELECT document"):
+            previous = engine.statements[-2] if len(engine.statements) > 1 else ""
+            row = ("text", {"source": "a.py"}, 0.5, "[1.0, 0.0]")
+            return [row] * min(parameters["k"], found(previous))
+        return []
+
+    engine = FakeEngine(answer)
+    return engine
+
+
+def get_searches(engine):
+    # The setting each search was made with
+    return [
+        engine.statements[i - 1] if i > 0 and engine.statements[i - 1].startswith("SET") else None
+        for i, s in enumerate(engine.statements)
+        if s.startswith("SELECT document")
+    ]
+
+
+def test_query_raises_hnsw_ef_search_to_fetch_k():
+    engine = get_search_engine(lambda setting: 1000)
+    store = get_store("hnsw", engine)
+
+    rows = store._query([1.0, 0.0], 50, include_embeddings=True)
+
+    # In the same transaction as the search, so it only applies to it
+    assert len(rows) == 50
+    assert engine.transactions == 1
+    assert get_searches(engine) == ["SET LOCAL hnsw.ef_search = 50"]
+
+
+def test_query_widens_hnsw_search_until_k_rows_come_back():
+    # Other collections crowd this one out of everything but an exact search
+    engine = get_search_engine(lambda setting: 10 if "indexscan" in setting else 2)
+    store = get_store("hnsw", engine)
+
+    rows = store._query([1.0, 0.0], 10)
+
+    assert len(rows) == 10
+    assert get_searches(engine) == [
+        "SET LOCAL hnsw.ef_search = 40",
+        "SET LOCAL hnsw.ef_search = 160",
+        "SET LOCAL hnsw.ef_search = 640",
+        "SET LOCAL enable_indexscan = off",
+    ]
+
+
+def test_query_sets_ivfflat_probes_from_lists():
+    engine = get_search_engine(lambda setting: 1000, lists=100)
+    store = get_store("ivfflat", engine)
+
+    store._query([1.0, 0.0], 10)
+    store._query([1.0, 0.0], 10)
+
+    assert get_searches(engine) == ["SET LOCAL ivfflat.probes = 10"] * 2
+    # The lists are only looked up once
+    assert sum("reloptions" in s for s in engine.statements) == 1
+
+
+def test_query_widens_ivfflat_probes_until_exact():
+    engine = get_search_engine(lambda setting: 0, lists=100)
+    store = get_store("ivfflat", engine)
+
+    # A collection with nothing in it still finishes, with an exact search
+    assert store._query([1.0, 0.0], 10) == []
+    assert get_searches(engine) == [
+        "SET LOCAL ivfflat.probes = 10",
+        "SET LOCAL ivfflat.probes = 40",
+        "SET LOCAL ivfflat.probes = 100",
+    ]
+
+
+def test_query_is_exact_without_an_index():
+    engine = get_search_engine(lambda setting: 3)
+    store = get_store("none", engine)
+
+    assert len(store._query([1.0, 0.0], 50)) == 3
+    assert get_searches(engine) == [None]
+
+
+def test_create_table_only_creates_missing_extension_once():
+    engine = FakeEngine(lambda statement, parameters: [(1,)] if "pg_extension" in statement else [])
+    store = get_store("none", engine)
+
+    store._create_table(3)
+    store._create_table(3)
+
+    assert not any("CREATE EXTENSION" in s for s in engine.statements)
+    assert sum("CREATE TABLE" in s for s in engine.statements) == 1
+
+
+def test_create_table_creates_extension_when_missing():
+    engine = FakeEngine()
+    get_store("none", engine)._create_table(3)
+
+    assert "CREATE EXTENSION IF NOT EXISTS vector" in engine.statements
+
+
+def get_ivfflat_engine(rows, lists):
+    def answer(statement, parameters):
+        if "COUNT(*)" in statement:
+            return [(rows,)]
+        if "reloptions" in statement:
+            return [([f"lists={lists}"] if lists is not None else None,)]
+        return []
+
+    return FakeEngine(answer)
+
+
+def test_create_index_rebuilds_outgrown_ivfflat_index():
+    engine = get_ivfflat_engine(rows=5000, lists=1)
+    get_store("ivfflat", engine).create_index()
+
+    assert "DROP INDEX IF EXISTS code_chunks_embedding_ivfflat" in engine.statements
+    assert engine.statements[-1].endswith("WITH (lists = 5)")
+
+
+def test_create_index_keeps_ivfflat_index_that_still_fits():
+    engine = get_ivfflat_engine(rows=5000, lists=4)
+    get_store("ivfflat", engine).create_index()
+
+    assert not any(s.startswith("DROP") for s in engine.statements)
+
+
+def test_create_index_builds_missing_ivfflat_index():
+    engine = get_ivfflat_engine(rows=500, lists=None)
+    get_store("ivfflat", engine).create_index()
+
+    assert not any(s.startswith("DROP") for s in engine.statements)
+    assert engine.statements[-1].endswith("WITH (lists = 1)")
+
+
+class FakeStore:
+    """Just enough of a PGVectorStore for get_pgvector_index."""
+
+    def __init__(self, documents):
+        self.collection_name = "owner/repo@main"
+        self.chunks = {get_chunk_id(d): d for d in documents}
+        self.indexed = False
+
+    def get_sources(self):
+        return {i: d.metadata.get("source") for i, d in self.chunks.items()}
+
+    def delete(self, ids):
+        for i in ids:
+            del self.chunks[i]
+
+    def add_texts(self, texts, metadatas, ids):
+        for text, metadata, i in zip(texts, metadatas, ids):
+            self.chunks[i] = Document(page_content=text, metadata=metadata)
+
+    def create_index(self):
+        self.indexed = True
+
+
+def get_documents(directory, contents):
+    return [
+        Document(page_content=content, metadata={"source": os.path.join(directory, name)})
+        for name, content in contents.items()
+    ]
+
+
+def test_get_pgvector_index_only_removes_chunks_in_scope(tmp_path):
+    directory = str(tmp_path)
+    store = FakeStore(get_documents(directory, {"a.py": "a", "b.py": "b", "c.py": "c"}))
+
+    # A run over just a.py (which changed) mustn't remove the chunks of b.py and c.py
+    get_pgvector_index(
+        get_documents(directory, {"a.py": "a changed"}),
+        store,
+        scope_paths=[os.path.join(directory, "a.py")],
+    )
+
+    assert sorted(d.page_content for d in store.chunks.values()) == ["a changed", "b", "c"]
+    assert store.indexed
+
+
+def test_get_pgvector_index_removes_everything_stale_without_scope(tmp_path):
+    directory = str(tmp_path)
+    store = FakeStore(get_documents(directory, {"a.py": "a", "b.py": "b"}))
+
+    get_pgvector_index(get_documents(directory, {"a.py": "a"}), store)
+
+    assert [d.page_content for d in store.chunks.values()] == ["a"]
+    # Nothing was added, so the index doesn't need touching
+    assert not store.indexed